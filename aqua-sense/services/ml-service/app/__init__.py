@@ -0,0 +1 @@
+"""AquaSense ML Service"""
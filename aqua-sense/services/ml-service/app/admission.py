@@ -0,0 +1,75 @@
+"""
+Request deadlines for load shedding
+
+Callers bound how long a scoring request may take with either header (the
+earlier wins; REQUEST_TIMEOUT applies when neither is sent):
+
+- X-Request-Timeout: seconds from the request reaching the service
+- X-Request-Deadline: absolute Unix time, in seconds
+
+A result delivered after the caller gave up is wasted model time that
+delays everyone queued behind it, so work that cannot finish in time is
+shed instead of queued: requests whose deadline has passed by the time the
+service gets to them are answered 503 before their body is read, scoring
+requests whose estimated queue delay would overrun it are rejected (or
+degraded) up front, and requests still waiting in the fair queue are
+dropped once it passes.
+"""
+
+import math
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from app import metrics
+
+# Monotonic deadline of the current request (None: no deadline), set by DeadlineMiddleware
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+class DeadlineExceeded(Exception):
+    """Raised for work dropped because its request's deadline passed while it was queued"""
+
+def parse_deadline(timeout: Optional[str], deadline: Optional[str], default_timeout: float = 0.0) -> Optional[float]:
+    """Monotonic deadline from X-Request-Timeout / X-Request-Deadline values; raises ValueError for malformed ones"""
+    now = time.monotonic()
+    deadlines = []
+    if timeout is not None:
+        seconds = float(timeout)
+        if not 0 < seconds < math.inf:
+            raise ValueError("X-Request-Timeout must be a positive number of seconds")
+        deadlines.append(now + seconds)
+    elif deadline is None and default_timeout > 0:
+        deadlines.append(now + default_timeout)
+    if deadline is not None:
+        epoch = float(deadline)
+        if not math.isfinite(epoch):
+            raise ValueError("X-Request-Deadline must be a Unix time in seconds")
+        deadlines.append(now + epoch - time.time())
+    return min(deadlines) if deadlines else None
+
+class DeadlineMiddleware:
+    """ASGI middleware reading each request's deadline, and rejecting requests that arrive past it"""
+
+    def __init__(self, app, default_timeout: float = 0.0):
+        self.app = app
+        self.default_timeout = default_timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = Headers(scope=scope)
+        try:
+            deadline = parse_deadline(
+                headers.get("x-request-timeout"), headers.get("x-request-deadline"), self.default_timeout
+            )
+        except ValueError as e:
+            return await JSONResponse({"detail": f"Invalid deadline: {str(e)}"}, status_code=400)(scope, receive, send)
+        if deadline is not None and deadline <= time.monotonic():
+            metrics.observe_shed("deadline_passed")
+            response = JSONResponse({"detail": "Request deadline has passed"}, status_code=503, headers={"Retry-After": "1"})
+            return await response(scope, receive, send)
+        request_deadline.set(deadline)
+        await self.app(scope, receive, send)
@@ -0,0 +1,294 @@
+"""
+Compiled per-tenant alert rule evaluation over alert.alert_rules
+
+Every enabled rule (`metric condition threshold`, e.g. `turbidity greater_than
+10`) is compiled into sorted threshold arrays, one per (metric, condition)
+pair. Within a pair, rules are ordered by (tenant, threshold), so for a reading
+the rules it fires are one contiguous range (two for not_equals) that a
+`searchsorted` finds. A whole batch is evaluated with a handful of vectorized
+searches per pair, and the work grows with the number of alerts produced
+rather than readings x rules.
+
+Rules are refreshed incrementally: only rows whose updated_at moved past the
+last watermark are re-read and the arrays are recompiled off the request path,
+then swapped in with a single assignment. A full reload every
+`full_reload_every` refreshes drops rules that were deleted outright.
+"""
+
+import csv
+import io
+import json
+import logging
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from app.db import Database
+from app.models import FEATURE_NAMES
+
+logger = logging.getLogger(__name__)
+
+# Conditions as stored in alert.alert_rules, with the symbols used in alert messages
+CONDITIONS = ["greater_than", "greater_than_or_equal", "less_than", "less_than_or_equal", "equals", "not_equals"]
+GREATER, GREATER_EQUAL, LESS, LESS_EQUAL, EQUAL, NOT_EQUAL = range(len(CONDITIONS))
+CONDITION_SYMBOLS = [">", ">=", "<", "<=", "==", "!="]
+CONDITION_ALIASES = {
+    "gt": GREATER, ">": GREATER, "above": GREATER,
+    "gte": GREATER_EQUAL, ">=": GREATER_EQUAL,
+    "lt": LESS, "<": LESS, "below": LESS,
+    "lte": LESS_EQUAL, "<=": LESS_EQUAL,
+    "eq": EQUAL, "==": EQUAL, "=": EQUAL, "equal": EQUAL,
+    "ne": NOT_EQUAL, "!=": NOT_EQUAL, "not_equal": NOT_EQUAL,
+}
+
+RULE_COLUMNS = ["id", "tenant_id", "name", "metric", "condition", "threshold", "severity", "enabled", "updated_at"]
+ALERT_COLUMNS = ["id", "rule_id", "sensor_id", "severity", "message", "metadata"]
+
+def parse_condition(condition: str) -> Optional[int]:
+    condition = condition.strip().lower()
+    if condition in CONDITIONS:
+        return CONDITIONS.index(condition)
+    return CONDITION_ALIASES.get(condition)
+
+class _ConditionGroup:
+    """Rules sharing one (metric, condition), ordered by (tenant, threshold)"""
+
+    def __init__(self, metric: int, condition: int, tenants: np.ndarray, thresholds: np.ndarray, rules: np.ndarray):
+        self.metric = metric
+        self.condition = condition
+        self.thresholds = np.unique(thresholds)
+        ranks = np.searchsorted(self.thresholds, thresholds)
+        keys = tenants.astype(np.int64) * len(self.thresholds) + ranks
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.rules = rules[order]
+
+    def fired(self, tenants: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(reading, rule) index pairs for every rule of this group the readings fire"""
+        readings = np.flatnonzero((tenants >= 0) & ~np.isnan(values))
+        width = len(self.thresholds)
+        base = tenants[readings].astype(np.int64) * width
+        values = values[readings]
+
+        lo = np.searchsorted(self.keys, base)
+        hi = np.searchsorted(self.keys, base + width)
+        # Rules of the reading's tenant with threshold < value end at `below`, <= value at `upto`
+        below = np.searchsorted(self.keys, base + np.searchsorted(self.thresholds, values, side="left"))
+        upto = np.searchsorted(self.keys, base + np.searchsorted(self.thresholds, values, side="right"))
+
+        ranges = {
+            GREATER: [(lo, below)],
+            GREATER_EQUAL: [(lo, upto)],
+            LESS: [(upto, hi)],
+            LESS_EQUAL: [(below, hi)],
+            EQUAL: [(below, upto)],
+            NOT_EQUAL: [(lo, below), (upto, hi)],
+        }[self.condition]
+        pairs = [_expand(readings, start, stop) for start, stop in ranges]
+        return (
+            np.concatenate([reading for reading, _ in pairs]),
+            self.rules[np.concatenate([position for _, position in pairs])],
+        )
+
+def _expand(readings: np.ndarray, start: np.ndarray, stop: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Flatten per-reading [start, stop) ranges into (reading, position) pairs"""
+    counts = np.maximum(stop - start, 0)
+    total = int(counts.sum())
+    reading = np.repeat(readings, counts)
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    position = np.repeat(start, counts) + (np.arange(total) - offsets)
+    return reading, position.astype(np.int64)
+
+class FiredRules:
+    """Columnar evaluation result: one (reading, rule) pair per alert, ordered by reading"""
+
+    def __init__(self, reading_index: np.ndarray, rule_index: np.ndarray):
+        order = np.lexsort((rule_index, reading_index))
+        self.reading_index = reading_index[order]
+        self.rule_index = rule_index[order]
+
+    def __len__(self) -> int:
+        return len(self.reading_index)
+
+class CompiledRules:
+    """Immutable snapshot of the enabled rules, laid out for vectorized evaluation"""
+
+    def __init__(self, rules: Dict[str, tuple], tenants: Dict[str, int]):
+        active = []
+        for rule_id, (tenant_id, name, metric, condition, threshold, severity, enabled) in rules.items():
+            if not enabled:
+                continue
+            if metric not in FEATURE_NAMES or parse_condition(condition) is None:
+                logger.debug("Skipping alert rule %s: unsupported %s %s", rule_id, metric, condition)
+                continue
+            active.append((rule_id, tenants[tenant_id], name, FEATURE_NAMES.index(metric),
+                           parse_condition(condition), float(threshold), severity))
+
+        columns = list(zip(*active)) if active else [()] * 7
+        self.rule_ids = np.array(columns[0], dtype=object)
+        self.tenant = np.array(columns[1], dtype=np.int32)
+        self.names = np.array(columns[2], dtype=object)
+        self.metric = np.array(columns[3], dtype=np.int8)
+        self.condition = np.array(columns[4], dtype=np.int8)
+        self.threshold = np.array(columns[5], dtype=np.float64)
+        self.severity = np.array(columns[6], dtype=object)
+        self.tenant_rule_counts = np.bincount(self.tenant, minlength=len(tenants))
+
+        self.groups: List[_ConditionGroup] = []
+        for metric in np.unique(self.metric).tolist():
+            for condition in np.unique(self.condition[self.metric == metric]).tolist():
+                members = np.flatnonzero((self.metric == metric) & (self.condition == condition))
+                self.groups.append(_ConditionGroup(
+                    metric, condition, self.tenant[members], self.threshold[members], members
+                ))
+
+    def __len__(self) -> int:
+        return len(self.rule_ids)
+
+    def evaluate(self, tenants: np.ndarray, features: np.ndarray) -> FiredRules:
+        """Every enabled rule of each reading's tenant (index per reading, -1 for none) against the batch"""
+        readings, rules = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for group in self.groups:
+            reading, rule = group.fired(tenants, features[:, group.metric])
+            readings.append(reading)
+            rules.append(rule)
+        return FiredRules(np.concatenate(readings), np.concatenate(rules))
+
+class AlertRuleEngine:
+    """Keeps the compiled rules in sync with alert.alert_rules and turns fired rules into alerts"""
+
+    def __init__(self, full_reload_every: int = 20):
+        self.rules: Dict[str, tuple] = {}
+        self.tenants: Dict[str, int] = {}
+        self.compiled = CompiledRules({}, {})
+        self.watermark: Optional[datetime] = None
+        self.full_reload_every = full_reload_every
+        self.refreshes = 0
+
+    def tenant_index(self, tenant_id: str) -> int:
+        """Interned index of a tenant, -1 if it has no rules"""
+        return self.tenants.get(str(tenant_id), -1)
+
+    def apply(self, rows: Sequence[tuple], replace: bool = False) -> int:
+        """Upsert alert_rules rows (RULE_COLUMNS order) and recompile; returns the number of changed rules"""
+        rules = {} if replace else dict(self.rules)
+        changed = 0
+        for rule_id, tenant_id, name, metric, condition, threshold, severity, enabled, updated_at in rows:
+            rule = (str(tenant_id), name, metric, condition, threshold, severity, bool(enabled))
+            changed += rules.get(str(rule_id)) != rule
+            rules[str(rule_id)] = rule
+            self.tenants.setdefault(str(tenant_id), len(self.tenants))
+            if updated_at is not None and (self.watermark is None or updated_at > self.watermark):
+                self.watermark = updated_at
+        changed += len(set(self.rules) - set(rules))
+        if changed or replace:
+            self.compiled = CompiledRules(rules, self.tenants)
+        self.rules = rules
+        return changed
+
+    def refresh(self, store: "AlertRuleStore") -> int:
+        """Pick up rules changed since the last refresh (everything on a periodic full reload)"""
+        full = self.watermark is None or self.refreshes % self.full_reload_every == 0
+        self.refreshes += 1
+        changed = self.apply(store.fetch_rules(None if full else self.watermark), replace=full)
+        if changed:
+            logger.info("Alert rules: %d changed, %d enabled across %d tenants",
+                        changed, len(self.compiled), len(self.tenants))
+        return changed
+
+    def evaluate(self, tenant_id: str, features: np.ndarray) -> Tuple[CompiledRules, FiredRules]:
+        """Evaluate one tenant's rules against a batch; returns the snapshot used with the result"""
+        compiled = self.compiled
+        tenants = np.full(len(features), self.tenant_index(tenant_id), dtype=np.int64)
+        return compiled, compiled.evaluate(tenants, features)
+
+def alert_records(
+    compiled: CompiledRules,
+    fired: FiredRules,
+    tenant_id: str,
+    sensor_ids: Sequence[str],
+    timestamps: Sequence[str],
+    features: np.ndarray,
+) -> List[dict]:
+    """alert.alerts rows (plus the rule name) for each fired rule"""
+    values = features[fired.reading_index, compiled.metric[fired.rule_index]].tolist()
+    records = []
+    for reading, rule, value in zip(fired.reading_index.tolist(), fired.rule_index.tolist(), values):
+        metric = FEATURE_NAMES[compiled.metric[rule]]
+        threshold = float(compiled.threshold[rule])
+        records.append({
+            "id": str(uuid.uuid4()),
+            "rule_id": compiled.rule_ids[rule],
+            "rule_name": compiled.names[rule],
+            "sensor_id": sensor_ids[reading],
+            "severity": compiled.severity[rule],
+            "message": f"{compiled.names[rule]}: {metric} {value:g} "
+                       f"{CONDITION_SYMBOLS[compiled.condition[rule]]} {threshold:g}",
+            "metadata": {
+                "tenant_id": tenant_id,
+                "metric": metric,
+                "value": value,
+                "threshold": threshold,
+                "condition": CONDITIONS[compiled.condition[rule]],
+                "reading_timestamp": timestamps[reading],
+                "reading_index": reading,
+            },
+        })
+    return records
+
+class AlertRuleStore(Database):
+    """Reads alert.alert_rules and bulk-inserts alert.alerts"""
+
+    def fetch_rules(self, since: Optional[datetime] = None) -> List[tuple]:
+        """Rules changed at or after `since` (all rules when None), in RULE_COLUMNS order"""
+        return self.fetch_since("alert.alert_rules", RULE_COLUMNS, since)
+
+    def insert_alerts(self, records: List[dict]) -> int:
+        """Bulk insert alert records and commit; returns the rows written
+
+        Alerts whose sensor or rule is not in the database (deleted since the
+        rules were compiled, say) are skipped, as alert.alerts references both.
+        """
+        if not records:
+            return 0
+        cursor = self.write_conn.cursor()
+        try:
+            sensors = self._existing(cursor, "sensor.sensors", {r["sensor_id"] for r in records})
+            rules = self._existing(cursor, "alert.alert_rules", {r["rule_id"] for r in records})
+            rows = [
+                (r["id"], r["rule_id"], r["sensor_id"], r["severity"], r["message"], json.dumps(r["metadata"]))
+                for r in records if r["sensor_id"] in sensors and r["rule_id"] in rules
+            ]
+            if rows and self.is_sqlite:
+                cursor.executemany(
+                    f"INSERT INTO alert.alerts ({', '.join(ALERT_COLUMNS)}) VALUES ({', '.join('?' * len(ALERT_COLUMNS))})",
+                    rows,
+                )
+            elif rows:
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                buffer.seek(0)
+                cursor.copy_expert(f"COPY alert.alerts ({', '.join(ALERT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        except Exception:
+            self.write_conn.rollback()
+            raise
+        self.write_conn.commit()
+        return len(rows)
+
+    def _existing(self, cursor, table: str, ids: Set[str]) -> Set[str]:
+        """The ids (UUIDs, in any spelling) that have a row in `table`"""
+        candidates: Dict[str, List[str]] = {}
+        for row_id in ids:
+            try:
+                candidates.setdefault(str(uuid.UUID(str(row_id))), []).append(row_id)
+            except ValueError:
+                continue
+        if not candidates:
+            return set()
+        cursor.execute(
+            self._sql(f"SELECT id FROM {table} WHERE id IN ({', '.join(['%s'] * len(candidates))})"),
+            self._params(list(candidates)),
+        )
+        return {row_id for row in cursor.fetchall() for row_id in candidates.get(str(row[0]), [])}
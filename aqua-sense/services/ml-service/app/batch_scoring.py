@@ -0,0 +1,196 @@
+"""
+Batch re-scoring of sensor.sensor_readings straight from the database
+
+Streams readings for a time range through a named (server-side) cursor in
+(sensor_id, timestamp) order, scores each fetchmany() chunk with the active
+models and bulk-writes the results to analytics.reading_scores with COPY.
+Every chunk is committed on its own, so an interrupted job can be resumed
+with --resume from the last (sensor_id, timestamp) key that was written.
+
+    python -m app.batch_scoring --start 2024-01-01 --end 2024-02-01 --resume
+
+DATABASE_URL may also be `sqlite:///path/to.db` (or `sqlite://` for memory)
+for local runs and tests, see app/db.py.
+"""
+
+import argparse
+import csv
+import io
+import logging
+import os
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.db import Database
+from app.models import ANOMALY_DETECTOR, MODEL_FACTORIES, MODEL_METHODS, WATER_QUALITY
+from app.registry import ModelRegistry
+
+logger = logging.getLogger(__name__)
+
+READING_COLUMNS = ["sensor_id", "timestamp", "ph", "temperature", "turbidity", "dissolved_oxygen", "conductivity"]
+SCORE_COLUMNS = [
+    "sensor_id", "timestamp", "quality_score", "quality_level", "risk_level", "anomaly_flags", "model_version"
+]
+
+SCORES_DDL = """
+CREATE TABLE IF NOT EXISTS analytics.reading_scores (
+    sensor_id {uuid} NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    quality_score SMALLINT NOT NULL,
+    quality_level VARCHAR(20) NOT NULL,
+    risk_level VARCHAR(20) NOT NULL,
+    anomaly_flags SMALLINT NOT NULL,
+    model_version VARCHAR(50) NOT NULL,
+    scored_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sensor_id, timestamp)
+)
+"""
+
+class ReadingStore(Database):
+    """Reads sensor readings and writes scores over DB-API (psycopg2 or sqlite3)"""
+
+    def ensure_schema(self):
+        cursor = self.write_conn.cursor()
+        cursor.execute(SCORES_DDL.format(uuid="TEXT" if self.is_sqlite else "UUID"))
+        self.write_conn.commit()
+
+    def resume_point(self, start: datetime, end: datetime) -> Optional[Tuple]:
+        """Last (sensor_id, timestamp) key already scored in the range"""
+        cursor = self.write_conn.cursor()
+        cursor.execute(
+            self._sql(
+                "SELECT sensor_id, timestamp FROM analytics.reading_scores "
+                "WHERE timestamp >= %s AND timestamp < %s "
+                "ORDER BY sensor_id DESC, timestamp DESC LIMIT 1"
+            ),
+            self._params([start, end]),
+        )
+        return cursor.fetchone()
+
+    def iter_chunks(
+        self, start: datetime, end: datetime, chunk_size: int, after: Optional[Tuple] = None
+    ) -> Iterator[List[tuple]]:
+        """Stream readings in primary-key order, chunk_size rows at a time"""
+        query = f"SELECT {', '.join(READING_COLUMNS)} FROM sensor.sensor_readings WHERE timestamp >= %s AND timestamp < %s"
+        params = [start, end]
+        if after is not None:
+            query += " AND (sensor_id, timestamp) > (%s, %s)"
+            params += list(after)
+        query += " ORDER BY sensor_id, timestamp"
+
+        if self.is_sqlite:
+            cursor = self.read_conn.cursor()
+        else:
+            cursor = self.read_conn.cursor(name="aquasense_batch_scoring")
+            cursor.itersize = chunk_size
+        cursor.execute(self._sql(query), self._params(params))
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    def write_scores(self, rows: List[tuple]):
+        """Bulk upsert one chunk of scores and commit it"""
+        cursor = self.write_conn.cursor()
+        update = ", ".join(f"{column} = excluded.{column}" for column in SCORE_COLUMNS[2:])
+        upsert = (
+            f"INSERT INTO analytics.reading_scores ({', '.join(SCORE_COLUMNS)}) {{source}} "
+            f"ON CONFLICT (sensor_id, timestamp) DO UPDATE SET {update}, scored_at = CURRENT_TIMESTAMP"
+        )
+        try:
+            if self.is_sqlite:
+                values = upsert.format(source=f"VALUES ({', '.join('?' * len(SCORE_COLUMNS))})")
+                cursor.executemany(values, [self._params(row) for row in rows])
+            else:
+                # COPY into a staging table, then upsert so re-runs over scored ranges are idempotent
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                buffer.seek(0)
+                cursor.execute(
+                    "CREATE TEMP TABLE IF NOT EXISTS reading_scores_staging "
+                    "(LIKE analytics.reading_scores INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+                )
+                cursor.copy_expert(
+                    f"COPY reading_scores_staging ({', '.join(SCORE_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer
+                )
+                cursor.execute(upsert.format(source=f"SELECT {', '.join(SCORE_COLUMNS)} FROM reading_scores_staging"))
+        except Exception:
+            # A chunk is written entirely or not at all, so resume_point never lands inside it
+            self.write_conn.rollback()
+            raise
+        self.write_conn.commit()
+
+def score_rows(registry: ModelRegistry, rows: List[tuple]) -> List[tuple]:
+    """Score one chunk of reading rows into analytics.reading_scores rows"""
+    features = np.array(
+        [[np.nan if value is None else float(value) for value in row[2:]] for row in rows], dtype=np.float64
+    )
+    quality_model = registry.get(WATER_QUALITY)
+    anomaly_detector = registry.get(ANOMALY_DETECTOR)
+    predictions = getattr(quality_model.model, MODEL_METHODS[WATER_QUALITY])(features)
+    flags = getattr(anomaly_detector.model, MODEL_METHODS[ANOMALY_DETECTOR])(features)
+    return [
+        (row[0], row[1], score, quality, risk, mask, quality_model.version)
+        for row, score, quality, risk, mask in zip(
+            rows,
+            predictions.quality_score.tolist(),
+            predictions.quality_level.tolist(),
+            predictions.risk_level.tolist(),
+            flags.mask.tolist(),
+        )
+    ]
+
+def run(
+    store: ReadingStore,
+    registry: ModelRegistry,
+    start: datetime,
+    end: datetime,
+    chunk_size: int = 50_000,
+    resume: bool = False,
+) -> int:
+    """Score every reading in [start, end); returns the number of readings written"""
+    store.ensure_schema()
+    after = store.resume_point(start, end) if resume else None
+    if after is not None:
+        logger.info("Resuming after sensor %s at %s", after[0], after[1])
+
+    written = 0
+    for rows in store.iter_chunks(start, end, chunk_size, after):
+        store.write_scores(score_rows(registry, rows))
+        written += len(rows)
+        logger.info("Scored %d readings (last key %s, %s)", written, rows[-1][0], rows[-1][1])
+    return written
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Re-score sensor.sensor_readings into analytics.reading_scores")
+    parser.add_argument("--start", type=datetime.fromisoformat, required=True, help="inclusive ISO timestamp")
+    parser.add_argument("--end", type=datetime.fromisoformat, required=True, help="exclusive ISO timestamp")
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="continue after the last scored key in the range (use the same --start/--end as the interrupted run)",
+    )
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("DATABASE_URL is not set")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    registry = ModelRegistry(os.getenv("MODEL_PATH", "/app/models"), MODEL_FACTORIES, MODEL_METHODS)
+    registry.refresh()
+
+    store = ReadingStore(args.database_url)
+    try:
+        written = run(store, registry, args.start, args.end, args.chunk_size, args.resume)
+    finally:
+        store.close()
+    logger.info("Done: %d readings scored", written)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Dynamic micro-batching for model calls
+
+Concurrent requests that each carry a handful of readings are coalesced into a
+single model call. A batch is dispatched as soon as it reaches the maximum
+batch size or the oldest request in it has waited the maximum wait time,
+whichever comes first, and each caller gets back its own slice of the result.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, List, Optional, Set, Tuple
+
+import numpy as np
+
+class _Pending:
+    """A request waiting to be batched"""
+
+    __slots__ = ("features", "future", "enqueued_at")
+
+    def __init__(self, features: np.ndarray, future: asyncio.Future):
+        self.features = features
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+class MicroBatcher:
+    """Coalesces concurrent feature batches into one model call
+
+    `fn` is a coroutine function that receives the concatenated feature matrix
+    and returns a `(context, result)` pair, where `result` supports row
+    slicing. Each caller gets `(context, result[its rows])`, so e.g. the model
+    version that produced the batch travels with the slice. Batches are
+    dispatched as separate tasks, so collecting the next batch does not wait
+    for the previous model call to finish.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[np.ndarray], Awaitable[Tuple[Any, Any]]],
+        max_batch_size: int = 1024,
+        max_wait: float = 0.002,
+        history: int = 1024,
+    ):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._carry: Optional[_Pending] = None
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+        self.on_batch: Optional[Callable[[int, int, List[float]], None]] = None
+
+        # Recent batch sizes (rows) and per-request queue waits, for stats()
+        self.batch_sizes: Deque[int] = deque(maxlen=history)
+        self.wait_times: Deque[float] = deque(maxlen=history)
+        self.batches = 0
+        self.requests = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return (self._queue.qsize() if self._queue else 0) + (self._carry is not None)
+
+    async def submit(self, features: np.ndarray) -> Tuple[Any, Any]:
+        """Queue features for the next batch and wait for this request's slice of the result"""
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._carry = None
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Pending(features, future))
+        return await future
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _next(self, timeout: Optional[float]) -> Optional[_Pending]:
+        if self._carry is not None:
+            pending, self._carry = self._carry, None
+            return pending
+        if timeout is None:
+            return await self._queue.get()
+        if timeout <= 0:
+            return self._queue.get_nowait() if not self._queue.empty() else None
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _collect(self) -> List[_Pending]:
+        """Gather requests until the batch is full or the first one has waited max_wait"""
+        first = await self._next(None)
+        batch, rows = [first], len(first.features)
+        deadline = first.enqueued_at + self.max_wait
+        while rows < self.max_batch_size:
+            pending = await self._next(deadline - time.perf_counter())
+            if pending is None:
+                break
+            if rows + len(pending.features) > self.max_batch_size:
+                self._carry = pending
+                break
+            batch.append(pending)
+            rows += len(pending.features)
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            batch = [pending for pending in batch if not pending.future.cancelled()]
+            if not batch:
+                continue
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, batch: List[_Pending]):
+        """Run one coalesced model call and fan the result slices back out"""
+        dispatched_at = time.perf_counter()
+        waits = [dispatched_at - pending.enqueued_at for pending in batch]
+        features = np.concatenate([pending.features for pending in batch])
+        self._record(len(features), waits)
+
+        try:
+            context, result = await self.fn(features)
+        except Exception as e:
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+
+        offset = 0
+        for pending in batch:
+            end = offset + len(pending.features)
+            if not pending.future.done():
+                pending.future.set_result((context, result[offset:end]))
+            offset = end
+
+    def _record(self, rows: int, waits: List[float]):
+        self.batches += 1
+        self.requests += len(waits)
+        self.batch_sizes.append(rows)
+        self.wait_times.extend(waits)
+        if self.on_batch is not None:
+            self.on_batch(rows, len(waits), waits)
+
+    def stats(self) -> dict:
+        """Queue depth plus recent batch size and wait time distribution"""
+        sizes = np.asarray(self.batch_sizes, dtype=np.float64)
+        waits = np.asarray(self.wait_times, dtype=np.float64) * 1000
+
+        def summary(values: np.ndarray) -> dict:
+            if not len(values):
+                return {"mean": 0.0, "p50": 0.0, "p99": 0.0}
+            return {
+                "mean": round(float(values.mean()), 3),
+                "p50": round(float(np.percentile(values, 50)), 3),
+                "p99": round(float(np.percentile(values, 99)), 3),
+            }
+
+        return {
+            "queue_depth": self.queue_depth,
+            "batches": self.batches,
+            "requests": self.requests,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batch_size": summary(sizes),
+            "wait_ms": summary(waits),
+        }
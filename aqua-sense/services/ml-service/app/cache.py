@@ -0,0 +1,177 @@
+"""
+Content-addressed prediction cache
+
+Results are cached per reading under a key derived from the feature vector,
+the model name and the model version, so re-submitted readings (dashboards,
+retried Kafka consumers) skip the model entirely and a new model version never
+sees results of the old one.
+
+Two tiers:
+- L1: an in-process LRU of recent keys
+- L2: Redis (REDIS_URL), read with a single MGET per batch and written with a
+  pipelined SET ... EX. Entries expire after the TTL; size-based eviction is
+  left to Redis' maxmemory-policy (allkeys-lru).
+
+Each cached value is the integer the model result is rebuilt from (quality
+score with its level and risk codes, anomaly bitmask), so the cache never
+stores per-reading dicts; results that do not fit one (custom models) are not
+cached.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_SEEDS = (np.uint64(0x9E3779B97F4A7C15), np.uint64(0xC2B2AE3D27D4EB4F))
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, applied element-wise"""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def row_hashes(features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Two independent 64-bit hashes of every feature row, computed column-wise"""
+    bits = np.ascontiguousarray(features, dtype=np.float64).view(np.uint64)
+    h1 = np.full(len(bits), _SEEDS[0], dtype=np.uint64)
+    h2 = np.full(len(bits), _SEEDS[1], dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for column in bits.T:
+            h1 = _mix(h1 ^ column)
+            h2 = _mix(h2 ^ _mix(column + _SEEDS[1]))
+    return h1, h2
+
+def cache_keys(model_name: str, version: str, features: np.ndarray) -> List[str]:
+    """Cache key of every reading for a given model version"""
+    # Bumped whenever the layout of cached values changes, so old entries are never decoded
+    prefix = f"aqs2:{model_name}:{version}:"
+    h1, h2 = row_hashes(features)
+    return [f"{prefix}{a:016x}{b:016x}" for a, b in zip(h1.tolist(), h2.tolist())]
+
+class InMemoryRedis:
+    """Minimal asyncio Redis stand-in (MGET and pipelined SET EX) for tests and local runs"""
+
+    def __init__(self):
+        self.data: Dict[str, Tuple[bytes, float]] = {}
+
+    async def mget(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        now = time.monotonic()
+        values = []
+        for key in keys:
+            entry = self.data.get(key)
+            if entry is not None and entry[1] <= now:
+                del self.data[key]
+                entry = None
+            values.append(entry[0] if entry else None)
+        return values
+
+    def pipeline(self, transaction: bool = False) -> "_InMemoryPipeline":
+        return _InMemoryPipeline(self)
+
+    async def flushdb(self):
+        self.data.clear()
+
+class _InMemoryPipeline:
+    def __init__(self, redis: InMemoryRedis):
+        self.redis = redis
+        self.commands: List[Tuple[str, bytes, float]] = []
+
+    def set(self, key: str, value, ex: int):
+        self.commands.append((key, str(value).encode(), time.monotonic() + ex))
+        return self
+
+    async def execute(self) -> List[bool]:
+        for key, value, expires_at in self.commands:
+            self.redis.data[key] = (value, expires_at)
+        results = [True] * len(self.commands)
+        self.commands = []
+        return results
+
+class PredictionCache:
+    """Two-tier (in-process LRU + Redis) cache of per-reading model outputs"""
+
+    def __init__(self, redis=None, ttl: int = 3600, l1_size: int = 100_000, max_rows: int = 10_000):
+        self.redis = redis
+        self.ttl = ttl
+        self.l1_size = l1_size
+        self.max_rows = max_rows
+        self._l1: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = {"l1": 0, "l2": 0}
+        self.misses = 0
+
+    def invalidate(self, *_):
+        """Drop the in-process tier (e.g. after a model version swap); L2 keys carry the version"""
+        with self._lock:
+            self._l1.clear()
+
+    async def lookup(self, keys: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Cached values and a hit mask for each key"""
+        values = np.zeros(len(keys), dtype=np.int64)
+        hit = np.zeros(len(keys), dtype=bool)
+
+        missing = []
+        with self._lock:
+            for idx, key in enumerate(keys):
+                value = self._l1.get(key)
+                if value is None:
+                    missing.append(idx)
+                else:
+                    self._l1.move_to_end(key)
+                    values[idx] = value
+                    hit[idx] = True
+        self.hits["l1"] += len(keys) - len(missing)
+
+        if missing and self.redis is not None:
+            try:
+                found = await self.redis.mget([keys[idx] for idx in missing])
+            except Exception as e:
+                logger.warning("Prediction cache L2 lookup failed: %s", e)
+                found = [None] * len(missing)
+            l2_hits = [(idx, int(value)) for idx, value in zip(missing, found) if value is not None]
+            for idx, value in l2_hits:
+                values[idx] = value
+                hit[idx] = True
+            self._put_l1((keys[idx], value) for idx, value in l2_hits)
+            self.hits["l2"] += len(l2_hits)
+
+        self.misses += int(len(keys) - hit.sum())
+        return values, hit
+
+    async def store(self, keys: List[str], values: np.ndarray):
+        """Write freshly computed values to both tiers"""
+        pairs = list(zip(keys, values.tolist()))
+        self._put_l1(pairs)
+        if self.redis is not None and pairs:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for key, value in pairs:
+                    pipe.set(key, value, ex=self.ttl)
+                await pipe.execute()
+            except Exception as e:
+                logger.warning("Prediction cache L2 store failed: %s", e)
+
+    def _put_l1(self, pairs):
+        with self._lock:
+            for key, value in pairs:
+                self._l1[key] = value
+                self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_size:
+                self._l1.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "l1_entries": len(self._l1),
+            "l1_hits": self.hits["l1"],
+            "l2_hits": self.hits["l2"],
+            "misses": self.misses,
+            "l2_backend": type(self.redis).__name__ if self.redis is not None else None,
+        }
@@ -0,0 +1,68 @@
+"""
+Columnar request encoding for the ML service
+
+Batch callers can skip the per-reading JSON objects of the regular endpoints
+and send the feature matrix column by column, either as JSON parallel arrays
+or as a raw binary body that maps straight into a NumPy array.
+
+Binary layout (little-endian):
+    magic       4 bytes   b"AQSC"
+    version     uint16    1
+    n_features  uint16    number of feature columns
+    n_rows      uint32    number of readings
+    payload     n_features blocks of n_rows float64, one block per feature
+"""
+
+import struct
+from typing import List, Sequence
+
+import numpy as np
+
+BINARY_CONTENT_TYPE = "application/vnd.aquasense.columnar"
+MAGIC = b"AQSC"
+VERSION = 1
+HEADER = struct.Struct("<4sHHI")
+FEATURE_DTYPE = np.dtype("<f8")
+
+class ColumnarFormatError(ValueError):
+    """Raised when a columnar request body is malformed"""
+
+def decode_features(body: bytes, n_features: int) -> np.ndarray:
+    """Map a binary columnar body onto an (n_rows, n_features) array without copying"""
+    if len(body) < HEADER.size:
+        raise ColumnarFormatError("body shorter than header")
+
+    magic, version, body_features, n_rows = HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise ColumnarFormatError("bad magic")
+    if version != VERSION:
+        raise ColumnarFormatError(f"unsupported version {version}")
+    if body_features != n_features:
+        raise ColumnarFormatError(f"expected {n_features} features, got {body_features}")
+
+    expected = HEADER.size + n_features * n_rows * FEATURE_DTYPE.itemsize
+    if len(body) != expected:
+        raise ColumnarFormatError(f"expected {expected} bytes, got {len(body)}")
+
+    # Feature blocks are contiguous, so each column is a contiguous view
+    columns = np.frombuffer(body, dtype=FEATURE_DTYPE, count=n_features * n_rows, offset=HEADER.size)
+    return columns.reshape(n_features, n_rows).T
+
+def encode_features(features: np.ndarray) -> bytes:
+    """Encode an (n_rows, n_features) array as a binary columnar body"""
+    features = np.asarray(features, dtype=FEATURE_DTYPE)
+    n_rows, n_features = features.shape
+    return HEADER.pack(MAGIC, VERSION, n_features, n_rows) + np.ascontiguousarray(features.T).tobytes()
+
+def columns_to_features(payload: dict, feature_names: Sequence[str]) -> np.ndarray:
+    """Stack JSON parallel arrays ({"ph": [...], ...}) into a feature matrix"""
+    try:
+        columns: List[np.ndarray] = [np.asarray(payload[name], dtype=np.float64) for name in feature_names]
+    except KeyError as e:
+        raise ColumnarFormatError(f"missing feature column {e.args[0]}")
+    except (TypeError, ValueError) as e:
+        raise ColumnarFormatError(f"invalid feature column: {e}")
+
+    if any(column.ndim != 1 or len(column) != len(columns[0]) for column in columns):
+        raise ColumnarFormatError("feature columns must be flat arrays of equal length")
+    return np.column_stack(columns)
@@ -0,0 +1,468 @@
+"""
+Kafka consumer mode: score sensor readings straight off the ingestion topic
+
+Instead of the sensor-service POSTing every batch, the ML service can consume
+the sensor-reading topic itself:
+
+    python -m app.consumer
+
+Readings are polled in large batches, scored with the active models in one
+call per batch, and the results are published to the predictions topic (every
+reading) and the anomalies topic (flagged readings only), keyed by sensor_id.
+Offsets are committed manually, only after the producer has confirmed every
+result of the batch, so delivery is at-least-once: after a crash or a failed
+publish the uncommitted readings are consumed and scored again.
+
+Messages are JSON SensorReading objects (snake_case fields, as accepted by the
+HTTP API). With DATABASE_URL set, each batch is also folded into the daily
+rollups (app/rollups.py) before its offsets are committed (readings consumed
+again are recognised by (sensor_id, timestamp) and not counted twice), and
+results carry the facility, tenant and location of their sensor
+(app/sensor_registry.py) so downstream consumers can route them per tenant.
+Messages that cannot be decoded, or whose sensor_id is missing (or, with
+rollups, not a UUID), are sent to KAFKA_DEAD_LETTER_TOPIC (when set) and committed with the batch,
+so one bad record cannot stall a partition.
+
+The broker is pluggable: `KafkaBroker` wraps confluent-kafka, and
+`InMemoryBroker` is a stand-in with the same semantics for tests and local runs.
+"""
+
+import abc
+import argparse
+import json
+import logging
+import os
+import signal
+import threading
+import time
+import uuid
+import zlib
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.models import (
+    ANOMALY_DETECTOR, FEATURE_NAMES, FLAG_NAMES, MODEL_FACTORIES, MODEL_METHODS, WATER_QUALITY
+)
+from app.registry import ModelRegistry
+from app.rollups import DailyRollups, RollupStore
+from app.sensor_registry import SensorRegistry, SensorRegistryStore
+
+logger = logging.getLogger(__name__)
+
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
+KAFKA_GROUP_ID = os.getenv("KAFKA_GROUP_ID", "ml-service")
+KAFKA_READINGS_TOPICS = [name for name in os.getenv("KAFKA_READINGS_TOPICS", "sensor-readings").split(",") if name]
+KAFKA_PREDICTIONS_TOPIC = os.getenv("KAFKA_PREDICTIONS_TOPIC", "reading-predictions")
+KAFKA_ANOMALIES_TOPIC = os.getenv("KAFKA_ANOMALIES_TOPIC", "reading-anomalies")
+KAFKA_DEAD_LETTER_TOPIC = os.getenv("KAFKA_DEAD_LETTER_TOPIC", "")
+KAFKA_POLL_BATCH = int(os.getenv("KAFKA_POLL_BATCH", "5000"))
+KAFKA_POLL_TIMEOUT = float(os.getenv("KAFKA_POLL_TIMEOUT", "1.0"))
+
+class Message:
+    """A consumed record and where it came from"""
+
+    __slots__ = ("topic", "partition", "offset", "key", "value")
+
+    def __init__(self, topic: str, partition: int, offset: int, key: Optional[bytes], value: bytes):
+        self.topic = topic
+        self.partition = partition
+        self.offset = offset
+        self.key = key
+        self.value = value
+
+class Broker(abc.ABC):
+    """What the consumer needs from a message broker
+
+    `poll` returns the next records after the consumer's position, `produce`
+    queues an output record, `flush` blocks until every queued record is
+    acknowledged (raising if any failed), `commit` stores the next offset to
+    read per (topic, partition) and `rewind` moves the position back to the
+    last commit, so records that were polled but not committed are redelivered.
+    """
+
+    @abc.abstractmethod
+    def poll(self, max_messages: int, timeout: float) -> List[Message]:
+        """Up to max_messages records, waiting at most timeout seconds for the first"""
+
+    @abc.abstractmethod
+    def produce(self, topic: str, key: Optional[bytes], value: bytes):
+        """Queue a record for delivery"""
+
+    @abc.abstractmethod
+    def flush(self, timeout: float):
+        """Wait until every queued record is acknowledged; raises BrokerError if any failed"""
+
+    @abc.abstractmethod
+    def commit(self, offsets: Dict[Tuple[str, int], int]):
+        """Store the next offset to read of each (topic, partition)"""
+
+    @abc.abstractmethod
+    def rewind(self):
+        """Move every partition back to its last committed offset"""
+
+    def close(self):
+        pass
+
+class BrokerError(RuntimeError):
+    """Publishing or committing failed; the batch has to be consumed again"""
+
+class InMemoryBroker(Broker):
+    """Single-consumer-group, in-process broker with Kafka's offset semantics (tests and local runs)"""
+
+    def __init__(self, topics: Sequence[str], partitions: int = 1):
+        self.topics = list(topics)
+        self.partitions = partitions
+        self.logs: Dict[str, List[List[Message]]] = defaultdict(lambda: [[] for _ in range(partitions)])
+        self.committed: Dict[Tuple[str, int], int] = {}
+        self.position: Dict[Tuple[str, int], int] = {}
+        self._pending: List[Message] = []
+        self._lock = threading.Lock()
+        # Set to make the next flush fail, e.g. to exercise redelivery
+        self.fail_next_flush = False
+
+    def append(self, topic: str, key: Optional[bytes], value: bytes) -> Message:
+        """Write a record straight to a topic log (partitioned by key, like the default partitioner)"""
+        with self._lock:
+            partition = zlib.crc32(key) % self.partitions if key is not None else 0
+            log = self.logs[topic][partition]
+            message = Message(topic, partition, len(log), key, value)
+            log.append(message)
+            return message
+
+    def messages(self, topic: str) -> List[Message]:
+        """Every record in a topic, partition by partition"""
+        return [message for log in self.logs[topic] for message in log]
+
+    def poll(self, max_messages: int, timeout: float) -> List[Message]:
+        batch: List[Message] = []
+        with self._lock:
+            for topic in self.topics:
+                for partition, log in enumerate(self.logs[topic]):
+                    start = self.position.get((topic, partition), self.committed.get((topic, partition), 0))
+                    taken = log[start:start + max_messages - len(batch)]
+                    batch.extend(taken)
+                    self.position[(topic, partition)] = start + len(taken)
+        if not batch and timeout > 0:
+            time.sleep(min(timeout, 0.01))
+        return batch
+
+    def produce(self, topic: str, key: Optional[bytes], value: bytes):
+        self._pending.append(Message(topic, -1, -1, key, value))
+
+    def flush(self, timeout: float):
+        pending, self._pending = self._pending, []
+        if self.fail_next_flush:
+            self.fail_next_flush = False
+            raise BrokerError(f"{len(pending)} records were not delivered")
+        for message in pending:
+            self.append(message.topic, message.key, message.value)
+
+    def commit(self, offsets: Dict[Tuple[str, int], int]):
+        with self._lock:
+            self.committed.update(offsets)
+
+    def rewind(self):
+        with self._lock:
+            self._pending = []
+            self.position.clear()
+
+class KafkaBroker(Broker):
+    """confluent-kafka consumer (manual commits) and idempotent producer"""
+
+    def __init__(self, bootstrap_servers: str, group_id: str, topics: Sequence[str]):
+        import confluent_kafka
+
+        self._kafka = confluent_kafka
+        self.consumer = confluent_kafka.Consumer({
+            "bootstrap.servers": bootstrap_servers,
+            "group.id": group_id,
+            "enable.auto.commit": False,
+            "auto.offset.reset": "earliest",
+            "fetch.min.bytes": 1 << 16,
+            "fetch.wait.max.ms": 100,
+        })
+        self.producer = confluent_kafka.Producer({
+            "bootstrap.servers": bootstrap_servers,
+            "enable.idempotence": True,
+            "linger.ms": 5,
+            "compression.type": "lz4",
+        })
+        self.consumer.subscribe(list(topics))
+        self._errors: List[str] = []
+
+    def _on_delivery(self, error, message):
+        if error is not None:
+            self._errors.append(f"{message.topic()}: {error}")
+
+    def poll(self, max_messages: int, timeout: float) -> List[Message]:
+        batch = []
+        for record in self.consumer.consume(num_messages=max_messages, timeout=timeout):
+            if record.error() is not None:
+                if record.error().code() != self._kafka.KafkaError._PARTITION_EOF:
+                    logger.warning("Consumer error: %s", record.error())
+                continue
+            batch.append(Message(record.topic(), record.partition(), record.offset(), record.key(), record.value()))
+        return batch
+
+    def produce(self, topic: str, key: Optional[bytes], value: bytes):
+        while True:
+            try:
+                self.producer.produce(topic, value=value, key=key, on_delivery=self._on_delivery)
+                return
+            except BufferError:
+                # Local queue is full: serve delivery callbacks until there is room
+                self.producer.poll(0.1)
+
+    def flush(self, timeout: float):
+        remaining = self.producer.flush(timeout)
+        errors, self._errors = self._errors, []
+        if remaining or errors:
+            raise BrokerError(f"{remaining} records undelivered, {len(errors)} failed: {'; '.join(errors[:5])}")
+
+    def commit(self, offsets: Dict[Tuple[str, int], int]):
+        partitions = [
+            self._kafka.TopicPartition(topic, partition, offset) for (topic, partition), offset in offsets.items()
+        ]
+        try:
+            self.consumer.commit(offsets=partitions, asynchronous=False)
+        except self._kafka.KafkaException as e:
+            raise BrokerError(f"Offset commit failed: {e}") from e
+
+    def rewind(self):
+        assigned = self.consumer.assignment()
+        for committed in self.consumer.committed(assigned):
+            if committed.offset >= 0:
+                self.consumer.seek(committed)
+            else:
+                # Nothing committed yet: back to where auto.offset.reset starts
+                committed.offset = self._kafka.OFFSET_BEGINNING
+                self.consumer.seek(committed)
+
+    def close(self):
+        self.producer.flush(10)
+        self.consumer.close()
+
+class ReadingConsumer:
+    """Polls readings, scores each batch and publishes the results before committing"""
+
+    def __init__(
+        self,
+        broker: Broker,
+        registry: ModelRegistry,
+        predictions_topic: str = KAFKA_PREDICTIONS_TOPIC,
+        anomalies_topic: str = KAFKA_ANOMALIES_TOPIC,
+        dead_letter_topic: str = KAFKA_DEAD_LETTER_TOPIC,
+        batch_size: int = KAFKA_POLL_BATCH,
+        poll_timeout: float = KAFKA_POLL_TIMEOUT,
+        flush_timeout: float = 30.0,
+        rollup_store: Optional[RollupStore] = None,
+        sensor_registry_store: Optional[SensorRegistryStore] = None,
+    ):
+        self.broker = broker
+        self.registry = registry
+        self.predictions_topic = predictions_topic
+        self.anomalies_topic = anomalies_topic
+        self.dead_letter_topic = dead_letter_topic
+        self.batch_size = batch_size
+        self.poll_timeout = poll_timeout
+        self.flush_timeout = flush_timeout
+        self.rollup_store = rollup_store
+        self.sensor_registry_store = sensor_registry_store
+        self.sensor_registry = SensorRegistry()
+        self.stopping = threading.Event()
+        self.consumed = 0
+        self.invalid = 0
+        self.anomalies = 0
+        self.redeliveries = 0
+
+    def decode(self, messages: List[Message]) -> Tuple[List[dict], np.ndarray, List[Message]]:
+        """Parsed readings and their feature matrix, plus the messages that could not be parsed
+
+        A reading needs every feature, an ISO timestamp and a sensor_id (the key
+        of its results), which must be a UUID when rollups are stored.
+        """
+        readings, rows, invalid = [], [], []
+        for message in messages:
+            try:
+                reading = json.loads(message.value)
+                row = [float(reading[name]) for name in FEATURE_NAMES]
+                datetime.fromisoformat(reading["timestamp"])
+                sensor_id = str(reading["sensor_id"])
+                if self.rollup_store is not None:
+                    uuid.UUID(sensor_id)
+                rows.append(row)
+                readings.append(reading)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.debug("Invalid reading at %s[%d]@%d: %s", message.topic, message.partition, message.offset, e)
+                invalid.append(message)
+        return readings, np.array(rows, dtype=np.float64).reshape(-1, len(FEATURE_NAMES)), invalid
+
+    def publish_results(self, readings: List[dict], features: np.ndarray) -> int:
+        """Score a batch and queue one prediction per reading and one anomaly per flagged reading"""
+        quality_model = self.registry.get(WATER_QUALITY)
+        anomaly_detector = self.registry.get(ANOMALY_DETECTOR)
+        predictions = getattr(quality_model.model, MODEL_METHODS[WATER_QUALITY])(features)
+        flags = getattr(anomaly_detector.model, MODEL_METHODS[ANOMALY_DETECTOR])(features)
+        if self.sensor_registry.loaded:
+            enrichment = self.sensor_registry.enrich([str(r.get("sensor_id")) for r in readings]).to_dicts()
+        else:
+            enrichment = [{}] * len(readings)
+
+        for reading, score, quality, risk, mask, fields in zip(
+            readings,
+            predictions.quality_score.tolist(),
+            predictions.quality_level.tolist(),
+            predictions.risk_level.tolist(),
+            flags.mask.tolist(),
+            enrichment,
+        ):
+            sensor_id = reading.get("sensor_id")
+            self.broker.produce(self.predictions_topic, str(sensor_id).encode(), json.dumps({
+                "sensor_id": sensor_id,
+                "timestamp": reading.get("timestamp"),
+                "quality_score": score,
+                "quality_level": quality,
+                "risk_level": risk,
+                "anomaly_flags": mask,
+                "model_version": quality_model.version,
+                **fields,
+            }).encode())
+
+        indices = flags.indices
+        for idx, mask, severity in zip(
+            indices.tolist(), flags.mask[indices].tolist(), flags.severity(indices).tolist()
+        ):
+            reading = readings[idx]
+            sensor_id = reading.get("sensor_id")
+            self.broker.produce(self.anomalies_topic, str(sensor_id).encode(), json.dumps({
+                "sensor_id": sensor_id,
+                "timestamp": reading.get("timestamp"),
+                "anomaly_types": FLAG_NAMES[mask],
+                "severity": severity,
+                "reading": {name: reading.get(name) for name in FEATURE_NAMES},
+                "model_version": anomaly_detector.version,
+                **enrichment[idx],
+            }).encode())
+        return len(indices)
+
+    def process(self, messages: List[Message]):
+        """Score, publish and commit one polled batch; raises BrokerError if it must be consumed again"""
+        readings, features, invalid = self.decode(messages)
+        anomalies = self.publish_results(readings, features) if readings else 0
+        if self.dead_letter_topic:
+            for message in invalid:
+                self.broker.produce(self.dead_letter_topic, message.key, message.value)
+
+        # Results and rollups must be stored before the readings are committed (at-least-once)
+        self.broker.flush(self.flush_timeout)
+        if self.rollup_store is not None and readings:
+            rollups = DailyRollups()
+            rollups.add([r["sensor_id"] for r in readings], [r["timestamp"] for r in readings], features)
+            try:
+                rollups.flush(self.rollup_store)
+            except Exception as e:
+                raise BrokerError(f"Rollup merge failed: {e}") from e
+        offsets: Dict[Tuple[str, int], int] = {}
+        for message in messages:
+            key = (message.topic, message.partition)
+            offsets[key] = max(offsets.get(key, 0), message.offset + 1)
+        self.broker.commit(offsets)
+
+        self.consumed += len(readings)
+        self.invalid += len(invalid)
+        self.anomalies += anomalies
+
+    def run_once(self) -> int:
+        """Poll and process one batch; returns the number of messages handled"""
+        messages = self.broker.poll(self.batch_size, self.poll_timeout)
+        if not messages:
+            return 0
+        try:
+            self.process(messages)
+        except BrokerError as e:
+            logger.error("Redelivering %d readings: %s", len(messages), e)
+            self.redeliveries += 1
+            self.broker.rewind()
+            return 0
+        return len(messages)
+
+    def refresh_sensor_registry(self):
+        if self.sensor_registry_store is None:
+            return
+        try:
+            self.sensor_registry.refresh(self.sensor_registry_store)
+        except Exception as e:
+            logger.error("Sensor registry refresh failed: %s", e)
+
+    def run(self, reload_interval: float = 30.0):
+        """Consume until stop() is called, picking up new model versions and sensors between batches"""
+        self.refresh_sensor_registry()
+        last_reload = time.monotonic()
+        last_report, reported = time.monotonic(), 0
+        while not self.stopping.is_set():
+            self.run_once()
+            now = time.monotonic()
+            if reload_interval > 0 and now - last_reload >= reload_interval:
+                self.registry.refresh()
+                self.refresh_sensor_registry()
+                last_reload = now
+            if now - last_report >= 60:
+                rate = (self.consumed - reported) / (now - last_report)
+                logger.info("Scored %d readings (%.0f/s), %d anomalies, %d invalid, %d redeliveries",
+                            self.consumed, rate, self.anomalies, self.invalid, self.redeliveries)
+                last_report, reported = now, self.consumed
+
+    def stop(self):
+        self.stopping.set()
+
+    def stats(self) -> dict:
+        return {
+            "consumed": self.consumed,
+            "invalid": self.invalid,
+            "anomalies": self.anomalies,
+            "redeliveries": self.redeliveries,
+        }
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Score sensor readings from Kafka and publish the results")
+    parser.add_argument("--bootstrap-servers", default=KAFKA_BOOTSTRAP_SERVERS)
+    parser.add_argument("--group-id", default=KAFKA_GROUP_ID)
+    parser.add_argument("--topics", default=",".join(KAFKA_READINGS_TOPICS), help="comma-separated input topics")
+    parser.add_argument("--batch-size", type=int, default=KAFKA_POLL_BATCH)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    registry = ModelRegistry(os.getenv("MODEL_PATH", "/app/models"), MODEL_FACTORIES, MODEL_METHODS)
+    registry.refresh()
+
+    broker = KafkaBroker(args.bootstrap_servers, args.group_id, [t for t in args.topics.split(",") if t])
+    rollup_store = sensor_registry_store = None
+    if os.getenv("DATABASE_URL"):
+        sensor_registry_store = SensorRegistryStore(os.environ["DATABASE_URL"])
+        if os.getenv("ROLLUPS_ENABLED", "true").lower() == "true":
+            rollup_store = RollupStore(os.environ["DATABASE_URL"])
+            rollup_store.ensure_schema()
+    consumer = ReadingConsumer(
+        broker,
+        registry,
+        batch_size=args.batch_size,
+        rollup_store=rollup_store,
+        sensor_registry_store=sensor_registry_store,
+    )
+    signal.signal(signal.SIGTERM, lambda *_: consumer.stop())
+    try:
+        consumer.run(float(os.getenv("MODEL_RELOAD_INTERVAL", "30")))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.close()
+        for store in (rollup_store, sensor_registry_store):
+            if store is not None:
+                store.close()
+    logger.info("Stopped: %s", consumer.stats())
+
+if __name__ == "__main__":
+    main()
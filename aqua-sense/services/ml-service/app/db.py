@@ -0,0 +1,92 @@
+"""
+Database access shared by the ML service's batch jobs and background loaders
+
+`Database` wraps a DB-API connection to the platform's PostgreSQL database
+(psycopg2), or to SQLite for local runs and tests: DATABASE_URL may be
+`sqlite:///path/to.db` (or `sqlite://` for memory), in which case the
+platform's schemas are emulated with attached databases, so the same
+schema-qualified SQL runs on both. Reads and writes use separate connections,
+except on an in-memory SQLite database, which only its own connection sees.
+"""
+
+import sqlite3
+from datetime import date, datetime
+from typing import List, Optional, Sequence, Tuple
+
+# Schemas from init.sql that are emulated with ATTACH on SQLite
+SCHEMAS = ("sensor", "alert", "analytics", "tenant")
+
+class Database:
+    """Read and write connections over DB-API (psycopg2 or sqlite3)"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.is_sqlite = url.startswith("sqlite://")
+        if self.is_sqlite:
+            # SQLAlchemy-style: sqlite:///relative.db, sqlite:////absolute.db, sqlite:// for memory
+            path = url[len("sqlite:///"):] or ":memory:"
+            self.write_conn = self._connect_sqlite(path)
+            self.read_conn = self.write_conn if path == ":memory:" else self._connect_sqlite(path)
+        else:
+            import psycopg2
+            # Named cursors live inside the reader's transaction, so writes need their own connection
+            self.read_conn = psycopg2.connect(url)
+            self.write_conn = psycopg2.connect(url)
+
+    @staticmethod
+    def _connect_sqlite(path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        for schema in SCHEMAS:
+            attached = ":memory:" if path == ":memory:" else f"{path}.{schema}"
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (attached,))
+        return conn
+
+    def _sql(self, query: str) -> str:
+        return query.replace("%s", "?") if self.is_sqlite else query
+
+    def _params(self, params: Sequence) -> Tuple:
+        if self.is_sqlite:
+            return tuple(
+                p.isoformat(sep=" ") if isinstance(p, datetime) else p.isoformat() if isinstance(p, date) else p
+                for p in params
+            )
+        return tuple(params)
+
+    def fetch_since(self, table: str, columns: List[str], since: Optional[datetime] = None) -> List[tuple]:
+        """Rows of `table` changed at or after `since` (all rows when None); `columns` ends with updated_at"""
+        query = f"SELECT {', '.join(columns)} FROM {table}"
+        params = []
+        if since is not None:
+            # >= rather than >: rows committed later with the same updated_at are re-read, not missed
+            query += " WHERE updated_at >= %s"
+            params.append(since)
+        rows = self.read(query, params)
+        if self.is_sqlite:
+            rows = [row[:-1] + (datetime.fromisoformat(row[-1]) if row[-1] else None,) for row in rows]
+        return rows
+
+    def read(self, query: str, params: Sequence = ()) -> List[tuple]:
+        """All rows of a query on the read connection, ending its transaction"""
+        cursor = self.read_conn.cursor()
+        try:
+            cursor.execute(self._sql(query), self._params(params))
+            rows = cursor.fetchall()
+        except Exception:
+            # Leave the connection usable for the next read
+            self._end_read(self.read_conn.rollback)
+            raise
+        finally:
+            cursor.close()
+        self._end_read(self.read_conn.commit)
+        return rows
+
+    def _end_read(self, end):
+        # A connection shared with writes (in-memory SQLite) opens no transaction for a SELECT,
+        # and ending one here would commit or roll back a write in progress on another thread
+        if self.read_conn is not self.write_conn:
+            end()
+
+    def close(self):
+        self.read_conn.close()
+        if self.write_conn is not self.read_conn:
+            self.write_conn.close()
@@ -0,0 +1,124 @@
+"""
+Executor layer for CPU-bound scoring
+
+Model calls on small batches stay inline on the event loop, where a thread
+hop would cost more than the work itself. Larger batches are moved off the
+loop so /health and other requests keep being served:
+
+- "thread": a thread pool; the vectorized NumPy paths release the GIL
+- "process": a process pool; the feature matrix is handed over through
+  multiprocessing.shared_memory instead of being pickled, and each worker
+  keeps its own model registry over the same MODEL_PATH artifacts
+- "inline": everything on the event loop (for debugging and benchmarks)
+"""
+
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+from app.models import MODEL_FACTORIES, MODEL_METHODS
+from app.registry import ModelRegistry
+
+EXECUTOR_MODES = ("inline", "thread", "process")
+
+# Per-process registry used by process pool workers
+_worker_registry: Optional[ModelRegistry] = None
+_worker_reload_interval = 0.0
+_worker_refreshed_at = 0.0
+
+def _init_worker(models_root: str, reload_interval: float):
+    global _worker_registry, _worker_reload_interval, _worker_refreshed_at
+    _worker_registry = ModelRegistry(models_root, MODEL_FACTORIES, MODEL_METHODS)
+    _worker_registry.refresh()
+    _worker_reload_interval = reload_interval
+    _worker_refreshed_at = time.monotonic()
+
+def _score_shared(name: str, shm_name: str, shape: Tuple[int, ...], dtype: str) -> Tuple[str, Any]:
+    """Score a feature matrix that lives in a shared memory block (runs in a worker process)"""
+    global _worker_refreshed_at
+    if _worker_reload_interval > 0 and time.monotonic() - _worker_refreshed_at > _worker_reload_interval:
+        _worker_registry.refresh()
+        _worker_refreshed_at = time.monotonic()
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        features = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        entry = _worker_registry.get(name)
+        result = getattr(entry.model, MODEL_METHODS[name])(features)
+        del features
+        return entry.version, result
+    finally:
+        shm.close()
+
+class ScoringExecutor:
+    """Runs model calls inline, on a thread pool or on a process pool depending on batch size"""
+
+    def __init__(
+        self,
+        registry: ModelRegistry,
+        mode: str = "thread",
+        workers: Optional[int] = None,
+        inline_max_rows: int = 5000,
+        reload_interval: float = 30.0,
+    ):
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"executor mode must be one of {EXECUTOR_MODES}, got {mode!r}")
+        self.registry = registry
+        self.mode = mode
+        self.workers = workers or multiprocessing.cpu_count()
+        self.inline_max_rows = inline_max_rows
+        self.reload_interval = reload_interval
+        self._pool: Optional[Executor] = None
+
+    @property
+    def pool(self) -> Executor:
+        if self._pool is None:
+            if self.mode == "process":
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.registry.root, self.reload_interval),
+                )
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scoring")
+        return self._pool
+
+    def score_inline(self, name: str, features: np.ndarray) -> Tuple[str, Any]:
+        """Score with the active model in this process; returns (model version, result)"""
+        entry = self.registry.get(name)
+        return entry.version, getattr(entry.model, MODEL_METHODS[name])(features)
+
+    async def score(self, name: str, features: np.ndarray, offload: bool = False) -> Tuple[str, Any]:
+        """Score features with the named model, off the event loop for large batches
+
+        `offload` moves even small batches off the loop, for models where one
+        row is expensive (a whole image).
+        """
+        if self.mode == "inline" or (not offload and len(features) <= self.inline_max_rows):
+            return self.score_inline(name, features)
+
+        loop = asyncio.get_running_loop()
+        if self.mode == "thread":
+            return await loop.run_in_executor(self.pool, self.score_inline, name, features)
+
+        features = np.ascontiguousarray(features)
+        shm = shared_memory.SharedMemory(create=True, size=max(features.nbytes, 1))
+        try:
+            np.ndarray(features.shape, dtype=features.dtype, buffer=shm.buf)[...] = features
+            return await loop.run_in_executor(
+                self.pool, _score_shared, name, shm.name, features.shape, features.dtype.str
+            )
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,323 @@
+"""
+Per-tenant rate limits and weighted fair queuing of model execution
+
+Every scoring request is charged to a tenant (X-Tenant-ID, or the tenant
+owning its sensors) and costs one unit per reading:
+
+- rate limits: each known tenant has a token bucket refilled at its plan's
+  readings per second, holding up to `burst_seconds` of them. Request/response
+  endpoints are rejected when the bucket cannot cover them (or are larger
+  than the whole burst); streams are paced instead, so a backfill slows down
+  rather than fails.
+- fair queuing: at most `max_rows` readings are scored at a time. Requests
+  beyond that wait in one queue ordered by virtual finish tag: a tenant's
+  request is tagged `cost / weight` after the later of the current virtual
+  time and its previous request's tag. Under contention tenants get model
+  time in proportion to their plan weight, and a bulk backlog only pushes
+  back its own tenant's requests, so small interactive requests of other
+  tenants skip ahead of it.
+
+Tenants the sensor registry does not know share one anonymous entry, so
+arbitrary X-Tenant-ID values cannot grow the per-tenant state. It is not
+rate limited: untagged callers would otherwise throttle each other.
+
+The scheduler also measures its throughput (readings completed per second
+while any are in flight), so the delay a new request would see can be
+estimated from the readings that would be scored before it; requests given
+a deadline stop waiting for their turn once it passes.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app import metrics
+from app.admission import DeadlineExceeded
+
+def parse_plan_values(spec: str) -> Dict[str, float]:
+    """Parse "plan:value,plan:value" (e.g. TENANT_PLAN_WEIGHTS)"""
+    values = {}
+    for item in spec.split(","):
+        if item.strip():
+            plan, _, value = item.partition(":")
+            values[plan.strip()] = float(value)
+    return values
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second, holding at most `burst` tokens"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, cost: float) -> float:
+        """Take `cost` tokens, or return how many seconds until they are available (taking none)
+
+        Returns math.inf for a cost larger than the burst, which can never be covered.
+        """
+        if self.rate <= 0:
+            return 0.0
+        if cost > self.burst:
+            return math.inf
+        self._refill(time.monotonic())
+        if self.tokens < cost:
+            return (cost - self.tokens) / self.rate
+        self.tokens -= cost
+        return 0.0
+
+    def reserve(self, cost: float) -> float:
+        """Take `cost` tokens, going into debt if needed; returns seconds to wait before using them"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(time.monotonic())
+        self.tokens -= cost
+        return max(0.0, -self.tokens / self.rate)
+
+class TenantState:
+    """Plan, rate limit, fair-queue tag and queue wait history of one tenant"""
+
+    def __init__(self, tenant_id: str, history: int):
+        self.tenant_id = tenant_id
+        self.plan: Optional[str] = None
+        self.weight = 1.0
+        self.bucket = TokenBucket(0.0, 0.0)
+        self.finish = 0.0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.wait_times: Deque[float] = deque(maxlen=history)
+
+class FairScheduler:
+    """Token-bucket admission and weighted fair queuing of scoring requests across tenants
+
+    `plan_of` returns a tenant's plan, or None for tenants that are not
+    known (pooled as anonymous, with the default plan's weight and no rate
+    limit); plans missing from `weights` / `rates` get weight 1 and no rate
+    limit. Throughput is re-estimated after every `throughput_window` seconds
+    spent scoring.
+    """
+
+    def __init__(
+        self,
+        plan_of: Callable[[str], Optional[str]],
+        weights: Dict[str, float],
+        rates: Dict[str, float],
+        default_plan: str = "basic",
+        max_rows: int = 8192,
+        burst_seconds: float = 5.0,
+        max_tenants: int = 10_000,
+        history: int = 1024,
+        throughput_window: float = 1.0,
+    ):
+        self.plan_of = plan_of
+        self.weights = weights
+        self.rates = rates
+        self.default_plan = default_plan
+        self.max_rows = max_rows
+        self.burst_seconds = burst_seconds
+        self.max_tenants = max_tenants
+        self.history = history
+        self.throughput_window = throughput_window
+        self.tenants: Dict[str, TenantState] = {}
+        self.in_flight = 0
+        self.virtual_time = 0.0
+        # Readings completed per second spent scoring (EWMA); None until first measured
+        self.throughput: Optional[float] = None
+        self._busy = 0.0
+        self._completed = 0
+        self._busy_mark = time.monotonic()
+        self._queue: List[Tuple[float, int, float, int, asyncio.Future, TenantState, Optional[float]]] = []
+        self._seq = itertools.count()
+
+    def tenant(self, tenant_id: str) -> TenantState:
+        """State of a tenant, picking up plan changes"""
+        plan = self.plan_of(tenant_id) if tenant_id else None
+        if plan is None or (tenant_id not in self.tenants and len(self.tenants) >= self.max_tenants):
+            tenant_id, plan = "", None
+        state = self.tenants.get(tenant_id)
+        if state is None:
+            state = self.tenants[tenant_id] = TenantState(tenant_id, self.history)
+        plan = plan or self.default_plan
+        if state.plan != plan:
+            rate = self.rates.get(plan, 0.0) if tenant_id else 0.0
+            state.bucket.rate, state.bucket.burst = rate, rate * self.burst_seconds
+            state.bucket.tokens = state.bucket.burst if state.plan is None else min(state.bucket.tokens, state.bucket.burst)
+            state.plan = plan
+            state.weight = self.weights.get(plan, 1.0)
+        return state
+
+    def admit(self, tenant_id: str, cost: int) -> float:
+        """Charge a request to its tenant's rate limit; returns 0, or seconds to retry after when rejected"""
+        state = self.tenant(tenant_id)
+        retry_after = state.bucket.take(cost)
+        if retry_after > 0:
+            state.rejected += 1
+            metrics.observe_tenant_rejected(state.plan)
+        else:
+            state.admitted += 1
+        return retry_after
+
+    async def pace(self, tenant_id: str, cost: int):
+        """Charge streamed work to its tenant's rate limit, waiting until it is within the limit"""
+        state = self.tenant(tenant_id)
+        state.admitted += 1
+        delay = state.bucket.reserve(cost)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def expected_delay(self, tenant_id: str, cost: int) -> float:
+        """Estimated seconds until a request of `cost` readings would be scored, at the measured throughput
+
+        Counts the readings in flight and those queued with an earlier tag
+        than the request would get, so a tenant's own backlog delays only it.
+        """
+        if not self.throughput:
+            return 0.0
+        state = self.tenant(tenant_id)
+        finish = max(self.virtual_time, state.finish) + cost / state.weight
+        ahead = sum(
+            queued_cost
+            for queued_finish, _, _, queued_cost, future, _, _ in self._queue
+            if queued_finish <= finish and not future.done()
+        )
+        return (self.in_flight + ahead + cost) / self.throughput
+
+    @asynccontextmanager
+    async def turn(self, tenant_id: str, cost: int, deadline: Optional[float] = None):
+        """Wait until it is this tenant's turn to score `cost` readings, holding them in flight for the block
+
+        Raises DeadlineExceeded if the turn has not come by `deadline` (time.monotonic()).
+        """
+        state = self.tenant(tenant_id)
+        start = max(self.virtual_time, state.finish)
+        tag = cost / state.weight
+        state.finish = start + tag
+        enqueued_at = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (state.finish, next(self._seq), start, cost, future, state, deadline))
+        self._dispatch()
+        if not future.done():
+            state.queued += 1
+            try:
+                timeout = None if deadline is None else deadline - time.monotonic()
+                await asyncio.wait([future], timeout=timeout)
+                if not future.done():
+                    future.cancel()
+                if future.cancelled():
+                    self._withdraw(state, tag)
+                    state.expired += 1
+                    metrics.observe_shed("deadline_passed")
+                    raise DeadlineExceeded("Request deadline passed while queued for scoring")
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Granted just as the caller gave up; hand the rows back
+                    self._release(cost)
+                else:
+                    self._withdraw(state, tag)
+                future.cancel()
+                raise
+            finally:
+                state.queued -= 1
+        wait = time.perf_counter() - enqueued_at
+        state.wait_times.append(wait)
+        metrics.observe_tenant_wait(state.plan, wait)
+        try:
+            yield
+        finally:
+            self._release(cost)
+
+    @staticmethod
+    def _withdraw(state: TenantState, tag: float):
+        """Give back the virtual time charged to a request dropped before its turn
+
+        Otherwise the tenant's next requests would queue behind work that never ran.
+        """
+        state.finish -= tag
+
+    def _release(self, cost: int):
+        self._measure()
+        self.in_flight -= cost
+        self._completed += cost
+        if self._busy >= self.throughput_window:
+            rate = self._completed / self._busy
+            self.throughput = rate if self.throughput is None else 0.7 * self.throughput + 0.3 * rate
+            self._busy, self._completed = 0.0, 0
+        self._dispatch()
+
+    def _measure(self) -> float:
+        """Add the time since the last change of in-flight readings to the busy time, if any were in flight"""
+        now = time.monotonic()
+        if self.in_flight > 0:
+            self._busy += now - self._busy_mark
+        self._busy_mark = now
+        return now
+
+    def _dispatch(self):
+        """Start queued requests, lowest tag first, while they fit (one at a time if larger than max_rows)
+
+        Requests whose deadline has passed are dropped rather than started.
+        """
+        now = self._measure()
+        while self._queue:
+            _, _, start, queued_cost, future, _, deadline = self._queue[0]
+            if future.cancelled():
+                heapq.heappop(self._queue)
+                continue
+            if deadline is not None and deadline <= now:
+                heapq.heappop(self._queue)
+                future.cancel()
+                continue
+            if self.in_flight and self.in_flight + queued_cost > self.max_rows:
+                break
+            heapq.heappop(self._queue)
+            self.in_flight += queued_cost
+            self.virtual_time = max(self.virtual_time, start)
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        """Rows in flight, throughput, queue length and per-tenant plan, limits and queue wait distribution"""
+
+        def summary(values: np.ndarray) -> dict:
+            if not len(values):
+                return {"mean": 0.0, "p50": 0.0, "p99": 0.0}
+            return {
+                "mean": round(float(values.mean()), 3),
+                "p50": round(float(np.percentile(values, 50)), 3),
+                "p99": round(float(np.percentile(values, 99)), 3),
+            }
+
+        return {
+            "in_flight_rows": self.in_flight,
+            "max_rows": self.max_rows,
+            "throughput_rows_per_second": round(self.throughput, 1) if self.throughput else None,
+            "queued": len(self._queue),
+            "tenants": {
+                tenant_id or "anonymous": {
+                    "plan": state.plan,
+                    "weight": state.weight,
+                    "rate_limit": state.bucket.rate or None,
+                    "queued": state.queued,
+                    "admitted": state.admitted,
+                    "rejected": state.rejected,
+                    "expired": state.expired,
+                    "wait_ms": summary(np.asarray(state.wait_times, dtype=np.float64) * 1000),
+                }
+                for tenant_id, state in self.tenants.items()
+            },
+        }
@@ -0,0 +1,252 @@
+"""
+Per-tenant water quality risk heatmap over web map tiles
+
+The latest quality score of every sensor is kept in arrays indexed by the
+sensor registry's interned sensor index. Sensors are placed at their
+facility's location and binned into web mercator (slippy map) tiles: each
+gets a Morton (Z-order) code of its tile at MAX_ZOOM, and the index is sorted
+by (tenant, code), so the tiles of any coarser zoom are contiguous runs of it.
+
+Aggregates for every zoom level (sensors, score sum/min, sensors per risk
+level, location sums for the centroid, newest reading) are built bottom-up
+with `reduceat`, each level from the one below, off the request path. A
+bounding box query at zoom z is a `searchsorted` for the Z-order range
+spanning the box in the tenant's run of that level, filtered to the tiles
+actually inside it, so a map pan touches only the tiles near the view.
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.db import Database
+from app.models import RISK_BANDS, RISK_LEVELS
+from app.sensor_registry import SensorRegistry
+
+logger = logging.getLogger(__name__)
+
+# Finest zoom level aggregated (tiles of ~600 m at the equator); codes fit in 32 bits
+MAX_ZOOM = 16
+MAX_LATITUDE = 85.0511287798
+
+def tile_xy(lat: np.ndarray, lng: np.ndarray, zoom: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Web mercator tile column and row of each location at a zoom level"""
+    n = 1 << zoom
+    lat = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    x = np.floor((np.asarray(lng) + 180.0) / 360.0 * n)
+    y = np.floor((1.0 - np.arcsinh(np.tan(lat)) / np.pi) / 2.0 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+def _spread(v: np.ndarray) -> np.ndarray:
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    return (v | (v << 1)) & 0x55555555
+
+def _compact(v: np.ndarray) -> np.ndarray:
+    v = v & 0x55555555
+    v = (v | (v >> 1)) & 0x33333333
+    v = (v | (v >> 2)) & 0x0F0F0F0F
+    v = (v | (v >> 4)) & 0x00FF00FF
+    return (v | (v >> 8)) & 0x0000FFFF
+
+def interleave(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Morton code of tile coordinates (up to 16 bits each)"""
+    return _spread(np.asarray(x, dtype=np.int64)) | (_spread(np.asarray(y, dtype=np.int64)) << 1)
+
+def deinterleave(codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return _compact(codes), _compact(codes >> 1)
+
+def epoch_seconds(timestamps: Sequence) -> np.ndarray:
+    """Seconds since the epoch of each timestamp (datetime or ISO string, naive times are UTC)"""
+    seconds = np.empty(len(timestamps))
+    for idx, ts in enumerate(timestamps):
+        if isinstance(ts, str):
+            ts = datetime.fromisoformat(ts)
+        seconds[idx] = (ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)).timestamp()
+    return seconds
+
+class LatestRisk:
+    """Latest quality score and reading time per interned sensor index"""
+
+    def __init__(self):
+        self.score = np.empty(0)
+        self.updated = np.empty(0)
+        self.updates = 0
+
+    def update(self, sensor: np.ndarray, timestamps: np.ndarray, scores: np.ndarray):
+        """Keep each sensor's newest score; unknown sensors (-1) and older readings are ignored"""
+        known = sensor >= 0
+        sensor, timestamps, scores = sensor[known], timestamps[known], scores[known]
+        if not len(sensor):
+            return
+        if sensor.max() >= len(self.score):
+            size = max(int(sensor.max()) + 1, 2 * len(self.score))
+            self.score = np.concatenate([self.score, np.full(size - len(self.score), np.nan)])
+            self.updated = np.concatenate([self.updated, np.full(size - len(self.updated), -np.inf)])
+        # Newest reading per sensor in the batch: last occurrence after sorting by time
+        order = np.lexsort((timestamps, sensor))
+        sensor, timestamps, scores = sensor[order], timestamps[order], scores[order]
+        last = np.r_[sensor[1:] != sensor[:-1], True]
+        sensor, timestamps, scores = sensor[last], timestamps[last], scores[last]
+        newer = timestamps >= self.updated[sensor]
+        self.score[sensor[newer]] = scores[newer]
+        self.updated[sensor[newer]] = timestamps[newer]
+        self.updates += 1
+
+class HeatmapLevel:
+    """Aggregates of the occupied tiles of one zoom level, sorted by (tenant, Morton code)"""
+
+    def __init__(self, tenant, code, sensors, score_sum, score_min, risk_counts, lat_sum, lng_sum, updated):
+        self.tenant = tenant
+        self.code = code
+        self.keys = (tenant << 32) | code
+        self.x, self.y = deinterleave(code)
+        self.sensors = sensors
+        self.score_sum = score_sum
+        self.score_min = score_min
+        self.risk_counts = risk_counts
+        self.lat_sum = lat_sum
+        self.lng_sum = lng_sum
+        self.updated = updated
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def grouped(cls, tenant, code, sensors, score_sum, score_min, risk_counts, lat_sum, lng_sum, updated):
+        """Merge entries (sorted by tenant and code) that fall in the same tile"""
+        keys = (tenant << 32) | code
+        if not len(keys):
+            return cls(tenant, code, sensors, score_sum, score_min, risk_counts, lat_sum, lng_sum, updated)
+        starts = np.r_[0, np.flatnonzero(np.diff(keys)) + 1]
+        return cls(
+            tenant[starts],
+            code[starts],
+            np.add.reduceat(sensors, starts),
+            np.add.reduceat(score_sum, starts),
+            np.minimum.reduceat(score_min, starts),
+            np.add.reduceat(risk_counts, starts, axis=0),
+            np.add.reduceat(lat_sum, starts),
+            np.add.reduceat(lng_sum, starts),
+            np.maximum.reduceat(updated, starts),
+        )
+
+    def coarser(self) -> "HeatmapLevel":
+        """The next zoom level out: four tiles per parent tile"""
+        return HeatmapLevel.grouped(
+            self.tenant, self.code >> 2, self.sensors, self.score_sum, self.score_min,
+            self.risk_counts, self.lat_sum, self.lng_sum, self.updated,
+        )
+
+class Heatmap:
+    """Risk aggregates for zoom levels 0..MAX_ZOOM, queried by tenant and bounding box"""
+
+    def __init__(self, levels: List[HeatmapLevel], tenant_ids: List[str], sensors: int):
+        self.levels = levels
+        self.tenant_ids = tenant_ids
+        self.tenant_index = {tenant_id: idx for idx, tenant_id in enumerate(tenant_ids)}
+        self.sensors = sensors
+        self.built_at = datetime.now(timezone.utc)
+
+    @classmethod
+    def build(cls, registry: SensorRegistry, latest: LatestRisk) -> "Heatmap":
+        """Aggregate the latest score of every located sensor"""
+        sensors, facilities, _ = registry.snapshot()
+        score, updated = latest.score.copy(), latest.updated.copy()
+        n = min(len(score), len(updated), len(sensors["facility"]))
+        facility = sensors["facility"][:n]
+        located = ~np.isnan(score[:n]) & (facility >= 0) & (facility < len(facilities["tenant"]))
+        sensor = np.flatnonzero(located)
+        facility = facility[sensor]
+        lat = facilities["location_lat"][facility]
+        lng = facilities["location_lng"][facility]
+        tenant = facilities["tenant"][facility].astype(np.int64)
+        keep = ~np.isnan(lat) & ~np.isnan(lng) & (tenant >= 0)
+        sensor, lat, lng, tenant = sensor[keep], lat[keep], lng[keep], tenant[keep]
+        score, updated = score[sensor], updated[sensor]
+
+        code = interleave(*tile_xy(lat, lng, MAX_ZOOM))
+        order = np.argsort((tenant << 32) | code, kind="stable")
+        risk_counts = np.zeros((len(order), len(RISK_LEVELS)), dtype=np.int64)
+        risk_counts[np.arange(len(order)), np.digitize(score[order], RISK_BANDS)] = 1
+        levels = [HeatmapLevel.grouped(
+            tenant[order], code[order], np.ones(len(order), dtype=np.int64), score[order], score[order],
+            risk_counts, lat[order], lng[order], updated[order],
+        )]
+        for _ in range(MAX_ZOOM):
+            levels.append(levels[-1].coarser())
+        levels.reverse()
+        return cls(levels, list(registry.tenants.ids), len(order))
+
+    def query(self, tenant_id: str, zoom: int, west: float, south: float, east: float, north: float) -> List[dict]:
+        """Tiles of the tenant's sensors at a zoom level within a bounding box (west > east crosses 180)"""
+        tenant = self.tenant_index.get(str(tenant_id))
+        if tenant is None:
+            return []
+        zoom = min(max(zoom, 0), MAX_ZOOM)
+        level = self.levels[zoom]
+        x0, y0 = tile_xy(np.array([north]), np.array([west]), zoom)
+        x1, y1 = tile_xy(np.array([south]), np.array([east]), zoom)
+        x0, y0, x1, y1 = int(x0[0]), int(y0[0]), int(x1[0]), int(y1[0])
+        spans = [(x0, x1)] if west <= east else [(x0, (1 << zoom) - 1), (0, x1)]
+
+        selected = []
+        for xa, xb in spans:
+            # Every tile in the box has a code between those of its top-left and bottom-right corners
+            lo = np.searchsorted(level.keys, (tenant << 32) | int(interleave(xa, y0)))
+            hi = np.searchsorted(level.keys, (tenant << 32) | int(interleave(xb, y1)), side="right")
+            x, y = level.x[lo:hi], level.y[lo:hi]
+            selected.append(lo + np.flatnonzero((x >= xa) & (x <= xb) & (y >= y0) & (y <= y1)))
+        return self.tiles(level, zoom, np.concatenate(selected))
+
+    def tiles(self, level: HeatmapLevel, zoom: int, rows: np.ndarray) -> List[dict]:
+        sensors = level.sensors[rows]
+        mean = np.round(level.score_sum[rows] / sensors, 1)
+        worst = RISK_LEVELS[np.digitize(level.score_min[rows], RISK_BANDS)]
+        score_min = np.round(level.score_min[rows], 1)
+        lat = np.round(level.lat_sum[rows] / sensors, 6)
+        lng = np.round(level.lng_sum[rows] / sensors, 6)
+        return [
+            {
+                "z": zoom,
+                "x": x,
+                "y": y,
+                "sensors": count,
+                "mean_quality_score": m,
+                "min_quality_score": s,
+                "risk_level": risk,
+                "risk_counts": dict(zip(RISK_LEVELS.tolist(), counts)),
+                "centroid": {"lat": la, "lng": ln},
+                "last_reading_at": datetime.fromtimestamp(u, timezone.utc).isoformat(),
+            }
+            for x, y, count, m, s, risk, counts, la, ln, u in zip(
+                level.x[rows].tolist(), level.y[rows].tolist(), sensors.tolist(), mean.tolist(),
+                score_min.tolist(), worst.tolist(), level.risk_counts[rows].tolist(),
+                lat.tolist(), lng.tolist(), level.updated[rows].tolist(),
+            )
+        ]
+
+class LatestScoreStore(Database):
+    """Reads each sensor's latest score from analytics.reading_scores (to seed the heatmap)"""
+
+    def fetch_latest_scores(self) -> List[tuple]:
+        """(sensor_id, timestamp, quality_score) of each sensor's newest scored reading"""
+        return self.read(
+            "SELECT s.sensor_id, s.timestamp, s.quality_score FROM analytics.reading_scores s "
+            "JOIN (SELECT sensor_id, MAX(timestamp) AS timestamp FROM analytics.reading_scores "
+            "GROUP BY sensor_id) latest ON s.sensor_id = latest.sensor_id AND s.timestamp = latest.timestamp"
+        )
+
+def seed_latest_risk(registry: SensorRegistry, latest: LatestRisk, rows: Optional[List[tuple]]):
+    """Load (sensor_id, timestamp, quality_score) rows into the latest scores"""
+    if not rows:
+        return
+    sensor_ids, timestamps, scores = zip(*rows)
+    latest.update(
+        registry.lookup([str(s) for s in sensor_ids]),
+        epoch_seconds(timestamps),
+        np.array(scores, dtype=np.float64),
+    )
@@ -0,0 +1,207 @@
+"""
+Batched analysis of water-sample photos
+
+Community and operator photos arrive in bursts after an incident, so each
+stage avoids serializing on one image at a time:
+
+- every upload is identified by its SHA-256; previously analysed photos are
+  answered from the prediction cache, identical photos within a request are
+  analysed once, and a photo already being analysed for another request is
+  awaited rather than decoded again;
+- decoding runs on a thread pool (Pillow releases the GIL while decoding) at
+  reduced resolution: JPEGs are scaled by libjpeg during the IDCT (draft
+  mode) to the smallest size still covering the model input, so the
+  full-size bitmap is never materialized;
+- decoded images of concurrent requests are coalesced by a MicroBatcher into
+  one (n, 3, size, size) tensor per model call, which runs off the event
+  loop.
+"""
+
+import asyncio
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.batching import MicroBatcher
+from app.cache import PredictionCache
+from app.lazy import lazy_import
+from app.models import IMAGE_ANALYZER, IMAGE_MEAN, IMAGE_STD, ImageAnalyses
+
+Image = lazy_import("PIL.Image")
+ImageOps = lazy_import("PIL.ImageOps")
+torch = lazy_import("torch")
+
+def image_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def image_keys(version: str, digests: List[str]) -> List[str]:
+    """Prediction cache keys of photos for a given image analyzer version"""
+    return [f"aqs:{IMAGE_ANALYZER}:{version}:{digest}" for digest in digests]
+
+def decode_image(data: bytes, size: int, max_pixels: int) -> np.ndarray:
+    """Normalized (3, size, size) float32 array of an encoded photo, center-cropped to a square
+
+    Raises ValueError for data that is not a decodable image or has more than
+    `max_pixels` pixels.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.width * image.height > max_pixels:
+                raise ValueError(f"{image.width}x{image.height} image exceeds the {max_pixels} pixel limit")
+            # No-op for formats without scaled decoding
+            image.draft("RGB", (size, size))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            image = ImageOps.fit(image, (size, size), Image.Resampling.BILINEAR)
+    except Image.UnidentifiedImageError as e:
+        raise ValueError("unrecognized image format") from e
+    except (OSError, SyntaxError, EOFError, Image.DecompressionBombError) as e:
+        raise ValueError(f"undecodable image: {e}") from e
+    pixels = np.asarray(image, dtype=np.float32) / 255
+    return ((pixels - IMAGE_MEAN) / IMAGE_STD).transpose(2, 0, 1)
+
+class TorchImageClassifier:
+    """Image analyzer artifact wrapping a TorchScript classifier over IMAGE_CLASSES
+
+    Saved with joblib like the other models (`image_analyzer/<version>.joblib`);
+    the TorchScript program travels as bytes and torch is only imported when
+    the artifact first scores a batch.
+    """
+
+    def __init__(self, program: bytes, version: str):
+        self.program = program
+        self.version = version
+        self._module = None
+
+    def __getstate__(self) -> dict:
+        return {**self.__dict__, "_module": None}
+
+    def analyze(self, images: np.ndarray) -> ImageAnalyses:
+        if self._module is None:
+            self._module = torch.jit.load(io.BytesIO(bytes(self.program)), map_location="cpu").eval()
+        with torch.inference_mode():
+            logits = self._module(torch.from_numpy(np.ascontiguousarray(images, dtype=np.float32)))
+            probabilities = torch.softmax(logits, dim=1).numpy()
+        return ImageAnalyses.from_probabilities(probabilities)
+
+class ImagePipeline:
+    """Hashing, cache lookups, pooled decoding and batched inference for uploaded photos
+
+    `score` runs the active image analyzer on a batch and returns
+    `(version, ImageAnalyses)`; `version` names the active version, used in
+    cache keys.
+    """
+
+    def __init__(
+        self,
+        score: Callable[[np.ndarray], Awaitable[Tuple[str, ImageAnalyses]]],
+        version: Callable[[], str],
+        cache: Optional[PredictionCache] = None,
+        workers: Optional[int] = None,
+        input_size: int = 224,
+        max_pixels: int = 40_000_000,
+        max_batch_size: int = 16,
+        max_wait: float = 0.01,
+    ):
+        self.version = version
+        self.cache = cache
+        self.input_size = input_size
+        self.max_pixels = max_pixels
+        self.workers = workers
+        self.batcher = MicroBatcher(score, max_batch_size, max_wait)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image-decode")
+        return self._pool
+
+    async def analyze(self, images: List[bytes]) -> List[dict]:
+        """Per-image sha256 plus label, confidence and cached, or an error for undecodable data"""
+        loop = asyncio.get_running_loop()
+        digests = await asyncio.gather(*(loop.run_in_executor(self.pool, image_digest, data) for data in images))
+        data = dict(zip(digests, images))
+        unique = list(data)
+        version = self.version()
+
+        results: Dict[str, dict] = {}
+        if self.cache is not None:
+            codes, hit = await self.cache.lookup(image_keys(version, unique))
+            hits = np.flatnonzero(hit)
+            analyses = ImageAnalyses.from_codes(codes[hits]).to_dicts()
+            for idx, result in zip(hits.tolist(), analyses):
+                results[unique[idx]] = {**result, "cached": True}
+
+        owned, awaited = [], []
+        for digest in unique:
+            if digest in results:
+                continue
+            future = self._in_flight.get(digest)
+            if future is None:
+                self._in_flight[digest] = loop.create_future()
+                owned.append(digest)
+            else:
+                awaited.append((digest, future))
+
+        if owned:
+            try:
+                computed = await self._compute(version, owned, [data[digest] for digest in owned])
+            except BaseException as e:
+                for digest in owned:
+                    future = self._in_flight.pop(digest)
+                    future.set_exception(e)
+                    # Marks the exception retrieved when no other request is waiting for it
+                    future.exception()
+                raise
+            for digest, result in zip(owned, computed):
+                self._in_flight.pop(digest).set_result(result)
+                results[digest] = result
+        for digest, future in awaited:
+            results[digest] = await asyncio.shield(future)
+
+        return [{"sha256": digest, **results[digest]} for digest in digests]
+
+    async def _compute(self, version: str, digests: List[str], images: List[bytes]) -> List[dict]:
+        """Decode and score photos that are neither cached nor in flight"""
+        loop = asyncio.get_running_loop()
+        decoded = await asyncio.gather(
+            *(loop.run_in_executor(self.pool, decode_image, data, self.input_size, self.max_pixels) for data in images),
+            return_exceptions=True,
+        )
+        for image in decoded:
+            if isinstance(image, BaseException) and not isinstance(image, ValueError):
+                raise image
+        results = [{"error": str(image)} if isinstance(image, ValueError) else None for image in decoded]
+        valid = [idx for idx, image in enumerate(decoded) if not isinstance(image, ValueError)]
+        if not valid:
+            return results
+
+        batch = np.stack([decoded[idx] for idx in valid])
+        size = self.batcher.max_batch_size
+        scored = await asyncio.gather(*(self._score(batch[start:start + size]) for start in range(0, len(batch), size)))
+        analyses = ImageAnalyses(
+            np.concatenate([part.label for _, part in scored]),
+            np.concatenate([part.confidence for _, part in scored]),
+        )
+        for idx, result in zip(valid, analyses.to_dicts()):
+            results[idx] = {**result, "cached": False}
+
+        # Results of a version swapped in mid-request are returned but not cached under the old key
+        if self.cache is not None and all(scored_version == version for scored_version, _ in scored):
+            await self.cache.store(image_keys(version, [digests[idx] for idx in valid]), analyses.code)
+        return results
+
+    async def _score(self, batch: np.ndarray) -> Tuple[str, ImageAnalyses]:
+        if self.batcher.max_wait > 0:
+            return await self.batcher.submit(batch)
+        return await self.batcher.fn(batch)
+
+    def shutdown(self):
+        self.batcher.stop()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
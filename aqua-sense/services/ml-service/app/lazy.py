@@ -0,0 +1,132 @@
+"""
+Lazy imports and import-time accounting for the ML service
+
+Heavy frameworks (torch, tensorflow, cv2, pandas, sklearn) are only imported
+when a model or route first touches them, through `lazy_import()` proxies.
+Routes that only need NumPy never pay for them, which keeps container cold
+start and autoscaling latency low.
+
+`import_timer` measures the cost of every module imported while the service
+starts (like `python -X importtime`, but in-process; app.main installs it
+around its own imports and removes it again), so the report can be
+logged at startup, checked against IMPORT_TIME_BUDGET_MS and served from an
+endpoint. Imports triggered later through lazy proxies are recorded too.
+"""
+
+import builtins
+import importlib
+import sys
+import threading
+import time
+from types import ModuleType
+from typing import Dict, List, Optional
+
+# Frameworks that must never be imported at module top level
+HEAVY_MODULES = ("torch", "tensorflow", "cv2", "pandas", "sklearn")
+
+class ImportTimer:
+    """Records cumulative and self time of first-time imports"""
+
+    def __init__(self):
+        self.records: Dict[str, dict] = {}
+        self._original_import = None
+        self._local = threading.local()
+
+    def install(self):
+        if self._original_import is None:
+            self._original_import = builtins.__import__
+            builtins.__import__ = self._timed_import
+
+    def uninstall(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self.record(name, elapsed, elapsed - children)
+
+    def record(self, name: str, cumulative: float, self_time: Optional[float] = None, lazy: bool = False):
+        self.records.setdefault(name, {
+            "module": name,
+            "cumulative_ms": round(cumulative * 1000, 3),
+            "self_ms": round((cumulative if self_time is None else self_time) * 1000, 3),
+            "lazy": lazy,
+        })
+
+    def report(self, top: Optional[int] = None) -> dict:
+        """Imports ordered by cumulative cost, with the startup total"""
+        records = sorted(self.records.values(), key=lambda r: r["cumulative_ms"], reverse=True)
+        return {
+            "startup_total_ms": round(sum(r["self_ms"] for r in records if not r["lazy"]), 3),
+            "heavy_modules_loaded": [name for name in HEAVY_MODULES if name in sys.modules],
+            "modules": records[:top] if top else records,
+        }
+
+import_timer = ImportTimer()
+
+class LazyModule(ModuleType):
+    """Module proxy that performs the real import on first attribute access
+
+    The proxy defines no public attributes of its own, so nothing on the real
+    module is shadowed; use load_module() / is_loaded() to inspect it.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_lazy_target"] = None
+        self.__dict__["_lazy_lock"] = threading.Lock()
+
+    def __getattr__(self, attr: str):
+        return getattr(load_module(self), attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if is_loaded(self) else "not loaded"
+        return f"<lazy module {self.__name__!r} ({state})>"
+
+def load_module(proxy: LazyModule) -> ModuleType:
+    """Import the module behind a lazy proxy (once) and return it"""
+    module = proxy.__dict__["_lazy_target"]
+    if module is None:
+        with proxy.__dict__["_lazy_lock"]:
+            module = proxy.__dict__["_lazy_target"]
+            if module is None:
+                start = time.perf_counter()
+                module = importlib.import_module(proxy.__name__)
+                import_timer.record(proxy.__name__, time.perf_counter() - start, lazy=True)
+                proxy.__dict__["_lazy_target"] = module
+    return module
+
+def is_loaded(proxy: LazyModule) -> bool:
+    return proxy.__dict__["_lazy_target"] is not None
+
+_lazy_modules: Dict[str, LazyModule] = {}
+
+def lazy_import(name: str) -> LazyModule:
+    """Shared lazy proxy for a module"""
+    if name not in _lazy_modules:
+        _lazy_modules[name] = LazyModule(name)
+    return _lazy_modules[name]
+
+def warm_up(names: List[str]) -> Dict[str, float]:
+    """Import the given modules now (e.g. before reporting ready); returns seconds per module"""
+    timings = {}
+    for name in names:
+        start = time.perf_counter()
+        load_module(lazy_import(name))
+        timings[name] = round(time.perf_counter() - start, 3)
+    return timings
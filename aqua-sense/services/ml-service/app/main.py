@@ -3,19 +3,147 @@ AquaSense ML Service
 Provides machine learning capabilities for water quality prediction and anomaly detection
 """
 
-from fastapi import FastAPI, HTTPException
+# Time every import made while the service module loads (see /debug/imports); only
+# this module installs the hook, so importing other app modules is never instrumented
+from app.lazy import import_timer, warm_up
+import_timer.install()
+
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
-from typing import List, Optional
+from starlette.datastructures import UploadFile
+from typing import List, Optional, Sequence, Union
 import numpy as np
-from datetime import datetime
-import joblib
+from datetime import date, datetime, timezone
+import asyncio
+import json
+import logging
+import math
 import os
+import time
+
+from app.admission import DeadlineExceeded, DeadlineMiddleware, request_deadline
+from app.alert_rules import AlertRuleEngine, AlertRuleStore, alert_records
+from app.heatmap import MAX_ZOOM, Heatmap, LatestRisk, LatestScoreStore, epoch_seconds, seed_latest_risk
+from app.batching import MicroBatcher
+from app.cache import PredictionCache, cache_keys
+from app.columnar import BINARY_CONTENT_TYPE, columns_to_features, decode_features
+from app.ndjson import DuplexStreamingResponse, RecordChunk, dumps_lines, iter_record_chunks
+from app.executor import ScoringExecutor
+from app.fairness import FairScheduler, parse_plan_values
+from app.images import ImagePipeline
+from app import metrics
+from app.models import (
+    ANOMALY_DETECTOR, ANOMALY_FLAGS, FEATURE_NAMES, FLAG_NAMES, IMAGE_ANALYZER, IMAGE_CLASSES, MODEL_FACTORIES,
+    MODEL_METHODS, WATER_QUALITY, AnomalyDetector, AnomalyFlags, QualityPredictions, as_feature_matrix
+)
+from app.online import OnlineAnomalyDetector
+from app.profiling import ProfilingMiddleware, RequestProfiler
+from app.registry import ModelRegistry
+from app.rollups import DailyRollups, RollupStore, summarize
+from app.sensor_registry import SensorRegistry, SensorRegistryStore
+from app.timeseries import MAX_WIDTH, METHODS, ReadingSeriesStore, SeriesCursor, downsample_series, parse_metrics
+
+import_timer.uninstall()
 
 app = FastAPI(title="AquaSense ML Service", version="1.0.0")
+app.add_middleware(metrics.InFlightMiddleware)
+logger = logging.getLogger(__name__)
 
 # Models directory
 MODELS_DIR = os.getenv("MODEL_PATH", "/app/models")
 
+# Readings scored per chunk by the streaming endpoint
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "5000"))
+
+# Online detector sizing and checkpoint location (empty disables checkpointing)
+ONLINE_DETECTOR_CAPACITY = int(os.getenv("ONLINE_DETECTOR_CAPACITY", "100000"))
+ONLINE_STATE_PATH = os.getenv("ONLINE_STATE_PATH", os.path.join(MODELS_DIR, "online_state.npz"))
+
+# Seconds between checks of MODELS_DIR for new model versions
+MODEL_RELOAD_INTERVAL = float(os.getenv("MODEL_RELOAD_INTERVAL", "30"))
+
+# Where model calls run: inline, thread or process; batches up to
+# SCORING_INLINE_MAX_ROWS rows always stay on the event loop
+SCORING_EXECUTOR = os.getenv("SCORING_EXECUTOR", "thread")
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", "0")) or None
+SCORING_INLINE_MAX_ROWS = int(os.getenv("SCORING_INLINE_MAX_ROWS", "5000"))
+
+# Prediction cache: Redis L2 when REDIS_URL is set, always an in-process L1;
+# batches larger than PREDICTION_CACHE_MAX_ROWS bypass the cache
+PREDICTION_CACHE_ENABLED = os.getenv("PREDICTION_CACHE_ENABLED", "true").lower() == "true"
+REDIS_URL = os.getenv("REDIS_URL", "")
+PREDICTION_CACHE_TTL = int(os.getenv("PREDICTION_CACHE_TTL", "3600"))
+PREDICTION_CACHE_L1_SIZE = int(os.getenv("PREDICTION_CACHE_L1_SIZE", "100000"))
+PREDICTION_CACHE_MAX_ROWS = int(os.getenv("PREDICTION_CACHE_MAX_ROWS", "10000"))
+
+# Startup import budget, and heavy modules to import before reporting ready
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "2000"))
+WARMUP_MODULES = [name for name in os.getenv("WARMUP_MODULES", "").split(",") if name]
+
+# Micro-batching of small concurrent requests (a max wait of 0 disables it)
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "1024"))
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", "2"))
+
+# Photo uploads: per-request limits, model input size, decode threads and
+# how decoded images are batched into one tensor per model call
+IMAGE_MAX_FILES = int(os.getenv("IMAGE_MAX_FILES", "32"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "40000000"))
+IMAGE_INPUT_SIZE = int(os.getenv("IMAGE_INPUT_SIZE", "224"))
+IMAGE_DECODE_WORKERS = int(os.getenv("IMAGE_DECODE_WORKERS", "0")) or None
+IMAGE_BATCH_MAX_SIZE = int(os.getenv("IMAGE_BATCH_MAX_SIZE", "16"))
+IMAGE_BATCH_MAX_WAIT_MS = float(os.getenv("IMAGE_BATCH_MAX_WAIT_MS", "10"))
+
+# Alert rules are read from DATABASE_URL (alert.alert_rules) and refreshed on updated_at
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+ALERT_RULES_REFRESH_INTERVAL = float(os.getenv("ALERT_RULES_REFRESH_INTERVAL", "30"))
+
+# Sensors, facilities and tenants used to enrich results, refreshed on updated_at
+SENSOR_REGISTRY_REFRESH_INTERVAL = float(os.getenv("SENSOR_REGISTRY_REFRESH_INTERVAL", "60"))
+
+# Seconds between rebuilds of the risk heatmap aggregates (when scores changed)
+HEATMAP_REFRESH_INTERVAL = float(os.getenv("HEATMAP_REFRESH_INTERVAL", "2"))
+
+# Daily per-sensor rollups of scored readings, merged into analytics.daily_rollups
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "true").lower() == "true"
+ROLLUP_FLUSH_INTERVAL = float(os.getenv("ROLLUP_FLUSH_INTERVAL", "10"))
+
+# Per-tenant scheduling: fair-queue weight and rate limit (readings per second,
+# with TENANT_BURST_SECONDS of burst) by tenant.tenants plan, and how many
+# readings are scored at once before requests queue for their tenant's turn.
+# Rate limits are off unless set (e.g. "basic:2000,professional:10000"), and
+# only apply to tenants the sensor registry knows
+TENANT_PLAN_WEIGHTS = parse_plan_values(os.getenv("TENANT_PLAN_WEIGHTS", "basic:1,professional:2,enterprise:4"))
+TENANT_PLAN_RATES = parse_plan_values(os.getenv("TENANT_PLAN_RATES", ""))
+TENANT_DEFAULT_PLAN = os.getenv("TENANT_DEFAULT_PLAN", "basic")
+TENANT_BURST_SECONDS = float(os.getenv("TENANT_BURST_SECONDS", "5"))
+FAIR_QUEUE_MAX_ROWS = int(os.getenv("FAIR_QUEUE_MAX_ROWS", "8192"))
+
+# Load shedding: timeout (seconds) for requests sent without X-Request-Timeout or
+# X-Request-Deadline (0: none), and degraded mode. "off" rejects scoring requests
+# that cannot finish in time with 503; "auto" instead answers them, and any
+# request facing more than DEGRADE_QUEUE_DELAY_MS of queueing, with the
+# threshold anomaly detector alone; "on" answers every scoring request that way
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "0"))
+DEGRADED_MODE = os.getenv("DEGRADED_MODE", "off").lower()
+DEGRADE_QUEUE_DELAY_MS = float(os.getenv("DEGRADE_QUEUE_DELAY_MS", "1000"))
+
+# Sampled request profiling, off by default: fraction of requests profiled, and
+# the admin token that profiles one request sent with it as X-Profile-Token and
+# authorizes GET /admin/profile; stacks are sampled every PROFILING_INTERVAL_MS
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+
+# Worker processes when served through app.prefork (0: one per available CPU),
+# and how long workers get to finish in-flight requests on shutdown or restart
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "0"))
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
+# Seconds between event loop lag probes (0 disables the probe)
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.5"))
+
 class SensorReading(BaseModel):
     """Sensor reading data model"""
     sensor_id: str
@@ -36,6 +164,11 @@ class PredictionResponse(BaseModel):
     model_version: str
     confidence: float
 
+class DegradedPredictionResponse(PredictionResponse):
+    """Prediction response answered by the threshold detector alone (no predictions, only anomalies)"""
+    anomalies: List[dict]
+    degraded: bool = True
+
 class AnomalyDetectionRequest(BaseModel):
     """Anomaly detection request"""
     readings: List[SensorReading]
@@ -45,91 +178,425 @@ class AnomalyDetectionResponse(BaseModel):
     anomalies: List[dict]
     anomaly_score: float
 
-# Mock model for demonstration
-class WaterQualityModel:
-    """Water quality prediction model"""
-    
-    def __init__(self):
-        self.version = "1.0.0"
-    
-    def predict(self, features: np.ndarray) -> np.ndarray:
-        """Predict water quality based on sensor readings"""
-        # Simple rule-based prediction for demonstration
-        predictions = []
-        for reading in features:
-            ph, temp, turbidity, do, conductivity = reading
-            
-            # Quality score (0-100)
-            score = 100
-            
-            # pH check (optimal: 6.5-8.5)
-            if ph < 6.5 or ph > 8.5:
-                score -= 20
-            
-            # Temperature check (optimal: 15-25°C)
-            if temp < 15 or temp > 25:
-                score -= 15
-            
-            # Turbidity check (lower is better)
-            if turbidity > 5:
-                score -= 25
-            
-            # Dissolved oxygen check (optimal: > 5 mg/L)
-            if do < 5:
-                score -= 30
-            
-            # Conductivity check
-            if conductivity > 1000:
-                score -= 10
-            
-            quality = "excellent" if score >= 80 else "good" if score >= 60 else "fair" if score >= 40 else "poor"
-            
-            predictions.append({
-                "quality_score": max(0, score),
-                "quality_level": quality,
-                "risk_level": "low" if score >= 70 else "medium" if score >= 50 else "high"
-            })
-        
-        return predictions
+class DegradedAnomalyDetectionResponse(AnomalyDetectionResponse):
+    """Anomaly detection response answered by the threshold detector alone"""
+    degraded: bool = True
+
+class AlertEvaluationRequest(BaseModel):
+    """Alert rule evaluation request"""
+    readings: List[SensorReading]
+
+class AlertEvaluationResponse(BaseModel):
+    """Alert rule evaluation response"""
+    alerts: List[dict]
+    rules_evaluated: int
+    alerts_written: int
+
+def extract_features(readings: List[SensorReading]) -> np.ndarray:
+    """Feature matrix (one row per reading, FEATURE_NAMES order) for a request's readings"""
+    return np.array([
+        [r.ph, r.temperature, r.turbidity, r.dissolved_oxygen, r.conductivity]
+        for r in readings
+    ])
+
+# Initialize models: built-in rule-based models until versioned artifacts are found
+registry = ModelRegistry(MODELS_DIR, builtins=MODEL_FACTORIES, required_methods=MODEL_METHODS)
+executor = ScoringExecutor(
+    registry,
+    mode=SCORING_EXECUTOR,
+    workers=SCORING_WORKERS,
+    inline_max_rows=SCORING_INLINE_MAX_ROWS,
+    reload_interval=MODEL_RELOAD_INTERVAL,
+)
+online_detector = OnlineAnomalyDetector(FEATURE_NAMES, capacity=ONLINE_DETECTOR_CAPACITY)
+alert_rules = AlertRuleEngine()
+daily_rollups = DailyRollups()
+sensor_registry = SensorRegistry()
+latest_risk = LatestRisk()
 
-class AnomalyDetector:
-    """Anomaly detection model"""
+def tenant_plan(tenant_id: str) -> Optional[str]:
+    """Plan a tenant is scheduled with; None for tenants the registry does not know (or before it is loaded)"""
+    if not sensor_registry.loaded:
+        return None
+    return sensor_registry.tenant_plan(tenant_id)
+
+fair_queue = FairScheduler(
+    tenant_plan,
+    TENANT_PLAN_WEIGHTS,
+    TENANT_PLAN_RATES,
+    default_plan=TENANT_DEFAULT_PLAN,
+    max_rows=FAIR_QUEUE_MAX_ROWS,
+    burst_seconds=TENANT_BURST_SECONDS,
+)
+
+def request_tenant(tenant_id: Optional[str], sensor_ids: Sequence[str] = ()) -> str:
+    """Tenant a request is charged to: X-Tenant-ID, else the owner of its first sensor"""
+    if tenant_id:
+        return tenant_id
+    if sensor_ids and sensor_registry.loaded:
+        return sensor_registry.enrich(sensor_ids[:1]).tenant_ids[0] or ""
+    return ""
+
+def admit(tenant: str, rows: int):
+    """Charge a request to its tenant's rate limit, rejecting it with 429 when over the limit
+
+    Requests larger than the tenant's whole burst can never be admitted and get 413.
+    """
+    retry_after = fair_queue.admit(tenant, rows)
+    if retry_after == math.inf:
+        raise HTTPException(status_code=413, detail="Request exceeds the tenant's rate limit burst; split it into smaller requests")
+    if retry_after > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Tenant rate limit exceeded",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+app.add_middleware(DeadlineMiddleware, default_timeout=REQUEST_TIMEOUT)
+
+profiler = RequestProfiler(PROFILING_SAMPLE_RATE, PROFILING_ADMIN_TOKEN, PROFILING_INTERVAL_MS / 1000)
+if profiler.enabled:
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+# Degraded mode skips the deployed models for the built-in threshold rules
+threshold_detector = AnomalyDetector()
+
+def overloaded(retry_after: float) -> HTTPException:
+    """503 for a request shed because it cannot finish before its deadline"""
+    return HTTPException(
+        status_code=503,
+        detail="Service overloaded: request cannot complete before its deadline",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+def shed_load(endpoint: str, tenant: str, rows: int) -> bool:
+    """Whether to answer a scoring request degraded; raises 503 when it cannot finish before its deadline"""
+    deadline = request_deadline.get()
+    now = time.monotonic()
+    if deadline is not None and deadline <= now:
+        metrics.observe_shed("deadline_passed")
+        raise overloaded(fair_queue.expected_delay(tenant, 0))
+    if DEGRADED_MODE == "on":
+        metrics.observe_degraded(endpoint)
+        return True
+    delay = fair_queue.expected_delay(tenant, rows)
+    late = deadline is not None and now + delay > deadline
+    if DEGRADED_MODE == "auto" and (late or delay > DEGRADE_QUEUE_DELAY_MS / 1000):
+        metrics.observe_degraded(endpoint)
+        return True
+    if late:
+        metrics.observe_shed("deadline_unmeetable")
+        raise overloaded(delay)
+    return False
+
+def create_prediction_cache() -> Optional[PredictionCache]:
+    """Build the prediction cache from the environment"""
+    if not PREDICTION_CACHE_ENABLED:
+        return None
+    redis_client = None
+    if REDIS_URL:
+        import redis.asyncio as aioredis
+        redis_client = aioredis.from_url(REDIS_URL)
+    return PredictionCache(
+        redis_client,
+        ttl=PREDICTION_CACHE_TTL,
+        l1_size=PREDICTION_CACHE_L1_SIZE,
+        max_rows=PREDICTION_CACHE_MAX_ROWS,
+    )
+
+prediction_cache = create_prediction_cache()
+if prediction_cache is not None:
+    registry.listeners.append(prediction_cache.invalidate)
+
+# How each model's result is reduced to one cached integer per reading, and rebuilt
+CACHE_CODECS = {
+    WATER_QUALITY: (QualityPredictions.pack, QualityPredictions.unpack),
+    ANOMALY_DETECTOR: (lambda flags: flags.mask, lambda values: AnomalyFlags(values.astype(np.uint8))),
+}
+
+async def score_cached(name: str, features: np.ndarray):
+    """Score features, answering previously seen readings from the prediction cache"""
+    if prediction_cache is None or not 0 < len(features) <= prediction_cache.max_rows:
+        return await executor.score(name, features)
     
-    def __init__(self):
-        self.version = "1.0.0"
+    encode, decode = CACHE_CODECS[name]
+    version = registry.get(name).version
+    keys = cache_keys(name, version, features)
+    values, hit = await prediction_cache.lookup(keys)
     
-    def detect(self, features: np.ndarray) -> List[dict]:
-        """Detect anomalies in sensor readings"""
-        anomalies = []
-        
-        for idx, reading in enumerate(features):
-            ph, temp, turbidity, do, conductivity = reading
-            anomaly_flags = []
-            
-            # Check for anomalies
-            if ph < 4 or ph > 10:
-                anomaly_flags.append("extreme_ph")
-            if temp < 0 or temp > 40:
-                anomaly_flags.append("extreme_temperature")
-            if turbidity > 50:
-                anomaly_flags.append("high_turbidity")
-            if do < 2:
-                anomaly_flags.append("low_oxygen")
-            if conductivity > 2000:
-                anomaly_flags.append("high_conductivity")
-            
-            if anomaly_flags:
-                anomalies.append({
-                    "reading_index": idx,
-                    "anomaly_types": anomaly_flags,
-                    "severity": "high" if len(anomaly_flags) > 2 else "medium" if len(anomaly_flags) > 1 else "low"
-                })
-        
-        return anomalies
+    misses = np.flatnonzero(~hit)
+    if len(misses):
+        scored_version, result = await executor.score(name, features[misses])
+        encoded = encode(result)
+        if scored_version != version or encoded is None:
+            # The model was swapped mid-request, or its results cannot be cached: answer uncached
+            if len(misses) == len(features):
+                return scored_version, result
+            return await executor.score(name, features)
+        values[misses] = encoded
+        await prediction_cache.store([keys[idx] for idx in misses.tolist()], values[misses])
+    
+    return version, decode(values)
+
+async def run_quality_model(features: np.ndarray):
+    """Score features with the active water quality model; returns (version, predictions)"""
+    version, predictions = await score_cached(WATER_QUALITY, features)
+    metrics.observe_scoring(WATER_QUALITY, len(predictions))
+    return version, predictions
+
+async def run_anomaly_detector(features: np.ndarray):
+    """Flag features with the active anomaly detector; returns (version, flags)"""
+    version, flags = await score_cached(ANOMALY_DETECTOR, features)
+    metrics.observe_scoring(ANOMALY_DETECTOR, len(flags), len(flags.indices), detector="threshold")
+    return version, flags
+
+quality_batcher = MicroBatcher(run_quality_model, MICRO_BATCH_MAX_SIZE, MICRO_BATCH_MAX_WAIT_MS / 1000)
+anomaly_batcher = MicroBatcher(run_anomaly_detector, MICRO_BATCH_MAX_SIZE, MICRO_BATCH_MAX_WAIT_MS / 1000)
+quality_batcher.on_batch = metrics.batch_observer(WATER_QUALITY)
+anomaly_batcher.on_batch = metrics.batch_observer(ANOMALY_DETECTOR)
+
+async def run_image_analyzer(images: np.ndarray):
+    """Classify a batch of decoded photos off the event loop; returns (version, analyses)"""
+    version, analyses = await executor.score(IMAGE_ANALYZER, images, offload=True)
+    metrics.observe_scoring(IMAGE_ANALYZER, len(analyses))
+    return version, analyses
+
+image_pipeline = ImagePipeline(
+    run_image_analyzer,
+    lambda: registry.get(IMAGE_ANALYZER).version,
+    cache=prediction_cache,
+    workers=IMAGE_DECODE_WORKERS,
+    input_size=IMAGE_INPUT_SIZE,
+    max_pixels=IMAGE_MAX_PIXELS,
+    max_batch_size=IMAGE_BATCH_MAX_SIZE,
+    max_wait=IMAGE_BATCH_MAX_WAIT_MS / 1000,
+)
+image_pipeline.batcher.on_batch = metrics.batch_observer(IMAGE_ANALYZER)
+
+async def score_batched(batcher: MicroBatcher, features: np.ndarray, tenant: str = ""):
+    """In the tenant's fair-queue turn, run small requests through the micro-batcher and larger ones directly"""
+    features = as_feature_matrix(features)
+    async with fair_queue.turn(tenant, len(features), request_deadline.get()):
+        if batcher.max_wait > 0 and 0 < len(features) < batcher.max_batch_size:
+            return await batcher.submit(features)
+        return await batcher.fn(features)
+
+@app.on_event("startup")
+async def load_models():
+    """Activate the latest model artifacts and keep watching for new versions"""
+    await asyncio.to_thread(registry.refresh)
+    if MODEL_RELOAD_INTERVAL > 0:
+        app.state.model_watcher = asyncio.create_task(registry.watch(MODEL_RELOAD_INTERVAL))
+    if EVENT_LOOP_LAG_INTERVAL > 0:
+        app.state.lag_monitor = asyncio.create_task(metrics.monitor_event_loop(EVENT_LOOP_LAG_INTERVAL))
+
+@app.on_event("shutdown")
+async def stop_model_watcher():
+    """Stop polling for new model versions and alert rules, the event loop probe and the micro-batchers"""
+    watcher = getattr(app.state, "model_watcher", None)
+    if watcher is not None:
+        watcher.cancel()
+    for name in ("lag_monitor", "alert_rules_watcher", "rollup_flusher", "sensor_registry_watcher", "heatmap_builder"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    quality_batcher.stop()
+    anomaly_batcher.stop()
+    image_pipeline.shutdown()
+    executor.shutdown()
+
+async def watch_alert_rules(store: AlertRuleStore, interval: float):
+    """Re-read alert rules changed since the last refresh"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(alert_rules.refresh, store)
+        except Exception as e:
+            logger.error("Alert rule refresh failed: %s", e)
+
+@app.on_event("startup")
+async def load_alert_rules():
+    """Compile the alert rules and keep them in sync with alert.alert_rules"""
+    app.state.alert_store = None
+    if not DATABASE_URL:
+        return
+    try:
+        store = await asyncio.to_thread(AlertRuleStore, DATABASE_URL)
+        await asyncio.to_thread(alert_rules.refresh, store)
+    except Exception as e:
+        logger.error("Alert rules unavailable, could not load from the database: %s", e)
+        return
+    app.state.alert_store = store
+    if ALERT_RULES_REFRESH_INTERVAL > 0:
+        app.state.alert_rules_watcher = asyncio.create_task(watch_alert_rules(store, ALERT_RULES_REFRESH_INTERVAL))
+
+async def watch_sensor_registry(store: SensorRegistryStore, interval: float):
+    """Re-read sensors, facilities and tenants changed since the last refresh"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(sensor_registry.refresh, store)
+        except Exception as e:
+            logger.error("Sensor registry refresh failed: %s", e)
+
+@app.on_event("startup")
+async def load_sensor_registry():
+    """Load the sensor registry and keep it in sync with the sensor and tenant tables"""
+    if not DATABASE_URL:
+        return
+    try:
+        store = await asyncio.to_thread(SensorRegistryStore, DATABASE_URL)
+        await asyncio.to_thread(sensor_registry.refresh, store)
+    except Exception as e:
+        logger.error("Results will not be enriched, could not load the sensor registry: %s", e)
+        return
+    if SENSOR_REGISTRY_REFRESH_INTERVAL > 0:
+        app.state.sensor_registry_watcher = asyncio.create_task(
+            watch_sensor_registry(store, SENSOR_REGISTRY_REFRESH_INTERVAL)
+        )
+
+async def build_heatmaps(interval: float):
+    """Rebuild the heatmap aggregates whenever scores or the sensor registry changed"""
+    built = None
+    while True:
+        version = (latest_risk.updates, sensor_registry.refreshes)
+        if version != built:
+            try:
+                app.state.heatmap = await asyncio.to_thread(Heatmap.build, sensor_registry, latest_risk)
+                built = version
+            except Exception as e:
+                logger.error("Heatmap build failed: %s", e)
+        await asyncio.sleep(interval)
+
+@app.on_event("startup")
+async def start_heatmaps():
+    """Seed the latest score per sensor from analytics.reading_scores and start the heatmap builder"""
+    app.state.heatmap = None
+    if not sensor_registry.loaded:
+        return
+    try:
+        store = await asyncio.to_thread(LatestScoreStore, DATABASE_URL)
+        try:
+            rows = await asyncio.to_thread(store.fetch_latest_scores)
+        finally:
+            store.close()
+        seed_latest_risk(sensor_registry, latest_risk, rows)
+    except Exception as e:
+        logger.error("Heatmap starts empty, could not read the latest scores: %s", e)
+    app.state.heatmap_builder = asyncio.create_task(build_heatmaps(HEATMAP_REFRESH_INTERVAL))
+
+def record_latest_risk(sensor_ids: List[str], timestamps: List, scores: np.ndarray):
+    """Keep each sensor's newest quality score for the heatmap"""
+    if sensor_registry.loaded:
+        latest_risk.update(sensor_registry.lookup(sensor_ids), epoch_seconds(timestamps), scores.astype(np.float64))
+
+def enrich_results(results: List[dict], sensor_ids: List[str]):
+    """Add facility, tenant and location to each result (once the sensor registry is loaded)"""
+    if sensor_registry.loaded:
+        for result, fields in zip(results, sensor_registry.enrich(sensor_ids).to_dicts()):
+            result.update(fields)
+
+def record_rollups(sensor_ids: List[str], timestamps: List, features: np.ndarray):
+    """Fold scored readings into the pending daily rollups (when a rollup store is configured)"""
+    if getattr(app.state, "rollup_store", None) is not None:
+        daily_rollups.add(sensor_ids, timestamps, features)
+
+async def flush_rollups(store: RollupStore, interval: float):
+    """Merge pending rollup readings into analytics.daily_rollups every interval"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(daily_rollups.flush, store)
+        except Exception as e:
+            logger.error("Rollup flush failed, %d readings pending: %s", daily_rollups.pending, e)
+
+@app.on_event("startup")
+async def load_rollups():
+    """Open the rollup store and start the periodic flush"""
+    app.state.rollup_store = None
+    if not (DATABASE_URL and ROLLUPS_ENABLED):
+        return
+    try:
+        store = await asyncio.to_thread(RollupStore, DATABASE_URL)
+        await asyncio.to_thread(store.ensure_schema)
+    except Exception as e:
+        logger.error("Daily rollups disabled, could not open the database: %s", e)
+        return
+    app.state.rollup_store = store
+    app.state.rollup_flusher = asyncio.create_task(flush_rollups(store, ROLLUP_FLUSH_INTERVAL))
+
+@app.on_event("shutdown")
+async def flush_rollups_on_shutdown():
+    """Merge whatever is still pending before exiting"""
+    store = getattr(app.state, "rollup_store", None)
+    if store is not None:
+        try:
+            await asyncio.to_thread(daily_rollups.flush, store)
+        except Exception as e:
+            logger.error("Lost %d pending rollup readings on shutdown: %s", daily_rollups.pending, e)
 
-# Initialize models
-quality_model = WaterQualityModel()
-anomaly_detector = AnomalyDetector()
+@app.on_event("startup")
+async def open_series_store():
+    """Open the connection the time series endpoint reads readings through"""
+    app.state.series_store = None
+    if not DATABASE_URL:
+        return
+    try:
+        app.state.series_store = await asyncio.to_thread(ReadingSeriesStore, DATABASE_URL)
+    except Exception as e:
+        logger.error("Time series unavailable, could not open the database: %s", e)
+
+def restore_online_detector():
+    """Resume per-sensor rolling statistics from the last checkpoint"""
+    if ONLINE_STATE_PATH and os.path.exists(ONLINE_STATE_PATH):
+        try:
+            online_detector.restore(ONLINE_STATE_PATH)
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning("Starting online detector cold, could not restore %s: %s", ONLINE_STATE_PATH, e)
+
+def save_online_detector():
+    """Persist per-sensor rolling statistics so restarts skip the warm-up"""
+    if ONLINE_STATE_PATH:
+        try:
+            online_detector.checkpoint(ONLINE_STATE_PATH)
+        except OSError as e:
+            logger.warning("Could not checkpoint online detector to %s: %s", ONLINE_STATE_PATH, e)
+
+@app.on_event("startup")
+async def restore_online_state():
+    """Restore the online detector, unless a prefork supervisor already restored the shared state"""
+    if not online_detector.shared:
+        restore_online_detector()
+
+@app.on_event("shutdown")
+async def checkpoint_online_state():
+    """Checkpoint the online detector; shared state is checkpointed by the supervisor after the last worker"""
+    if not online_detector.shared:
+        save_online_detector()
+
+@app.on_event("startup")
+async def report_import_times():
+    """Log the startup import cost and flag it when it exceeds the budget"""
+    report = import_timer.report(top=10)
+    slowest = ", ".join(f"{r['module']} {r['cumulative_ms']:.0f}ms" for r in report["modules"])
+    logger.info("Startup imports took %.0fms (slowest: %s)", report["startup_total_ms"], slowest)
+    if report["startup_total_ms"] > IMPORT_TIME_BUDGET_MS:
+        logger.warning(
+            "Startup imports took %.0fms, over the %.0fms budget", report["startup_total_ms"], IMPORT_TIME_BUDGET_MS
+        )
+    if report["heavy_modules_loaded"]:
+        logger.warning("Heavy modules imported at startup: %s", ", ".join(report["heavy_modules_loaded"]))
+
+@app.on_event("startup")
+async def warm_up_service():
+    """Import WARMUP_MODULES and run a dummy batch through each model before reporting ready"""
+    app.state.ready = False
+    app.state.warmup = await asyncio.to_thread(warm_up, WARMUP_MODULES)
+    dummy = np.zeros((1, len(FEATURE_NAMES)))
+    # Straight to the models so the dummy batch stays out of the scoring metrics
+    await score_cached(WATER_QUALITY, dummy)
+    await score_cached(ANOMALY_DETECTOR, dummy)
+    app.state.ready = True
 
 @app.get("/health")
 async def health_check():
@@ -141,54 +608,145 @@ async def health_check():
         "models_loaded": True
     }
 
-@app.post("/predict/water-quality", response_model=PredictionResponse)
-async def predict_water_quality(request: PredictionRequest):
+@app.get("/ready")
+async def readiness_check():
+    """Readiness check: 503 until models are loaded and warm-up has finished"""
+    if not getattr(app.state, "ready", False):
+        raise HTTPException(status_code=503, detail="Warming up")
+    return {"status": "ready", "warmup_seconds": app.state.warmup}
+
+@app.get("/debug/imports")
+async def get_import_report():
+    """Per-module import cost at startup, plus modules imported lazily since"""
+    return import_timer.report()
+
+# Responses are encoded by hand (see the serialization stage), in exactly these models' shapes
+@app.post("/predict/water-quality", response_model=Union[PredictionResponse, DegradedPredictionResponse])
+async def predict_water_quality(
+    request: PredictionRequest,
+    tenant_id: Optional[str] = Header(None, alias="X-Tenant-ID"),
+):
     """Predict water quality based on sensor readings"""
+    metrics.observe_parse("predict_water_quality")
+    tenant = request_tenant(tenant_id, [r.sensor_id for r in request.readings[:1]])
+    degraded = shed_load("predict_water_quality", tenant, len(request.readings))
+    admit(tenant, len(request.readings))
     try:
         # Extract features from readings
-        features = np.array([
-            [r.ph, r.temperature, r.turbidity, r.dissolved_oxygen, r.conductivity]
-            for r in request.readings
-        ])
+        with metrics.stage("predict_water_quality", "features"):
+            features = extract_features(request.readings)
         
-        # Make predictions
-        predictions = quality_model.predict(features)
+        # Make predictions (only threshold anomaly flags when degraded)
+        with metrics.stage("predict_water_quality", "model"):
+            if degraded:
+                flags = threshold_detector.detect(features)
+            else:
+                model_version, predictions = await score_batched(quality_batcher, features, tenant)
         
-        # Add sensor IDs to predictions
-        for idx, pred in enumerate(predictions):
-            pred["sensor_id"] = request.readings[idx].sensor_id
-            pred["timestamp"] = request.readings[idx].timestamp.isoformat()
+        sensor_ids = [r.sensor_id for r in request.readings]
+        timestamps = [r.timestamp for r in request.readings]
+        if degraded:
+            with metrics.stage("predict_water_quality", "serialization"):
+                return JSONResponse({
+                    "predictions": [],
+                    "anomalies": anomaly_results(request.readings, flags),
+                    "model_version": threshold_detector.version,
+                    "confidence": 0.0,
+                    "degraded": True
+                })
+        # Degraded responses are not model-scored, so only full predictions are rolled up
+        record_rollups(sensor_ids, timestamps, features)
+        record_latest_risk(sensor_ids, timestamps, predictions.quality_score)
         
-        return PredictionResponse(
-            predictions=predictions,
-            model_version=quality_model.version,
-            confidence=0.92
-        )
+        with metrics.stage("predict_water_quality", "serialization"):
+            predictions = predictions.to_dicts()
+            
+            # Add sensor IDs to predictions
+            for idx, pred in enumerate(predictions):
+                pred["sensor_id"] = request.readings[idx].sensor_id
+                pred["timestamp"] = request.readings[idx].timestamp.isoformat()
+            enrich_results(predictions, [pred["sensor_id"] for pred in predictions])
+            
+            # Encoded here (same shape as PredictionResponse) so the stage covers the response body
+            return JSONResponse({
+                "predictions": predictions,
+                "model_version": model_version,
+                "confidence": 0.92
+            })
     
+    except DeadlineExceeded:
+        raise overloaded(fair_queue.expected_delay(tenant, 0))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
-@app.post("/detect/anomalies", response_model=AnomalyDetectionResponse)
-async def detect_anomalies(request: AnomalyDetectionRequest):
+def anomaly_results(readings: List[SensorReading], flags: AnomalyFlags) -> List[dict]:
+    """Flagged readings as response dicts, with their sensor and timestamp"""
+    anomalies = flags.to_dicts()
+    for anomaly in anomalies:
+        idx = anomaly["reading_index"]
+        anomaly["sensor_id"] = readings[idx].sensor_id
+        anomaly["timestamp"] = readings[idx].timestamp.isoformat()
+    enrich_results(anomalies, [anomaly["sensor_id"] for anomaly in anomalies])
+    return anomalies
+
+@app.post("/detect/anomalies", response_model=Union[AnomalyDetectionResponse, DegradedAnomalyDetectionResponse])
+async def detect_anomalies(
+    request: AnomalyDetectionRequest,
+    tenant_id: Optional[str] = Header(None, alias="X-Tenant-ID"),
+):
     """Detect anomalies in sensor readings"""
+    metrics.observe_parse("detect_anomalies")
+    tenant = request_tenant(tenant_id, [r.sensor_id for r in request.readings[:1]])
+    degraded = shed_load("detect_anomalies", tenant, len(request.readings))
+    admit(tenant, len(request.readings))
     try:
         # Extract features from readings
-        features = np.array([
-            [r.ph, r.temperature, r.turbidity, r.dissolved_oxygen, r.conductivity]
-            for r in request.readings
-        ])
+        with metrics.stage("detect_anomalies", "features"):
+            features = extract_features(request.readings)
         
-        # Detect anomalies
-        anomalies = anomaly_detector.detect(features)
+        # Detect anomalies (with the built-in threshold rules when degraded)
+        with metrics.stage("detect_anomalies", "model"):
+            if degraded:
+                flags = threshold_detector.detect(features)
+            else:
+                _, flags = await score_batched(anomaly_batcher, features, tenant)
+        
+        with metrics.stage("detect_anomalies", "serialization"):
+            # Add sensor information
+            anomalies = anomaly_results(request.readings, flags)
+            
+            # Calculate overall anomaly score
+            anomaly_score = len(anomalies) / len(request.readings) if request.readings else 0.0
+            
+            response = {
+                "anomalies": anomalies,
+                "anomaly_score": round(anomaly_score, 3)
+            }
+            if degraded:
+                response["degraded"] = True
+            return JSONResponse(response)
+    
+    except DeadlineExceeded:
+        raise overloaded(fair_queue.expected_delay(tenant, 0))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Detection error: {str(e)}")
+
+@app.post("/detect/anomalies/online", response_model=AnomalyDetectionResponse)
+async def detect_anomalies_online(request: AnomalyDetectionRequest):
+    """Detect anomalies against each sensor's rolling history (z-score and rate of change)"""
+    try:
+        features = extract_features(request.readings)
+        
+        anomalies = online_detector.detect([r.sensor_id for r in request.readings], features).to_dicts()
+        metrics.observe_scoring("online_anomaly_detector", len(features), len(anomalies), detector="online")
         
-        # Add sensor information
         for anomaly in anomalies:
             idx = anomaly["reading_index"]
             anomaly["sensor_id"] = request.readings[idx].sensor_id
             anomaly["timestamp"] = request.readings[idx].timestamp.isoformat()
+        enrich_results(anomalies, [anomaly["sensor_id"] for anomaly in anomalies])
         
-        # Calculate overall anomaly score
-        anomaly_score = len(anomalies) / len(request.readings) if request.readings else 0
+        anomaly_score = len(anomalies) / len(request.readings) if request.readings else 0.0
         
         return AnomalyDetectionResponse(
             anomalies=anomalies,
@@ -198,22 +756,402 @@ async def detect_anomalies(request: AnomalyDetectionRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Detection error: {str(e)}")
 
+@app.post("/alerts/evaluate", response_model=AlertEvaluationResponse)
+async def evaluate_alert_rules(
+    request: AlertEvaluationRequest,
+    tenant_id: str = Header(..., alias="X-Tenant-ID"),
+    persist: bool = True,
+):
+    """Evaluate the tenant's enabled alert rules against readings, writing fired alerts to alert.alerts"""
+    store = getattr(app.state, "alert_store", None)
+    if store is None:
+        raise HTTPException(status_code=503, detail="Alert rules are not loaded (DATABASE_URL)")
+    try:
+        features = as_feature_matrix(extract_features(request.readings))
+        compiled, fired = alert_rules.evaluate(tenant_id, features)
+        records = alert_records(
+            compiled,
+            fired,
+            tenant_id,
+            [r.sensor_id for r in request.readings],
+            [r.timestamp.isoformat() for r in request.readings],
+            features,
+        )
+        
+        written = 0
+        if persist and records:
+            written = await asyncio.to_thread(store.insert_alerts, records)
+        
+        tenant = alert_rules.tenant_index(tenant_id)
+        return JSONResponse({
+            "alerts": records,
+            "rules_evaluated": int(compiled.tenant_rule_counts[tenant]) if 0 <= tenant < len(compiled.tenant_rule_counts) else 0,
+            "alerts_written": written
+        })
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Alert evaluation error: {str(e)}")
+
+@app.post("/models/online/checkpoint")
+async def checkpoint_online_detector():
+    """Write the online detector state to ONLINE_STATE_PATH"""
+    if not ONLINE_STATE_PATH:
+        raise HTTPException(status_code=409, detail="ONLINE_STATE_PATH is not configured")
+    online_detector.checkpoint(ONLINE_STATE_PATH)
+    return {"path": ONLINE_STATE_PATH, "sensors": online_detector.size}
+
+async def read_columnar_features(request: Request) -> np.ndarray:
+    """Read a columnar request body (JSON parallel arrays or binary blocks) into a feature matrix"""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in ("application/json", BINARY_CONTENT_TYPE):
+        raise HTTPException(
+            status_code=415, detail=f"Columnar bodies are application/json or {BINARY_CONTENT_TYPE}"
+        )
+    body = await request.body()
+    try:
+        if content_type == "application/json":
+            return columns_to_features(json.loads(body), FEATURE_NAMES)
+        return decode_features(body, len(FEATURE_NAMES))
+    except ValueError as e:
+        # ColumnarFormatError, and JSON that does not parse or is not UTF-8
+        raise HTTPException(status_code=400, detail=f"Invalid columnar body: {str(e)}")
+
+@app.post("/predict/water-quality/columnar")
+async def predict_water_quality_columnar(request: Request):
+    """Predict water quality for a columnar batch, returning columnar results in row order"""
+    features = await read_columnar_features(request)
+    tenant = request_tenant(request.headers.get("x-tenant-id"))
+    degraded = shed_load("predict_water_quality_columnar", tenant, len(features))
+    admit(tenant, len(features))
+    try:
+        if degraded:
+            return JSONResponse({
+                **flagged_columns(threshold_detector.detect(features)),
+                "model_version": threshold_detector.version,
+                "degraded": True
+            })
+        async with fair_queue.turn(tenant, len(features), request_deadline.get()):
+            model_version, predictions = await run_quality_model(features)
+        
+        return JSONResponse({
+            "quality_score": predictions.quality_score.tolist(),
+            "quality_level": predictions.quality_level.tolist(),
+            "risk_level": predictions.risk_level.tolist(),
+            "model_version": model_version,
+            "confidence": 0.92
+        })
+    
+    except DeadlineExceeded:
+        raise overloaded(fair_queue.expected_delay(tenant, 0))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+def flagged_columns(flags: AnomalyFlags) -> dict:
+    """Flagged rows of a columnar batch as parallel arrays, plus the overall anomaly score"""
+    indices = flags.indices
+    return {
+        "reading_index": indices.tolist(),
+        "anomaly_flags": flags.mask[indices].tolist(),
+        "severity": flags.severity(indices).tolist(),
+        "flag_names": ANOMALY_FLAGS,
+        "anomaly_score": round(len(indices) / len(flags), 3) if len(flags) else 0.0
+    }
+
+@app.post("/detect/anomalies/columnar")
+async def detect_anomalies_columnar(request: Request):
+    """Detect anomalies in a columnar batch, returning flagged rows as parallel arrays"""
+    features = await read_columnar_features(request)
+    tenant = request_tenant(request.headers.get("x-tenant-id"))
+    degraded = shed_load("detect_anomalies_columnar", tenant, len(features))
+    admit(tenant, len(features))
+    try:
+        if degraded:
+            return JSONResponse({**flagged_columns(threshold_detector.detect(features)), "degraded": True})
+        async with fair_queue.turn(tenant, len(features), request_deadline.get()):
+            _, flags = await run_anomaly_detector(features)
+        
+        return JSONResponse(flagged_columns(flags))
+    
+    except DeadlineExceeded:
+        raise overloaded(fair_queue.expected_delay(tenant, 0))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Detection error: {str(e)}")
+
+@app.post("/analyze/images")
+async def analyze_images(request: Request):
+    """Classify water-sample photos uploaded as multipart/form-data files"""
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > IMAGE_MAX_FILES * IMAGE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"At most {IMAGE_MAX_FILES} images of {IMAGE_MAX_BYTES} bytes")
+    form = await request.form(max_files=IMAGE_MAX_FILES, max_fields=IMAGE_MAX_FILES)
+    try:
+        uploads = [value for _, value in form.multi_items() if isinstance(value, UploadFile)]
+        if not uploads:
+            raise HTTPException(status_code=400, detail="Expected at least one image file")
+        images = []
+        for upload in uploads:
+            data = await upload.read(IMAGE_MAX_BYTES + 1)
+            if len(data) > IMAGE_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"{upload.filename} exceeds {IMAGE_MAX_BYTES} bytes")
+            images.append(data)
+    finally:
+        await form.close()
+    
+    try:
+        results = await image_pipeline.analyze(images)
+        return {
+            "results": [{"filename": upload.filename, **result} for upload, result in zip(uploads, results)],
+            "model_version": registry.get(IMAGE_ANALYZER).version,
+        }
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Image analysis error: {str(e)}")
+
+async def score_record_chunk(chunk: RecordChunk, tenant_id: Optional[str] = None) -> bytes:
+    """Score one chunk of NDJSON readings and serialize the results as NDJSON"""
+    results = [{"line": line, "error": error} for line, error in chunk.errors]
+    
+    readings, valid, rollup_rows = [], [], []
+    for line, record in zip(chunk.line_numbers, chunk.records):
+        try:
+            readings.append([float(record[name]) for name in FEATURE_NAMES])
+            valid.append((line, record))
+        except (KeyError, TypeError, ValueError) as e:
+            results.append({"line": line, "error": f"invalid reading: {str(e)}"})
+            continue
+        try:
+            rollup_rows.append((str(record["sensor_id"]), datetime.fromisoformat(record["timestamp"]), len(readings) - 1))
+        except (KeyError, TypeError, ValueError):
+            pass  # scored, but without a sensor and time it cannot be rolled up
+    
+    if readings:
+        features = np.array(readings, dtype=np.float64)
+        # Streams are paced to the tenant's rate limit rather than rejected mid-way
+        tenant = request_tenant(tenant_id, [str(valid[0][1].get("sensor_id", ""))])
+        await fair_queue.pace(tenant, len(features))
+        async with fair_queue.turn(tenant, len(features)):
+            _, predictions = await run_quality_model(features)
+            _, flags = await run_anomaly_detector(features)
+        if rollup_rows:
+            sensor_ids, timestamps, rows = zip(*rollup_rows)
+            record_rollups(list(sensor_ids), list(timestamps), features[list(rows)])
+            record_latest_risk(list(sensor_ids), list(timestamps), predictions.quality_score[list(rows)])
+        for (line, record), score, quality, risk, mask in zip(
+            valid,
+            predictions.quality_score.tolist(),
+            predictions.quality_level.tolist(),
+            predictions.risk_level.tolist(),
+            flags.mask.tolist(),
+        ):
+            results.append({
+                "line": line,
+                "sensor_id": record.get("sensor_id"),
+                "timestamp": record.get("timestamp"),
+                "quality_score": score,
+                "quality_level": quality,
+                "risk_level": risk,
+                "anomaly_types": FLAG_NAMES[mask],
+            })
+        scored = results[-len(valid):]
+        enrich_results(scored, [str(result["sensor_id"]) for result in scored])
+    
+    # Chunks are consecutive lines, so results come out in input order
+    results.sort(key=lambda result: result["line"])
+    return dumps_lines(results)
+
+@app.post("/predict/stream")
+async def predict_stream(request: Request):
+    """Score an unbounded NDJSON stream of readings chunk by chunk, streaming NDJSON results back"""
+    async def results():
+        # The request body is only pulled as fast as the client consumes results
+        async for chunk in iter_record_chunks(request.stream(), STREAM_CHUNK_SIZE):
+            yield await score_record_chunk(chunk, request.headers.get("x-tenant-id"))
+    
+    return DuplexStreamingResponse(results(), media_type="application/x-ndjson")
+
+@app.get("/metrics/batching")
+async def get_batching_metrics():
+    """Micro-batcher queue depth, batch size and wait time, plus prediction cache hit counts"""
+    return {
+        "water_quality": quality_batcher.stats(),
+        "anomaly_detector": anomaly_batcher.stats(),
+        "image_analyzer": image_pipeline.batcher.stats(),
+        "prediction_cache": prediction_cache.stats() if prediction_cache is not None else None
+    }
+
+@app.get("/metrics/tenants")
+async def get_tenant_metrics():
+    """Fair-queue occupancy and throughput, and per-tenant plan, rate limit, admissions and queue wait time"""
+    return {**fair_queue.stats(), "degraded_mode": DEGRADED_MODE}
+
+@app.get("/admin/profile")
+async def get_profile(
+    reset: bool = False,
+    token: Optional[str] = Header(None, alias="X-Profile-Token"),
+):
+    """Collapsed stacks sampled from profiled requests (flamegraph.pl / speedscope input)"""
+    if not profiler.authorized(token):
+        raise HTTPException(status_code=403, detail="X-Profile-Token does not match PROFILING_ADMIN_TOKEN")
+    stats = profiler.stats()
+    return Response(
+        profiler.collapsed(reset),
+        media_type="text/plain",
+        headers={"X-Profiled-Requests": str(stats["requests"]), "X-Profile-Samples": str(stats["samples"])},
+    )
+
+@app.get("/analytics/daily-quality")
+async def get_daily_quality(
+    start: date,
+    end: date,
+    sensor_id: Optional[List[str]] = Query(None),
+):
+    """Per-sensor daily count, mean, std, min and max of each feature for days in [start, end)"""
+    store = getattr(app.state, "rollup_store", None)
+    if store is None:
+        raise HTTPException(status_code=503, detail="Daily rollups are not enabled (DATABASE_URL)")
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    rows = await asyncio.to_thread(store.query, start, end, sensor_id)
+    return {"days": [summarize(row) for row in rows], "pending_readings": daily_rollups.pending}
+
+@app.get("/maps/risk-heatmap")
+async def get_risk_heatmap(
+    zoom: int = Query(..., ge=0, le=22),
+    west: float = Query(-180.0, ge=-180, le=180),
+    south: float = Query(-90.0, ge=-90, le=90),
+    east: float = Query(180.0, ge=-180, le=180),
+    north: float = Query(90.0, ge=-90, le=90),
+    tenant_id: str = Header(..., alias="X-Tenant-ID"),
+):
+    """Latest water quality risk of the tenant's sensors, aggregated into map tiles within a bounding box
+
+    Map clients zoom in to 22; past MAX_ZOOM the finest tiles are returned,
+    with the zoom they belong to.
+    """
+    heatmap = getattr(app.state, "heatmap", None)
+    if heatmap is None:
+        raise HTTPException(status_code=503, detail="Risk heatmap is not available (DATABASE_URL)")
+    if south > north:
+        raise HTTPException(status_code=400, detail="south must not be above north")
+    tiles = heatmap.query(tenant_id, zoom, west, south, east, north)
+    return JSONResponse({
+        "zoom": min(zoom, MAX_ZOOM),
+        "tiles": tiles,
+        "generated_at": heatmap.built_at.isoformat(),
+    })
+
+@app.get("/timeseries/readings")
+async def get_reading_series(
+    sensor_id: List[str] = Query(...),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    width: int = Query(800, ge=1, le=MAX_WIDTH),
+    method: str = "lttb",
+    metrics: Optional[str] = None,
+    cursor: Optional[str] = None,
+):
+    """Readings of each sensor downsampled to `width` time buckets, or only what is new since `cursor`"""
+    store = getattr(app.state, "series_store", None)
+    if store is None:
+        raise HTTPException(status_code=503, detail="Time series are not available (DATABASE_URL)")
+    try:
+        names = parse_metrics(metrics)
+        end_seconds = float(epoch_seconds([end or datetime.now(timezone.utc)])[0])
+        if cursor is not None:
+            grid = SeriesCursor.decode(cursor)
+            begin = grid.resume_from
+        elif start is None:
+            raise ValueError("start is required without a cursor")
+        elif method not in METHODS:
+            raise ValueError(f"method must be one of {list(METHODS)}")
+        else:
+            begin = float(epoch_seconds([start])[0])
+            grid = SeriesCursor(begin, (end_seconds - begin) / width, method, begin)
+        if end_seconds <= begin or grid.bucket <= 0:
+            raise ValueError("end must be after start")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        sensors, t, values = await asyncio.to_thread(store.fetch_series, sensor_id, begin, end_seconds, names)
+        series = await asyncio.to_thread(downsample_series, sensors, t, values, names, grid)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Time series error: {str(e)}")
+    
+    # The bucket holding `end` may still receive readings, so the next poll starts over from it
+    next_grid = SeriesCursor(grid.anchor, grid.bucket, grid.method, max(grid.bucket_start(end_seconds), begin))
+    return JSONResponse({
+        "method": grid.method,
+        "bucket_seconds": grid.bucket,
+        "replace_from": round(begin * 1000),
+        "series": series,
+        "cursor": next_grid.encode(),
+    })
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
 @app.get("/models/info")
 async def get_model_info():
     """Get information about loaded models"""
+    quality_model = registry.get(WATER_QUALITY)
+    anomaly_detector = registry.get(ANOMALY_DETECTOR)
+    image_analyzer = registry.get(IMAGE_ANALYZER)
     return {
         "water_quality_model": {
             "version": quality_model.version,
             "type": "rule-based",
-            "features": ["ph", "temperature", "turbidity", "dissolved_oxygen", "conductivity"]
+            "features": FEATURE_NAMES
         },
         "anomaly_detector": {
             "version": anomaly_detector.version,
+            "type": "threshold",
+            "features": FEATURE_NAMES
+        },
+        "image_analyzer": {
+            "version": image_analyzer.version,
+            "type": "rule-based",
+            "classes": IMAGE_CLASSES.tolist(),
+            "input_size": IMAGE_INPUT_SIZE
+        },
+        "active_versions": registry.info(),
+        "online_anomaly_detector": {
+            "version": online_detector.version,
             "type": "statistical",
-            "features": ["ph", "temperature", "turbidity", "dissolved_oxygen", "conductivity"]
+            "features": FEATURE_NAMES,
+            "sensors_tracked": online_detector.size,
+            "capacity": online_detector.capacity,
+            "span": online_detector.span,
+            "state_bytes": online_detector.nbytes
         }
     }
 
+def share_online_state():
+    """Before forking workers: restore the online detector and move its state to shared memory"""
+    restore_online_detector()
+    online_detector.share()
+
+def release_online_state():
+    """After the last worker exited: checkpoint the shared state and free it"""
+    save_online_detector()
+    online_detector.unshare()
+
+def serve():
+    """Serve from SERVICE_WORKERS forked worker processes (see app.prefork)"""
+    from app.prefork import Supervisor
+    Supervisor(
+        app,
+        host="0.0.0.0",
+        port=8086,
+        workers=SERVICE_WORKERS,
+        graceful_timeout=GRACEFUL_TIMEOUT,
+        on_start=share_online_state,
+        on_exit=release_online_state,
+    ).run()
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8086)
+    # `python -m app.prefork` additionally aggregates /metrics across workers
+    serve()
@@ -0,0 +1,181 @@
+"""
+Prometheus metrics for the ML service
+
+Served from /metrics and scraped alongside the Spring services' actuator
+endpoints. Request latency is split into stages so a slow endpoint can be
+attributed to parsing, feature extraction, the model or serialization:
+
+- parse: from the request reaching the app to the handler starting (body read,
+  JSON decoding and validation)
+- features: building the feature matrix
+- model: scoring, including micro-batch queueing and the prediction cache
+- serialization: building and encoding the response body
+
+Under `python -m app.prefork` (PROMETHEUS_MULTIPROC_DIR set) every worker
+writes its samples to per-process files, and a scrape of any worker returns
+the aggregate of all of them.
+"""
+
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+STAGE_SECONDS = Histogram(
+    "aquasense_ml_stage_seconds",
+    "Time spent in each stage of a scoring request",
+    ["endpoint", "stage"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+MODEL_BATCH_ROWS = Histogram(
+    "aquasense_ml_model_batch_rows",
+    "Readings per model call",
+    ["model"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536, 262144, 1048576),
+)
+MICRO_BATCH_REQUESTS = Histogram(
+    "aquasense_ml_micro_batch_requests",
+    "Requests coalesced into one micro-batch",
+    ["model"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+MICRO_BATCH_WAIT_SECONDS = Histogram(
+    "aquasense_ml_micro_batch_wait_seconds",
+    "Time a request waited in the micro-batch queue",
+    ["model"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+READINGS_SCORED = Counter(
+    "aquasense_ml_readings_scored_total",
+    "Readings scored, by model",
+    ["model"],
+)
+ANOMALOUS_READINGS = Counter(
+    "aquasense_ml_anomalous_readings_total",
+    "Readings flagged with at least one anomaly, by detector",
+    ["detector"],
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "aquasense_ml_event_loop_lag_seconds",
+    "How late the event loop woke up a periodic timer",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+EVENT_LOOP_LAG_LAST = Gauge(
+    "aquasense_ml_event_loop_lag_last_seconds",
+    "Event loop lag at the last probe",
+    multiprocess_mode="livemax",
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "aquasense_ml_requests_in_flight",
+    "HTTP requests currently being handled",
+    multiprocess_mode="livesum",
+)
+
+TENANT_QUEUE_WAIT_SECONDS = Histogram(
+    "aquasense_ml_tenant_queue_wait_seconds",
+    "Time a scoring request waited in the fair queue for its tenant's turn, by tenant plan",
+    ["plan"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+TENANT_REJECTED_REQUESTS = Counter(
+    "aquasense_ml_tenant_rejected_requests_total",
+    "Requests rejected by the tenant's rate limit, by tenant plan",
+    ["plan"],
+)
+SHED_REQUESTS = Counter(
+    "aquasense_ml_shed_requests_total",
+    "Requests rejected or dropped because they could not finish before their deadline",
+    ["reason"],
+)
+DEGRADED_REQUESTS = Counter(
+    "aquasense_ml_degraded_requests_total",
+    "Requests answered by the threshold anomaly detector alone, skipping the models",
+    ["endpoint"],
+)
+
+# Set when a request reaches the app, read by handlers to time the parse stage
+request_started: ContextVar[float] = ContextVar("request_started", default=0.0)
+
+class InFlightMiddleware:
+    """ASGI middleware tracking in-flight HTTP requests and when each one arrived"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request_started.set(time.perf_counter())
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+
+def observe_parse(endpoint: str):
+    """Record the parse stage: time from the request arriving to the handler starting"""
+    started = request_started.get()
+    if started:
+        STAGE_SECONDS.labels(endpoint, "parse").observe(time.perf_counter() - started)
+
+@contextmanager
+def stage(endpoint: str, name: str):
+    """Time a block of a handler as one stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(endpoint, name).observe(time.perf_counter() - start)
+
+def batch_observer(model: str):
+    """MicroBatcher.on_batch hook recording requests per batch and queue waits"""
+    requests = MICRO_BATCH_REQUESTS.labels(model)
+    wait = MICRO_BATCH_WAIT_SECONDS.labels(model)
+
+    def on_batch(rows: int, n_requests: int, waits: List[float]):
+        requests.observe(n_requests)
+        for seconds in waits:
+            wait.observe(seconds)
+
+    return on_batch
+
+def observe_scoring(model: str, rows: int, anomalous: int = 0, detector: str = ""):
+    """Record one model call: its batch size and, for detectors, how many readings were flagged"""
+    MODEL_BATCH_ROWS.labels(model).observe(rows)
+    READINGS_SCORED.labels(model).inc(rows)
+    if detector:
+        ANOMALOUS_READINGS.labels(detector).inc(anomalous)
+
+def observe_tenant_wait(plan: str, seconds: float):
+    TENANT_QUEUE_WAIT_SECONDS.labels(plan).observe(seconds)
+
+def observe_tenant_rejected(plan: str):
+    TENANT_REJECTED_REQUESTS.labels(plan).inc()
+
+def observe_shed(reason: str):
+    SHED_REQUESTS.labels(reason).inc()
+
+def observe_degraded(endpoint: str):
+    DEGRADED_REQUESTS.labels(endpoint).inc()
+
+def render() -> tuple:
+    """Current metrics in the Prometheus text format, with its content type"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+async def monitor_event_loop(interval: float = 0.5):
+    """Measure how late the loop wakes a sleeping task; sustained lag means blocking work on the loop"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        EVENT_LOOP_LAG_SECONDS.observe(lag)
+        EVENT_LOOP_LAG_LAST.set(lag)
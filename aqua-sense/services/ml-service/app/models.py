@@ -0,0 +1,262 @@
+"""
+AquaSense ML models
+Rule-based water quality, anomaly and sample photo models plus their columnar result types
+"""
+
+from typing import List, Optional
+
+import numpy as np
+
+# Feature column order shared by every model
+FEATURE_NAMES = ["ph", "temperature", "turbidity", "dissolved_oxygen", "conductivity"]
+PH, TEMPERATURE, TURBIDITY, DISSOLVED_OXYGEN, CONDUCTIVITY = range(len(FEATURE_NAMES))
+
+# Quality score bands (np.digitize edges -> label index)
+QUALITY_BANDS = [40, 60, 80]
+QUALITY_LEVELS = np.array(["poor", "fair", "good", "excellent"])
+RISK_BANDS = [50, 70]
+RISK_LEVELS = np.array(["high", "medium", "low"])
+
+def as_feature_matrix(features) -> np.ndarray:
+    """Coerce features to a float64 (n_readings, n_features) matrix"""
+    return np.asarray(features, dtype=np.float64).reshape(-1, len(FEATURE_NAMES))
+
+class QualityPredictions:
+    """Columnar water quality predictions, one entry per reading"""
+
+    def __init__(self, quality_score: np.ndarray, quality_level: np.ndarray, risk_level: np.ndarray):
+        self.quality_score = quality_score
+        self.quality_level = quality_level
+        self.risk_level = risk_level
+
+    @classmethod
+    def from_scores(cls, scores: np.ndarray) -> "QualityPredictions":
+        """Derive the quality and risk bands from raw scores"""
+        return cls(
+            quality_score=np.maximum(scores, 0),
+            quality_level=QUALITY_LEVELS[np.digitize(scores, QUALITY_BANDS)],
+            risk_level=RISK_LEVELS[np.digitize(scores, RISK_BANDS)],
+        )
+
+    def pack(self) -> Optional[np.ndarray]:
+        """One int64 per reading holding the score and the level and risk band codes
+
+        None when a score is not a non-negative integer or a band is not one of
+        QUALITY_LEVELS / RISK_LEVELS (a custom model's output), as such results
+        cannot be rebuilt from the packed value.
+        """
+        scores = np.asarray(self.quality_score)
+        quality = np.asarray(self.quality_level)[:, None] == QUALITY_LEVELS
+        risk = np.asarray(self.risk_level)[:, None] == RISK_LEVELS
+        integral = np.all(scores == np.round(scores)) and np.all(scores >= 0)
+        if not (integral and quality.any(axis=1).all() and risk.any(axis=1).all()):
+            return None
+        return (scores.astype(np.int64) << 4) | (quality.argmax(axis=1) << 2) | risk.argmax(axis=1)
+
+    @classmethod
+    def unpack(cls, values: np.ndarray) -> "QualityPredictions":
+        """Predictions from pack() values"""
+        return cls(values >> 4, QUALITY_LEVELS[(values >> 2) & 3], RISK_LEVELS[values & 3])
+
+    def __len__(self) -> int:
+        return len(self.quality_score)
+
+    def __getitem__(self, rows: slice) -> "QualityPredictions":
+        return QualityPredictions(self.quality_score[rows], self.quality_level[rows], self.risk_level[rows])
+
+    def to_dicts(self) -> List[dict]:
+        """Materialize per-reading dicts (response edge only)"""
+        return [
+            {"quality_score": score, "quality_level": quality, "risk_level": risk}
+            for score, quality, risk in zip(
+                self.quality_score.tolist(), self.quality_level.tolist(), self.risk_level.tolist()
+            )
+        ]
+
+# Mock model for demonstration
+class WaterQualityModel:
+    """Water quality prediction model"""
+    
+    def __init__(self):
+        self.version = "1.0.0"
+    
+    def predict(self, features: np.ndarray) -> QualityPredictions:
+        """Predict water quality based on sensor readings"""
+        # Simple rule-based prediction for demonstration, evaluated column-wise
+        features = as_feature_matrix(features)
+        ph = features[:, PH]
+        temp = features[:, TEMPERATURE]
+        
+        # Quality score (0-100)
+        score = np.full(len(features), 100, dtype=np.int64)
+        
+        # pH check (optimal: 6.5-8.5)
+        score -= 20 * ((ph < 6.5) | (ph > 8.5))
+        
+        # Temperature check (optimal: 15-25°C)
+        score -= 15 * ((temp < 15) | (temp > 25))
+        
+        # Turbidity check (lower is better)
+        score -= 25 * (features[:, TURBIDITY] > 5)
+        
+        # Dissolved oxygen check (optimal: > 5 mg/L)
+        score -= 30 * (features[:, DISSOLVED_OXYGEN] < 5)
+        
+        # Conductivity check
+        score -= 10 * (features[:, CONDUCTIVITY] > 1000)
+        
+        return QualityPredictions.from_scores(score)
+
+# Anomaly flag bits, in reporting order
+ANOMALY_FLAGS = ["extreme_ph", "extreme_temperature", "high_turbidity", "low_oxygen", "high_conductivity"]
+EXTREME_PH, EXTREME_TEMPERATURE, HIGH_TURBIDITY, LOW_OXYGEN, HIGH_CONDUCTIVITY = (
+    np.uint8(1 << bit) for bit in range(len(ANOMALY_FLAGS))
+)
+
+# Lookup tables indexed by bitmask value
+FLAG_COUNT = np.array([bin(mask).count("1") for mask in range(1 << len(ANOMALY_FLAGS))], dtype=np.uint8)
+FLAG_NAMES = [
+    [name for bit, name in enumerate(ANOMALY_FLAGS) if mask & (1 << bit)]
+    for mask in range(1 << len(ANOMALY_FLAGS))
+]
+SEVERITY_BANDS = [2, 3]
+SEVERITY_LEVELS = np.array(["low", "medium", "high"])
+
+class AnomalyFlags:
+    """Columnar anomaly detection result: one uint8 flag bitmask per reading"""
+
+    def __init__(self, mask: np.ndarray):
+        self.mask = mask
+
+    def __len__(self) -> int:
+        return len(self.mask)
+
+    def __getitem__(self, rows: slice) -> "AnomalyFlags":
+        return AnomalyFlags(self.mask[rows])
+
+    @property
+    def indices(self) -> np.ndarray:
+        """Indices of readings with at least one anomaly flag"""
+        return np.flatnonzero(self.mask)
+
+    @property
+    def flag_count(self) -> np.ndarray:
+        """Number of anomaly flags raised per reading (popcount of the mask)"""
+        return FLAG_COUNT[self.mask]
+
+    def severity(self, indices: np.ndarray) -> np.ndarray:
+        """Severity labels for the given (flagged) reading indices"""
+        return SEVERITY_LEVELS[np.digitize(FLAG_COUNT[self.mask[indices]], SEVERITY_BANDS)]
+
+    def to_dicts(self) -> List[dict]:
+        """Materialize dicts for flagged readings only (response edge only)"""
+        indices = self.indices
+        return [
+            {"reading_index": idx, "anomaly_types": list(FLAG_NAMES[mask]), "severity": severity}
+            for idx, mask, severity in zip(
+                indices.tolist(), self.mask[indices].tolist(), self.severity(indices).tolist()
+            )
+        ]
+
+class AnomalyDetector:
+    """Anomaly detection model"""
+    
+    def __init__(self):
+        self.version = "1.0.0"
+    
+    def detect(self, features: np.ndarray) -> AnomalyFlags:
+        """Detect anomalies in sensor readings"""
+        features = as_feature_matrix(features)
+        ph = features[:, PH]
+        temp = features[:, TEMPERATURE]
+        mask = np.zeros(len(features), dtype=np.uint8)
+        
+        # Check for anomalies
+        mask |= EXTREME_PH * ((ph < 4) | (ph > 10))
+        mask |= EXTREME_TEMPERATURE * ((temp < 0) | (temp > 40))
+        mask |= HIGH_TURBIDITY * (features[:, TURBIDITY] > 50)
+        mask |= LOW_OXYGEN * (features[:, DISSOLVED_OXYGEN] < 2)
+        mask |= HIGH_CONDUCTIVITY * (features[:, CONDUCTIVITY] > 2000)
+        
+        return AnomalyFlags(mask)
+
+# Sample photo classes and the per-channel normalization images are fed to models with
+IMAGE_CLASSES = np.array(["clear", "turbid", "algal_bloom", "foam", "oil_sheen", "discolored"])
+IMAGE_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGE_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+CONFIDENCE_SCALE = 1_000_000
+
+class ImageAnalyses:
+    """Columnar photo classification result: most likely class and its probability per image"""
+
+    def __init__(self, label: np.ndarray, confidence: np.ndarray):
+        self.label = label
+        self.confidence = confidence
+
+    @classmethod
+    def from_probabilities(cls, probabilities: np.ndarray) -> "ImageAnalyses":
+        label = np.argmax(probabilities, axis=1)
+        return cls(label, probabilities[np.arange(len(label)), label])
+
+    @property
+    def code(self) -> np.ndarray:
+        """Label and confidence packed into one integer per image (for the prediction cache)"""
+        confidence = np.minimum(np.round(self.confidence * CONFIDENCE_SCALE), CONFIDENCE_SCALE - 1)
+        return self.label.astype(np.int64) * CONFIDENCE_SCALE + confidence.astype(np.int64)
+
+    @classmethod
+    def from_codes(cls, codes: np.ndarray) -> "ImageAnalyses":
+        return cls(codes // CONFIDENCE_SCALE, (codes % CONFIDENCE_SCALE) / CONFIDENCE_SCALE)
+
+    def __len__(self) -> int:
+        return len(self.label)
+
+    def __getitem__(self, rows: slice) -> "ImageAnalyses":
+        return ImageAnalyses(self.label[rows], self.confidence[rows])
+
+    def to_dicts(self) -> List[dict]:
+        """Materialize per-image dicts (response edge only)"""
+        return [
+            {"label": label, "confidence": round(confidence, 4)}
+            for label, confidence in zip(IMAGE_CLASSES[self.label].tolist(), self.confidence.tolist())
+        ]
+
+def _pixel_mean(values: np.ndarray) -> np.ndarray:
+    """Mean over all pixels of each image"""
+    return values.reshape(len(values), -1).mean(axis=1)
+
+def _pixel_std(values: np.ndarray) -> np.ndarray:
+    """Standard deviation over all pixels of each image"""
+    return values.reshape(len(values), -1).std(axis=1)
+
+# Mock model for demonstration
+class ImageAnalyzer:
+    """Water sample photo classifier"""
+
+    def __init__(self):
+        self.version = "1.0.0"
+
+    def analyze(self, images: np.ndarray) -> ImageAnalyses:
+        """Classify a batch of normalized (n_images, 3, height, width) photos"""
+        # Simple colour statistics for demonstration, computed for the whole batch at once
+        rgb = np.clip(images * IMAGE_STD[:, None, None] + IMAGE_MEAN[:, None, None], 0, 1)
+        r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+        brightness = rgb.mean(axis=1)
+        saturation = rgb.max(axis=1) - rgb.min(axis=1)
+        scores = np.stack([
+            _pixel_mean(b - r) * 3 + 0.3 - _pixel_mean(saturation > 0.5),
+            _pixel_mean(np.minimum(r, g) - b) * 4 + _pixel_mean(brightness < 0.6) * 0.3,
+            _pixel_mean(g - np.maximum(r, b)) * 6,
+            _pixel_mean((brightness > 0.85) & (saturation < 0.1)) * 2,
+            (_pixel_std(r - g) + _pixel_std(g - b)) * _pixel_mean(brightness < 0.5) * 6,
+            _pixel_mean(r - np.maximum(g, b)) * 6 - 0.3,
+        ], axis=1) * 6
+        probabilities = np.exp(scores - scores.max(axis=1, keepdims=True))
+        return ImageAnalyses.from_probabilities(probabilities / probabilities.sum(axis=1, keepdims=True))
+
+# Registry names, built-in factories and scoring method of each model
+WATER_QUALITY = "water_quality"
+ANOMALY_DETECTOR = "anomaly_detector"
+IMAGE_ANALYZER = "image_analyzer"
+MODEL_FACTORIES = {WATER_QUALITY: WaterQualityModel, ANOMALY_DETECTOR: AnomalyDetector, IMAGE_ANALYZER: ImageAnalyzer}
+MODEL_METHODS = {WATER_QUALITY: "predict", ANOMALY_DETECTOR: "detect", IMAGE_ANALYZER: "analyze"}
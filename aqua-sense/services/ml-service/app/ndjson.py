@@ -0,0 +1,96 @@
+"""
+Newline-delimited JSON helpers for streaming endpoints
+
+Request bodies are consumed incrementally and handed out in fixed-size
+chunks of parsed records, so memory stays bounded by the chunk size no matter
+how long the stream is.
+"""
+
+import json
+from typing import AsyncIterator, List, Tuple
+
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+# Upper bound on a single line, so a missing newline cannot grow the buffer forever
+MAX_LINE_BYTES = 64 * 1024
+
+class DuplexStreamingResponse(StreamingResponse):
+    """Streaming response whose body iterator is allowed to keep reading the request body
+
+    StreamingResponse normally drains receive() in the background to watch for
+    client disconnects, which would steal the request body chunks from a
+    handler that is still consuming them. Here the request stream itself
+    reports the disconnect (ClientDisconnect) instead.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+class RecordChunk:
+    """A chunk of parsed NDJSON records plus the lines that failed to parse"""
+
+    def __init__(self):
+        self.records: List[dict] = []
+        self.line_numbers: List[int] = []
+        self.errors: List[Tuple[int, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.records) + len(self.errors)
+
+async def iter_record_chunks(
+    stream: AsyncIterator[bytes], chunk_size: int, max_line_bytes: int = MAX_LINE_BYTES
+) -> AsyncIterator[RecordChunk]:
+    """Split a byte stream into NDJSON records, yielding chunks of at most chunk_size lines"""
+    buffer = b""
+    line_number = 0
+    chunk = RecordChunk()
+
+    def add_line(line: bytes):
+        nonlocal line_number
+        line_number += 1
+        if not line.strip():
+            return
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            chunk.errors.append((line_number, str(e)))
+            return
+        chunk.records.append(record)
+        chunk.line_numbers.append(line_number)
+
+    skipping = False
+    async for data in stream:
+        if skipping:
+            # Discard the rest of an oversized line up to its newline
+            if b"\n" not in data:
+                continue
+            data = data.split(b"\n", 1)[1]
+            skipping = False
+
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            add_line(line)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = RecordChunk()
+
+        if len(buffer) > max_line_bytes:
+            line_number += 1
+            chunk.errors.append((line_number, f"line exceeds {max_line_bytes} bytes"))
+            buffer = b""
+            skipping = True
+
+    if buffer and not skipping:
+        add_line(buffer)
+    if len(chunk):
+        yield chunk
+
+def dumps_lines(items: List[dict]) -> bytes:
+    """Serialize records as NDJSON"""
+    return "".join(json.dumps(item, separators=(",", ":")) + "\n" for item in items).encode()
@@ -0,0 +1,311 @@
+"""
+Online per-sensor anomaly detection
+
+Keeps compact rolling state for every sensor in preallocated NumPy arrays:
+an exponentially weighted mean/variance per feature and the sensor's last
+reading. Each reading is scored against its own sensor's history (z-score
+and rate of change) and then folded into the state, so the cost per reading
+is O(1) regardless of how long a sensor has been reporting. The standard
+deviation is floored at a per-feature minimum, so a sensor that has reported
+a constant value still has readings that jump away from it flagged.
+
+Sensors are mapped to dense state slots through an open-addressing hash table
+keyed by a 64-bit hash of the sensor id, so the whole state is plain arrays
+that can be checkpointed to a single .npz file, or moved into one shared
+memory block that forked worker processes score and update together (under a
+process-shared lock, at a fixed capacity).
+"""
+
+import hashlib
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+# Per-feature rate-of-change limits between consecutive readings
+# (ph, temperature, turbidity, dissolved_oxygen, conductivity)
+DEFAULT_MAX_DELTA = (1.5, 5.0, 25.0, 3.0, 500.0)
+
+# Per-feature floor of the standard deviation z-scores divide by, about one
+# sensor resolution step (same feature order)
+DEFAULT_MIN_STD = (0.05, 0.1, 0.5, 0.1, 5.0)
+
+def sensor_key(sensor_id: str) -> int:
+    """Stable non-zero 64-bit key for a sensor id (0 marks an empty table entry)"""
+    key = int.from_bytes(hashlib.blake2b(sensor_id.encode(), digest_size=8).digest(), "little")
+    return key or 1
+
+def sensor_keys(sensor_ids: Sequence[str]) -> np.ndarray:
+    """Vector of sensor keys for a batch of sensor ids"""
+    return np.fromiter((sensor_key(sensor_id) for sensor_id in sensor_ids), dtype=np.uint64, count=len(sensor_ids))
+
+def occurrence_rank(slots: np.ndarray) -> np.ndarray:
+    """For each row, how many earlier rows in the batch share its slot"""
+    order = np.argsort(slots, kind="stable")
+    sorted_slots = slots[order]
+    starts = np.r_[0, np.flatnonzero(sorted_slots[1:] != sorted_slots[:-1]) + 1]
+    group_start = np.repeat(starts, np.diff(np.r_[starts, len(slots)]))
+    rank = np.empty(len(slots), dtype=np.int64)
+    rank[order] = np.arange(len(slots)) - group_start
+    return rank
+
+class OnlineAnomalies:
+    """Columnar online detection result: per-feature z-score and rate-of-change flag masks"""
+
+    def __init__(self, zscore: np.ndarray, zscore_mask: np.ndarray, roc_mask: np.ndarray, feature_names: List[str]):
+        self.zscore = zscore
+        self.zscore_mask = zscore_mask
+        self.roc_mask = roc_mask
+        self.feature_names = feature_names
+
+    def __len__(self) -> int:
+        return len(self.zscore_mask)
+
+    @property
+    def indices(self) -> np.ndarray:
+        """Indices of readings with at least one z-score or rate-of-change flag"""
+        return np.flatnonzero(self.zscore_mask | self.roc_mask)
+
+    def _names(self, mask: int) -> List[str]:
+        return [name for bit, name in enumerate(self.feature_names) if mask & (1 << bit)]
+
+    def to_dicts(self) -> List[dict]:
+        """Materialize dicts for flagged readings only (response edge only)"""
+        indices = self.indices
+        return [
+            {
+                "reading_index": idx,
+                "zscore_features": self._names(z_mask),
+                "rate_of_change_features": self._names(roc_mask),
+                "max_abs_zscore": round(max_z, 3),
+            }
+            for idx, z_mask, roc_mask, max_z in zip(
+                indices.tolist(),
+                self.zscore_mask[indices].tolist(),
+                self.roc_mask[indices].tolist(),
+                np.nan_to_num(np.nanmax(np.abs(self.zscore[indices]), axis=1, initial=0.0)).tolist(),
+            )
+        ]
+
+class OnlineAnomalyDetector:
+    """Stateful per-sensor anomaly detector with rolling statistics"""
+
+    STATE_ARRAYS = ("table_keys", "table_slots", "count", "mean", "var", "last")
+
+    def __init__(
+        self,
+        feature_names: List[str],
+        capacity: int = 100_000,
+        span: int = 60,
+        z_threshold: float = 4.0,
+        min_count: int = 10,
+        max_delta: Sequence[float] = DEFAULT_MAX_DELTA,
+        min_std: Sequence[float] = DEFAULT_MIN_STD,
+    ):
+        self.version = "1.0.0"
+        self.feature_names = list(feature_names)
+        self.span = span
+        self.alpha = 2.0 / (span + 1)
+        self.z_threshold = z_threshold
+        self.min_count = min_count
+        self.max_delta = np.asarray(max_delta, dtype=np.float32)
+        self.min_var = np.square(np.asarray(min_std, dtype=np.float32))
+        self._size = np.zeros(1, dtype=np.int64)
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        self._lock = threading.Lock()
+        self._allocate(capacity)
+
+    @property
+    def size(self) -> int:
+        """Number of sensors with a state slot"""
+        return int(self._size[0])
+
+    @size.setter
+    def size(self, value: int):
+        self._size[0] = value
+
+    @property
+    def shared(self) -> bool:
+        return self._shm is not None
+
+    def share(self) -> shared_memory.SharedMemory:
+        """Move the state into one shared memory block for processes forked after this call
+
+        Capacity is fixed from then on; readings of sensors beyond it are not
+        scored.
+        """
+        arrays = {name: getattr(self, name) for name in ("_size",) + self.STATE_ARRAYS}
+        offsets, total = {}, 0
+        for name, values in arrays.items():
+            offsets[name] = total
+            total += -(-values.nbytes // 64) * 64
+        shm = shared_memory.SharedMemory(create=True, size=total)
+        for name, values in arrays.items():
+            view = np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf, offset=offsets[name])
+            view[...] = values
+            setattr(self, name, view)
+        self._shm = shm
+        self._lock = multiprocessing.get_context("fork").Lock()
+        return shm
+
+    def unshare(self):
+        """Copy the state back to private memory and free the shared block (once workers are gone)"""
+        if self._shm is None:
+            return
+        for name in ("_size",) + self.STATE_ARRAYS:
+            setattr(self, name, getattr(self, name).copy())
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+        self._lock = threading.Lock()
+
+    def _allocate(self, capacity: int):
+        """Preallocate state for `capacity` sensors and a hash table at most half full"""
+        n_features = len(self.feature_names)
+        table_size = 1 << max(4, int(2 * capacity - 1).bit_length())
+        self.capacity = capacity
+        self.table_keys = np.zeros(table_size, dtype=np.uint64)
+        self.table_slots = np.full(table_size, -1, dtype=np.int32)
+        self.count = np.zeros(capacity, dtype=np.uint32)
+        self.mean = np.zeros((capacity, n_features), dtype=np.float32)
+        self.var = np.zeros((capacity, n_features), dtype=np.float32)
+        self.last = np.full((capacity, n_features), np.nan, dtype=np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the state arrays"""
+        return sum(getattr(self, name).nbytes for name in self.STATE_ARRAYS)
+
+    def _grow(self):
+        """Double the capacity, carrying over existing sensor state"""
+        old = {name: getattr(self, name) for name in self.STATE_ARRAYS}
+        self._allocate(self.capacity * 2)
+        for name in ("count", "mean", "var", "last"):
+            getattr(self, name)[: self.size] = old[name][: self.size]
+        occupied = old["table_keys"] != 0
+        for key, slot in zip(old["table_keys"][occupied].tolist(), old["table_slots"][occupied].tolist()):
+            self._insert(key, slot)
+
+    def _insert(self, key: int, slot: Optional[int] = None) -> int:
+        """Find or claim the table entry for `key`, assigning a new slot if needed"""
+        mask = len(self.table_keys) - 1
+        pos = key & mask
+        while True:
+            existing = int(self.table_keys[pos])
+            if existing == key:
+                return int(self.table_slots[pos])
+            if existing == 0:
+                if slot is None:
+                    if self.size >= self.capacity:
+                        if self.shared:
+                            return -1
+                        self._grow()
+                        return self._insert(key)
+                    slot = self.size
+                    self.size += 1
+                self.table_keys[pos] = key
+                self.table_slots[pos] = slot
+                return slot
+            pos = (pos + 1) & mask
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Resolve sensor keys to state slots, registering unseen sensors"""
+        table_size = len(self.table_keys)
+        mask = np.uint64(table_size - 1)
+        pos = (keys & mask).astype(np.int64)
+        slots = np.full(len(keys), -1, dtype=np.int64)
+        pending = np.arange(len(keys))
+        while pending.size:
+            found = self.table_keys[pos[pending]]
+            hit = found == keys[pending]
+            slots[pending[hit]] = self.table_slots[pos[pending[hit]]]
+            empty = found == 0
+            # New sensors are rare after warm-up; claim their entries one by one
+            for idx in pending[empty].tolist():
+                slots[idx] = self._insert(int(keys[idx]))
+            if len(self.table_keys) != table_size:
+                # The table grew underneath us, so restart the probe against the new layout
+                return self.lookup(keys)
+            pending = pending[~(hit | empty)]
+            pos[pending] = (pos[pending] + 1) & int(mask)
+        return slots
+
+    def _score_and_update(self, slots: np.ndarray, x: np.ndarray):
+        """Score readings against, then fold them into, distinct sensor slots"""
+        count = self.count[slots]
+        mean = self.mean[slots]
+        var = self.var[slots]
+        prev = self.last[slots]
+        valid = ~np.isnan(x)
+
+        std = np.sqrt(np.maximum(var, self.min_var))
+        with np.errstate(invalid="ignore"):
+            zscore = np.where(count[:, None] >= self.min_count, (x - mean) / std, np.nan)
+        z_flags = np.abs(zscore) > self.z_threshold
+        roc_flags = np.abs(x - prev) > self.max_delta
+
+        # EWMA mean/variance; the first readings fall back to a cumulative average
+        alpha = np.maximum(self.alpha, 1.0 / (count + 1.0)).astype(np.float32)[:, None]
+        diff = x - mean
+        incr = alpha * diff
+        self.mean[slots] = np.where(valid, mean + incr, mean)
+        self.var[slots] = np.where(valid, (1 - alpha) * (var + diff * incr), var)
+        # A missing value keeps the previous one, so the next reading still gets a rate of change
+        self.last[slots] = np.where(valid, x, self.last[slots])
+        self.count[slots] = count + 1
+        return zscore, z_flags, roc_flags
+
+    def detect(self, sensor_ids: Sequence[str], features: np.ndarray) -> OnlineAnomalies:
+        """Score a batch of readings in arrival order and update per-sensor state"""
+        features = np.asarray(features, dtype=np.float32).reshape(-1, len(self.feature_names))
+        keys = sensor_keys(sensor_ids)
+
+        zscore = np.full(features.shape, np.nan, dtype=np.float32)
+        z_flags = np.zeros(features.shape, dtype=bool)
+        roc_flags = np.zeros(features.shape, dtype=bool)
+
+        with self._lock:
+            slots = self.lookup(keys)
+            # -1: no slot left in a shared, fixed-capacity state
+            tracked = np.flatnonzero(slots >= 0)
+            # Process the batch in waves so repeated readings of a sensor are applied in order
+            rank = occurrence_rank(slots[tracked]) if len(tracked) else tracked
+            for wave in range(int(rank.max()) + 1 if len(rank) else 0):
+                rows = tracked[rank == wave]
+                zscore[rows], z_flags[rows], roc_flags[rows] = self._score_and_update(slots[rows], features[rows])
+
+        bits = (1 << np.arange(len(self.feature_names))).astype(np.uint8)
+        return OnlineAnomalies(
+            zscore=zscore,
+            zscore_mask=(z_flags * bits).sum(axis=1, dtype=np.uint8),
+            roc_mask=(roc_flags * bits).sum(axis=1, dtype=np.uint8),
+            feature_names=self.feature_names,
+        )
+
+    def checkpoint(self, path: str):
+        """Atomically write the detector state to an .npz file"""
+        with self._lock:
+            size = self.size
+            state = {name: getattr(self, name).copy() for name in self.STATE_ARRAYS}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, size=size, feature_names=np.array(self.feature_names), **state)
+        os.replace(tmp_path, path)
+
+    def restore(self, path: str):
+        """Load detector state written by checkpoint()"""
+        with np.load(path) as state:
+            if list(state["feature_names"]) != self.feature_names:
+                raise ValueError("checkpoint does not match detector configuration")
+            capacity = len(state["count"])
+            with self._lock:
+                if capacity != self.capacity:
+                    if self.shared:
+                        raise ValueError("checkpoint capacity does not match the shared detector state")
+                    self._allocate(capacity)
+                for name in self.STATE_ARRAYS:
+                    getattr(self, name)[...] = state[name]
+                self.size = int(state["size"])
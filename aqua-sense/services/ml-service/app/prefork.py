@@ -0,0 +1,281 @@
+"""
+Prefork multi-worker serving for the ML service
+
+`python -m app.prefork` serves the app from several worker processes that
+share one listening socket: by default one per CPU available to the
+container (its affinity mask, capped by the cgroup CPU quota), or
+SERVICE_WORKERS.
+
+The supervisor imports the app once and forks every worker from it, so
+module code and built-in models are shared copy-on-write. Before forking it
+moves the online detector's per-sensor state into shared memory, so all
+workers score and update the same sensors, and checkpoints it once every
+worker has exited. Model artifacts are memory-mapped from MODEL_PATH, so each
+worker's arrays are views of the same page cache pages rather than copies.
+
+Signals to the supervisor:
+- SIGTERM / SIGINT: workers stop accepting connections and finish in-flight
+  requests (up to GRACEFUL_TIMEOUT seconds), then the supervisor exits
+- SIGHUP: rolling restart; each worker is replaced by a fresh fork, and only
+  stopped once its replacement has started
+Workers that exit unexpectedly are replaced, with a growing delay while they
+keep failing right after starting.
+"""
+
+import logging
+import math
+import os
+import select
+import shutil
+import signal
+import socket
+import tempfile
+import time
+from typing import Callable, Dict, Optional, Set
+
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+# A worker that exits sooner than this after starting counts as crash-looping
+MIN_WORKER_UPTIME = 5.0
+MAX_RESPAWN_DELAY = 30.0
+
+# CPU quota files, first found wins: cgroup v2 ("<quota> <period>"), then v1
+CGROUP_CPU_LIMITS = (
+    ("/sys/fs/cgroup/cpu.max", None),
+    ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us"),
+)
+
+def available_cpus() -> int:
+    """CPUs this process may run on: the affinity mask, capped by a cgroup CPU quota"""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    for quota_path, period_path in CGROUP_CPU_LIMITS:
+        try:
+            with open(quota_path) as f:
+                values = f.read().split()
+            if period_path is not None:
+                with open(period_path) as f:
+                    values.append(f.read().strip())
+            quota, period = values[0], values[1]
+        except (OSError, IndexError):
+            continue
+        if quota not in ("max", "-1"):
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+        break
+    return cpus
+
+class _WorkerServer(uvicorn.Server):
+    """uvicorn server that tells the supervisor once the app has started"""
+
+    def __init__(self, config: uvicorn.Config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if self.started:
+            os.write(self.ready_fd, b"1")
+            os.close(self.ready_fd)
+
+class Supervisor:
+    """Forks and supervises worker processes serving an ASGI app on a shared socket
+
+    `on_start` runs in the supervisor before the first fork (e.g. to set up
+    shared memory) and `on_exit` after the last worker has stopped.
+    """
+
+    def __init__(
+        self,
+        app,
+        host: str = "0.0.0.0",
+        port: int = 8086,
+        workers: int = 0,
+        graceful_timeout: float = 30.0,
+        on_start: Optional[Callable[[], None]] = None,
+        on_exit: Optional[Callable[[], None]] = None,
+    ):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers or available_cpus()
+        self.graceful_timeout = graceful_timeout
+        self.on_start = on_start
+        self.on_exit = on_exit
+        self._children: Dict[int, float] = {}
+        self._ready_pipes: Dict[int, int] = {}
+        self._retiring: Set[int] = set()
+        self._socket: Optional[socket.socket] = None
+        self._stopping = False
+        self._restart_requested = False
+        self._crashes = 0
+        self._respawn_at = 0.0
+
+    def run(self):
+        """Serve until SIGTERM or SIGINT"""
+        self._socket = self._bind()
+        if self.on_start is not None:
+            self.on_start()
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGHUP, self._request_restart)
+        logger.info("Serving on %s:%d with %d workers", self.host, self.port, self.workers)
+        try:
+            for _ in range(self.workers):
+                self._spawn()
+            while not self._stopping:
+                self._reap()
+                if self._restart_requested:
+                    self._restart_requested = False
+                    self._rolling_restart()
+                missing = self.workers - (len(self._children) - len(self._retiring))
+                if missing > 0 and time.monotonic() >= self._respawn_at:
+                    for _ in range(missing):
+                        self._spawn()
+                time.sleep(0.1)
+        finally:
+            self._stop()
+            self._socket.close()
+            if self.on_exit is not None:
+                self.on_exit()
+
+    def _bind(self) -> socket.socket:
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+    def _request_restart(self, signum, frame):
+        self._restart_requested = True
+
+    def _spawn(self) -> int:
+        """Fork a worker that reports on a pipe once the app has started; returns its pid"""
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            self._serve_worker(ready_w)
+        os.close(ready_w)
+        self._children[pid] = time.monotonic()
+        self._ready_pipes[pid] = ready_r
+        return pid
+
+    def _serve_worker(self, ready_fd: int):
+        """Worker process body; never returns"""
+        code = 1
+        try:
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(signum, signal.SIG_DFL)
+            config = uvicorn.Config(
+                self.app, host=self.host, port=self.port, timeout_graceful_shutdown=self.graceful_timeout
+            )
+            server = _WorkerServer(config, ready_fd)
+            server.run(sockets=[self._socket])
+            code = 0 if server.started else 3
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            logger.exception("Worker %d failed", os.getpid())
+        finally:
+            os._exit(code)
+
+    def _reap(self):
+        """Collect exited workers; unexpected exits are replaced by the main loop"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            started = self._children.pop(pid, None)
+            self._close_ready_pipe(pid)
+            mark_worker_dead(pid)
+            if pid in self._retiring:
+                self._retiring.discard(pid)
+                continue
+            if started is None or self._stopping:
+                continue
+            self._crashes = self._crashes + 1 if time.monotonic() - started < MIN_WORKER_UPTIME else 0
+            delay = min(2 ** self._crashes, MAX_RESPAWN_DELAY) if self._crashes else 0
+            self._respawn_at = time.monotonic() + delay
+            logger.warning("Worker %d exited with status %d, replacing it in %.0fs",
+                           pid, os.waitstatus_to_exitcode(status), delay)
+
+    def _rolling_restart(self):
+        """Replace every current worker, stopping each one once its replacement is serving"""
+        logger.info("Restarting %d workers", len(self._children) - len(self._retiring))
+        for pid in [pid for pid in self._children if pid not in self._retiring]:
+            if self._stopping:
+                return
+            replacement = self._spawn()
+            if not self._wait_ready(replacement):
+                logger.error("Replacement worker %d did not start, keeping worker %d", replacement, pid)
+                continue
+            self._retiring.add(pid)
+            os.kill(pid, signal.SIGTERM)
+
+    def _wait_ready(self, pid: int) -> bool:
+        """Wait for a worker to report that the app has started (False if it exits or times out first)"""
+        fd = self._ready_pipes.get(pid)
+        deadline = time.monotonic() + max(self.graceful_timeout, 60.0)
+        while fd is not None and not self._stopping and time.monotonic() < deadline:
+            readable, _, _ = select.select([fd], [], [], 0.5)
+            if readable:
+                ready = os.read(fd, 1) == b"1"
+                self._close_ready_pipe(pid)
+                return ready
+            self._reap()
+            fd = self._ready_pipes.get(pid)
+        return False
+
+    def _close_ready_pipe(self, pid: int):
+        fd = self._ready_pipes.pop(pid, None)
+        if fd is not None:
+            os.close(fd)
+
+    def _stop(self):
+        """Ask every worker to finish its requests and exit; kill the ones that outlive the grace period"""
+        self._stopping = True
+        for pid in self._children:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self._children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self._children):
+            logger.warning("Worker %d did not stop in time, killing it", pid)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self._children.pop(pid)
+            self._close_ready_pipe(pid)
+            mark_worker_dead(pid)
+
+def mark_worker_dead(pid: int):
+    """Drop a dead worker's live gauges from the multiprocess metrics directory"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    # Must be set before prometheus_client is imported, so workers write metrics
+    # to per-process files that any worker can aggregate on /metrics
+    created_metrics_dir = None
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        created_metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="aquasense-metrics-")
+    try:
+        from app.main import serve
+        serve()
+    finally:
+        if created_metrics_dir is not None:
+            shutil.rmtree(created_metrics_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Sampled request profiling
+
+Off unless PROFILING_SAMPLE_RATE or PROFILING_ADMIN_TOKEN is set. Then
+ProfilingMiddleware profiles that fraction of requests, plus any request
+sent with `X-Profile-Token: <admin token>`. While a profiled request is in
+flight, a sampler thread wakes every PROFILING_INTERVAL_MS and records one
+stack per profiled request:
+
+- the event loop thread's stack, when the request's task is the one running;
+- otherwise the chain of coroutines the request is suspended in, ending in
+  "(waiting)", so time spent queued (fair queue, micro-batcher, scoring
+  executor, database) shows up alongside time spent computing.
+
+Samples are aggregated as collapsed stacks ("frame;frame;frame count" lines,
+rooted at the request's method and path), the input format of flamegraph.pl,
+speedscope and similar tools. Profiled requests are never instrumented, only
+observed from the sampler thread; a request that is not selected costs one
+random draw, and with profiling off the middleware is not installed at all.
+"""
+
+import asyncio
+import hmac
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    return f"{code.co_qualname} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+def thread_stack(frame, root=None) -> List[str]:
+    """Frame names of a thread's stack, outermost first, starting at `root` when it is on the stack"""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        if frame is root:
+            break
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+def await_stack(coro) -> List[str]:
+    """Frame names of the coroutines a suspended task is awaiting, outermost first"""
+    names = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        names.append(frame_name(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    names.append("(waiting)")
+    return names
+
+class RequestProfiler:
+    """Statistical profiler of selected in-flight requests, aggregating their sampled stacks
+
+    Stacks beyond `max_stacks` distinct ones are counted under their
+    request's "(other)" entry.
+    """
+
+    def __init__(self, sample_rate: float = 0.0, token: str = "", interval: float = 0.005, max_stacks: int = 10_000):
+        self.sample_rate = sample_rate
+        self.token = token
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.requests = 0
+        self.samples = 0
+        self._stacks: Counter = Counter()
+        self._active: Dict[asyncio.Task, str] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or bool(self.token)
+
+    def authorized(self, token: Optional[str]) -> bool:
+        """Whether a token matches the admin token (never when none is configured)"""
+        return bool(self.token and token) and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def selects(self, token: Optional[str]) -> bool:
+        """Whether to profile a request: sent with the admin token, or drawn at the sample rate"""
+        return self.authorized(token) or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    @contextmanager
+    def profile(self, label: str):
+        """Sample the current task's stack, under `label`, until the block exits"""
+        task = asyncio.current_task()
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread = threading.get_ident()
+            self._active[task] = label
+            self.requests += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+                self._thread.start()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active.pop(task, None)
+
+    def _sample(self):
+        """Sampler thread body: runs while any profiled request is in flight"""
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                active = list(self._active.items())
+                loop, loop_thread = self._loop, self._loop_thread
+            frame = sys._current_frames().get(loop_thread)
+            running = asyncio.current_task(loop)
+            stacks = []
+            for task, label in active:
+                coro = task.get_coro()
+                if task is running and frame is not None:
+                    stack = thread_stack(frame, getattr(coro, "cr_frame", None))
+                else:
+                    stack = await_stack(coro)
+                stacks.append((label, ";".join([label, *stack])))
+            del frame
+            with self._lock:
+                self.samples += 1
+                for label, stack in stacks:
+                    if stack not in self._stacks and len(self._stacks) >= self.max_stacks:
+                        stack = f"{label};(other)"
+                    self._stacks[stack] += 1
+
+    def collapsed(self, reset: bool = False) -> str:
+        """Aggregated samples as collapsed stack lines ("frame;frame count"), optionally clearing them"""
+        with self._lock:
+            stacks = sorted(self._stacks.items())
+            if reset:
+                self._stacks.clear()
+                self.requests = self.samples = 0
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sample_rate": self.sample_rate,
+                "interval_ms": self.interval * 1000,
+                "requests": self.requests,
+                "in_flight": len(self._active),
+                "samples": self.samples,
+                "stacks": len(self._stacks),
+            }
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling the requests a RequestProfiler selects"""
+
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith("/admin/"):
+            return await self.app(scope, receive, send)
+        token = None
+        if self.profiler.token:
+            for name, value in scope["headers"]:
+                if name == b"x-profile-token":
+                    token = value.decode("latin-1")
+                    break
+        if not self.profiler.selects(token):
+            return await self.app(scope, receive, send)
+        with self.profiler.profile(f"{scope['method']} {scope['path'].replace(';', '%3B')}"):
+            await self.app(scope, receive, send)
@@ -0,0 +1,127 @@
+"""
+Versioned model registry for the ML service
+
+Artifacts are discovered under MODEL_PATH as `<name>/<version>.joblib` and the
+highest version of each model is active. They are loaded with
+`joblib.load(mmap_mode="r")`, so large NumPy arrays inside an (uncompressed)
+artifact are memory-mapped and every worker process shares one page-cached
+copy. Trainers should write to a temporary name and rename into place.
+
+The registry polls for new or replaced artifacts and swaps the active entry in
+a single reference assignment: requests that already hold the previous entry
+finish on it, new requests pick up the new one.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.lazy import lazy_import
+
+# Only needed once an artifact exists, and it pulls in its own dependencies
+joblib = lazy_import("joblib")
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_SUFFIX = ".joblib"
+
+def version_key(version: str) -> Tuple:
+    """Sort key that orders "1.10.0" after "1.9.0" """
+    return tuple((0, int(part)) if part.isdigit() else (1, part) for part in version.replace("-", ".").split("."))
+
+class ModelEntry:
+    """An active model together with the version and artifact it was loaded from"""
+
+    def __init__(self, name: str, model: object, version: str, path: Optional[str] = None, mtime: Optional[float] = None):
+        self.name = name
+        self.model = model
+        self.version = version
+        self.path = path
+        self.mtime = mtime
+        self.loaded_at = time.time()
+
+    def info(self) -> dict:
+        return {
+            "version": self.version,
+            "source": self.path or "builtin",
+            "loaded_at": self.loaded_at,
+        }
+
+class ModelRegistry:
+    """Discovers, loads and hot-swaps versioned model artifacts"""
+
+    def __init__(self, root: str, builtins: Dict[str, Callable[[], object]], required_methods: Dict[str, str]):
+        self.root = root
+        self.builtins = builtins
+        self.required_methods = required_methods
+        self._active: Dict[str, ModelEntry] = {}
+        self._failed: Dict[str, Tuple[str, float]] = {}
+        # Called with the new entry after every swap (e.g. cache invalidation)
+        self.listeners: List[Callable[[ModelEntry], None]] = []
+        for name, factory in builtins.items():
+            model = factory()
+            self._active[name] = ModelEntry(name, model, getattr(model, "version", "builtin"))
+
+    def get(self, name: str) -> ModelEntry:
+        """The active entry for a model; hold on to it for the whole request"""
+        return self._active[name]
+
+    def info(self) -> Dict[str, dict]:
+        return {name: entry.info() for name, entry in self._active.items()}
+
+    def discover(self, name: str) -> Optional[Tuple[str, str, float]]:
+        """Latest (version, path, mtime) artifact for a model, if any"""
+        directory = os.path.join(self.root, name)
+        try:
+            files = [f for f in os.listdir(directory) if f.endswith(ARTIFACT_SUFFIX)]
+        except FileNotFoundError:
+            return None
+        if not files:
+            return None
+        latest = max(files, key=lambda f: version_key(f[: -len(ARTIFACT_SUFFIX)]))
+        path = os.path.join(directory, latest)
+        return latest[: -len(ARTIFACT_SUFFIX)], path, os.stat(path).st_mtime
+
+    def load(self, name: str, version: str, path: str, mtime: float) -> ModelEntry:
+        """Load an artifact with memory-mapped arrays and check it exposes the model interface"""
+        model = joblib.load(path, mmap_mode="r")
+        method = self.required_methods[name]
+        if not callable(getattr(model, method, None)):
+            raise TypeError(f"{path} does not provide {method}()")
+        return ModelEntry(name, model, version, path, mtime)
+
+    def refresh(self) -> List[str]:
+        """Load any new or replaced artifacts; returns the names that were swapped"""
+        swapped = []
+        for name in self.builtins:
+            found = self.discover(name)
+            if found is None:
+                continue
+            version, path, mtime = found
+            current = self._active[name]
+            if (current.path, current.mtime) == (path, mtime) or self._failed.get(name) == (path, mtime):
+                continue
+            try:
+                entry = self.load(name, version, path, mtime)
+            except Exception as e:
+                logger.error("Keeping %s %s, failed to load %s: %s", name, current.version, path, e)
+                # Remember the failure so a broken artifact is not reloaded on every poll
+                self._failed[name] = (path, mtime)
+                continue
+            self._active[name] = entry
+            swapped.append(name)
+            logger.info("Activated %s %s from %s", name, version, path)
+            for listener in self.listeners:
+                listener(entry)
+        return swapped
+
+    async def watch(self, interval: float):
+        """Poll MODEL_PATH for changes, loading off the event loop"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error("Model registry refresh failed: %s", e)
@@ -0,0 +1,477 @@
+"""
+Incrementally maintained per-sensor, per-day water quality rollups
+
+Readings that pass through the ML service are folded into running aggregates
+per (sensor_id, day): count, sum, sum of squares, min and max of every
+feature. Deltas are reduced in memory with NumPy and periodically upserted
+into analytics.daily_rollups, adding counts and sums and taking the min/max of
+the stored and new values. Because every delta is merged rather than
+replacing a row, readings that arrive late for an earlier day are folded into
+that day correctly.
+
+Dashboards read O(days x sensors) rollup rows instead of aggregating
+sensor.sensor_readings; analytics.daily_rollup_quality is defined over the
+rollup table (analytics.daily_water_quality still reads every stored reading,
+including those that never pass through the ML service). Days are UTC.
+Existing history is loaded with
+
+    python -m app.rollups --backfill --start 2024-01-01 --end 2024-07-01
+
+which recomputes the given days from sensor.sensor_readings and replaces
+their rollup rows (run it for days that are no longer receiving readings).
+
+Each reading is counted once: flushes claim the (sensor_id, timestamp) of
+their readings in analytics.rollup_readings in the same transaction as the
+merge, and only fold in readings not claimed before, so re-submitted
+readings, Kafka redeliveries and retried flushes are not counted twice.
+Claims are pruned `dedupe_days` after they were made, after which the same
+reading submitted again would be counted again.
+
+Readings whose sensor_id is not a UUID cannot be stored and are not rolled
+up. Readings that fail to merge are retried on the next flushes, and dropped
+(with an error logged) after `max_retries` failures in a row.
+"""
+
+import argparse
+import csv
+import io
+import logging
+import os
+import threading
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.db import Database
+from app.models import FEATURE_NAMES
+
+logger = logging.getLogger(__name__)
+
+# Per-feature statistics, in column order
+STATS = ["count", "sum", "sumsq", "min", "max"]
+COUNT, SUM, SUMSQ, MIN, MAX = range(len(STATS))
+STAT_COLUMNS = [f"{feature}_{stat}" for feature in FEATURE_NAMES for stat in STATS]
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+ROLLUPS_DDL = """
+CREATE TABLE IF NOT EXISTS analytics.daily_rollups (
+    sensor_id {uuid} NOT NULL,
+    day DATE NOT NULL,
+    {columns},
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sensor_id, day)
+)
+"""
+
+READINGS_DDL = """
+CREATE TABLE IF NOT EXISTS analytics.rollup_readings (
+    sensor_id {uuid} NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    claimed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sensor_id, timestamp)
+)
+"""
+
+def utc_times(timestamps: Sequence) -> np.ndarray:
+    """Naive UTC datetime64[us] of each timestamp (datetime or ISO string)"""
+    times = np.empty(len(timestamps), dtype="datetime64[us]")
+    for idx, ts in enumerate(timestamps):
+        if isinstance(ts, str):
+            ts = datetime.fromisoformat(ts)
+        if ts.tzinfo is not None:
+            ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+        times[idx] = ts
+    return times
+
+def day_numbers(times: np.ndarray) -> np.ndarray:
+    """UTC day (days since 1970-01-01) of each datetime64 time"""
+    return times.astype("datetime64[D]").astype(np.int64)
+
+def unique_readings(sensors: np.ndarray, times: np.ndarray) -> np.ndarray:
+    """Positions of the first reading of each (sensor, time) key, in input order"""
+    if not len(times):
+        return np.zeros(0, dtype=np.int64)
+    _, sensor_codes = np.unique(sensors, return_inverse=True)
+    order = np.lexsort((times.astype(np.int64), sensor_codes))
+    codes, stamps = sensor_codes[order], times[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (codes[1:] != codes[:-1]) | (stamps[1:] != stamps[:-1])
+    return np.sort(order[first])
+
+def storable_sensor_ids(sensor_ids: Sequence) -> np.ndarray:
+    """Sensor ids as canonical UUID strings, "" for ids that are not UUIDs"""
+    ids = np.empty(len(sensor_ids), dtype=object)
+    for idx, sensor_id in enumerate(sensor_ids):
+        try:
+            ids[idx] = str(uuid.UUID(str(sensor_id)))
+        except ValueError:
+            ids[idx] = ""
+    return ids
+
+def reading_stats(features: np.ndarray) -> np.ndarray:
+    """(n, n_features, len(STATS)) stats of single readings; missing values count as nothing"""
+    missing = np.isnan(features)
+    stats = np.empty(features.shape + (len(STATS),))
+    stats[..., COUNT] = ~missing
+    stats[..., SUM] = np.where(missing, 0.0, features)
+    stats[..., SUMSQ] = stats[..., SUM] ** 2
+    stats[..., MIN] = np.where(missing, np.inf, features)
+    stats[..., MAX] = np.where(missing, -np.inf, features)
+    return stats
+
+def reduce_stats(sensors: np.ndarray, days: np.ndarray, stats: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Merge stats rows sharing a (sensor, day) key: add counts and sums, min/max the extremes"""
+    if not len(days):
+        return sensors, days, stats
+    sensor_values, sensor_codes = np.unique(sensors, return_inverse=True)
+    keys = (sensor_codes.astype(np.int64) << 32) | (days - days.min())
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(keys)) + 1])
+    ordered = stats[order]
+
+    merged = np.empty((len(starts),) + stats.shape[1:])
+    merged[..., COUNT:SUMSQ + 1] = np.add.reduceat(ordered[..., COUNT:SUMSQ + 1], starts, axis=0)
+    merged[..., MIN] = np.minimum.reduceat(ordered[..., MIN], starts, axis=0)
+    merged[..., MAX] = np.maximum.reduceat(ordered[..., MAX], starts, axis=0)
+    first = order[starts]
+    return sensor_values[sensor_codes[first]], days[first], merged
+
+class DailyRollups:
+    """Scored readings waiting to be rolled up, drained by flush()"""
+
+    def __init__(self, max_pending: int = 1_000_000, max_retries: int = 5):
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self._sensors: List[np.ndarray] = []
+        self._times: List[np.ndarray] = []
+        self._features: List[np.ndarray] = []
+        self._rows = 0
+        self._lock = threading.Lock()
+        self._failures = 0
+        self.readings = 0
+        self.skipped = 0
+        self.dropped = 0
+
+    @property
+    def pending(self) -> int:
+        return self._rows
+
+    def add(self, sensor_ids: Sequence[str], timestamps: Sequence, features: np.ndarray):
+        """Queue a batch of readings for the next flush, skipping readings of non-UUID sensor ids"""
+        sensors = storable_sensor_ids(sensor_ids)
+        valid = np.flatnonzero(sensors != "")
+        self.skipped += len(sensors) - len(valid)
+        if not len(valid):
+            return
+        features = np.asarray(features, dtype=np.float64).reshape(len(sensors), len(FEATURE_NAMES))
+        self._append(
+            sensors[valid].astype(str),
+            utc_times([timestamps[idx] for idx in valid.tolist()]),
+            features[valid],
+        )
+        self.readings += len(valid)
+
+    def _append(self, sensors: np.ndarray, times: np.ndarray, features: np.ndarray):
+        with self._lock:
+            self._sensors.append(sensors)
+            self._times.append(times)
+            self._features.append(features)
+            self._rows += len(times)
+            if self._rows > self.max_pending:
+                # Bound memory while the database is unreachable: drop repeats, then the oldest readings
+                sensors, times, features = self._unique()
+                excess = max(len(times) - self.max_pending, 0)
+                if excess:
+                    logger.error("Dropping %d pending rollup readings, more than %d queued", excess, self.max_pending)
+                    self.dropped += excess
+                self._sensors, self._times, self._features = [sensors[excess:]], [times[excess:]], [features[excess:]]
+                self._rows = len(times) - excess
+
+    def _unique(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        sensors, times = np.concatenate(self._sensors), np.concatenate(self._times)
+        features = np.concatenate(self._features)
+        keep = unique_readings(sensors, times)
+        return sensors[keep], times[keep], features[keep]
+
+    def take(self) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Remove and return all pending readings, once per (sensor, timestamp)"""
+        with self._lock:
+            if not self._rows:
+                return None
+            readings = self._unique()
+            self._sensors, self._times, self._features, self._rows = [], [], [], 0
+        return readings
+
+    def flush(self, store: "RollupStore") -> int:
+        """Merge pending readings into the stored rollups; returns the readings not counted before
+
+        On failure the readings are kept for the next flush, or dropped once
+        `max_retries` flushes in a row have failed; the error is re-raised.
+        """
+        readings = self.take()
+        if readings is None:
+            return 0
+        try:
+            merged = store.merge(*readings)
+        except Exception:
+            self._failures += 1
+            if self._failures < self.max_retries:
+                self._append(*readings)
+            else:
+                logger.error("Dropping %d rollup readings after %d failed flushes", len(readings[1]), self._failures)
+                self.dropped += len(readings[1])
+                self._failures = 0
+            raise
+        self._failures = 0
+        return merged
+
+def summarize(row: Sequence) -> dict:
+    """Query result for one rollup row (sensor_id, day, STAT_COLUMNS...)"""
+    sensor_id, day = row[0], row[1]
+    stats = np.array([np.nan if value is None else float(value) for value in row[2:]]).reshape(len(FEATURE_NAMES), len(STATS))
+    count = stats[:, COUNT]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = stats[:, SUM] / count
+        std = np.sqrt(np.maximum(stats[:, SUMSQ] / count - mean ** 2, 0.0))
+
+    def value(x: float) -> Optional[float]:
+        return None if np.isnan(x) or np.isinf(x) else round(float(x), 4)
+
+    return {
+        "date": day if isinstance(day, str) else day.isoformat(),
+        "sensor_id": str(sensor_id),
+        "features": {
+            name: {
+                "count": int(count[idx]) if not np.isnan(count[idx]) else 0,
+                "mean": value(mean[idx]),
+                "std": value(std[idx]),
+                "min": value(stats[idx, MIN]),
+                "max": value(stats[idx, MAX]),
+            }
+            for idx, name in enumerate(FEATURE_NAMES)
+        },
+    }
+
+class RollupStore(Database):
+    """Reads and additively merges analytics.daily_rollups, counting each reading once"""
+
+    def __init__(self, url: str, dedupe_days: int = 35):
+        super().__init__(url)
+        self.dedupe_days = dedupe_days
+        self._pruned: Optional[date] = None
+
+    def ensure_schema(self):
+        columns = ",\n    ".join(
+            f"{column} {'BIGINT NOT NULL DEFAULT 0' if column.endswith('_count') else 'DOUBLE PRECISION'}"
+            for column in STAT_COLUMNS
+        )
+        uuid_type = "TEXT" if self.is_sqlite else "UUID"
+        cursor = self.write_conn.cursor()
+        cursor.execute(ROLLUPS_DDL.format(uuid=uuid_type, columns=columns))
+        cursor.execute(READINGS_DDL.format(uuid=uuid_type))
+        if not self.is_sqlite:
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_rollup_readings_claimed_at ON analytics.rollup_readings (claimed_at)"
+            )
+        self.write_conn.commit()
+
+    def _merge_sql(self, source: str) -> str:
+        updates = []
+        for column in STAT_COLUMNS:
+            current, new = f"r.{column}", f"excluded.{column}"
+            if column.endswith(("_count", "_sum", "_sumsq")):
+                updates.append(f"{column} = COALESCE({current}, 0) + COALESCE({new}, 0)")
+            else:
+                pick = "MIN" if column.endswith("_min") else "MAX"
+                pick = pick if self.is_sqlite else ("LEAST" if pick == "MIN" else "GREATEST")
+                # NULL (no values yet) on either side keeps the other side
+                updates.append(f"{column} = {pick}(COALESCE({current}, {new}), COALESCE({new}, {current}))")
+        return (
+            f"INSERT INTO analytics.daily_rollups AS r (sensor_id, day, {', '.join(STAT_COLUMNS)}) {source} "
+            f"ON CONFLICT (sensor_id, day) DO UPDATE SET {', '.join(updates)}, updated_at = CURRENT_TIMESTAMP"
+        )
+
+    def merge(self, sensors: np.ndarray, times: np.ndarray, features: np.ndarray) -> int:
+        """Fold readings not counted before into the stored rollups and commit; returns their number"""
+        cursor = self.write_conn.cursor()
+        try:
+            fresh = self._claim(cursor, sensors, times)
+            if fresh.any():
+                self._merge_rows(cursor, self._delta_rows(*reduce_stats(
+                    sensors[fresh], day_numbers(times[fresh]), reading_stats(features[fresh])
+                )))
+            pruned = self._prune(cursor)
+        except Exception:
+            self.write_conn.rollback()
+            raise
+        self.write_conn.commit()
+        if pruned is not None:
+            self._pruned = pruned
+        return int(fresh.sum())
+
+    def _claim(self, cursor, sensors: np.ndarray, times: np.ndarray) -> np.ndarray:
+        """Record (sensor_id, timestamp) keys; True for readings whose key was not recorded before"""
+        keys = list(zip(sensors.tolist(), times.tolist()))
+        if self.is_sqlite:
+            fresh = np.zeros(len(keys), dtype=bool)
+            for idx, key in enumerate(keys):
+                cursor.execute(
+                    "INSERT OR IGNORE INTO analytics.rollup_readings (sensor_id, timestamp) VALUES (?, ?)",
+                    self._params(key),
+                )
+                fresh[idx] = cursor.rowcount == 1
+            return fresh
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(keys)
+        buffer.seek(0)
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS rollup_readings_staging "
+            "(sensor_id UUID, timestamp TIMESTAMP) ON COMMIT DELETE ROWS"
+        )
+        cursor.copy_expert("COPY rollup_readings_staging (sensor_id, timestamp) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(
+            "INSERT INTO analytics.rollup_readings (sensor_id, timestamp) "
+            "SELECT sensor_id, timestamp FROM rollup_readings_staging "
+            "ON CONFLICT DO NOTHING RETURNING sensor_id, timestamp"
+        )
+        claimed = {(str(sensor_id), timestamp) for sensor_id, timestamp in cursor.fetchall()}
+        return np.fromiter((key in claimed for key in keys), dtype=bool, count=len(keys))
+
+    def _delta_rows(self, sensors: np.ndarray, days: np.ndarray, stats: np.ndarray) -> List[tuple]:
+        flat = stats.reshape(len(days), -1)
+        counts = np.array([column.endswith("_count") for column in STAT_COLUMNS])
+        cells = flat.astype(object)
+        cells[:, counts] = flat[:, counts].astype(np.int64).astype(object)
+        # Features without values on a day have +-inf extremes, stored as NULL
+        cells[np.isinf(flat)] = None
+        return [
+            (sensor, date.fromordinal(day + EPOCH_ORDINAL), *row)
+            for sensor, day, row in zip(sensors.tolist(), days.tolist(), cells.tolist())
+        ]
+
+    def _prune(self, cursor) -> Optional[date]:
+        """Forget claims made more than `dedupe_days` ago, at most once a day; returns the day pruned
+
+        The caller records the day once the deletion is committed, so a rolled
+        back prune is retried on the next merge.
+        """
+        today = datetime.now(timezone.utc).date()
+        if self._pruned == today:
+            return None
+        # Compared in the database's own clock, which set the claims' claimed_at
+        if self.is_sqlite:
+            cursor.execute(
+                "DELETE FROM analytics.rollup_readings WHERE claimed_at < datetime('now', ?)", (f"-{self.dedupe_days} days",)
+            )
+        else:
+            cursor.execute(
+                "DELETE FROM analytics.rollup_readings WHERE claimed_at < LOCALTIMESTAMP - make_interval(days => %s)",
+                (self.dedupe_days,),
+            )
+        return today
+
+    def _merge_rows(self, cursor, rows: List[tuple]):
+        if self.is_sqlite:
+            cursor.executemany(
+                self._merge_sql(f"VALUES ({', '.join('?' * (len(STAT_COLUMNS) + 2))})"),
+                [self._params(row) for row in rows],
+            )
+        else:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            cursor.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS daily_rollups_staging "
+                "(LIKE analytics.daily_rollups INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+            )
+            cursor.copy_expert(
+                f"COPY daily_rollups_staging (sensor_id, day, {', '.join(STAT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+            cursor.execute(self._merge_sql(
+                f"SELECT sensor_id, day, {', '.join(STAT_COLUMNS)} FROM daily_rollups_staging"
+            ))
+
+    def query(self, start: date, end: date, sensor_ids: Optional[List[str]] = None) -> List[tuple]:
+        """Rollup rows for days in [start, end), optionally for some sensors only"""
+        query = (
+            f"SELECT sensor_id, day, {', '.join(STAT_COLUMNS)} FROM analytics.daily_rollups "
+            "WHERE day >= %s AND day < %s"
+        )
+        params: List = [start, end]
+        if sensor_ids:
+            query += f" AND sensor_id IN ({', '.join(['%s'] * len(sensor_ids))})"
+            params += sensor_ids
+        query += " ORDER BY day, sensor_id"
+        return self.read(query, params)
+
+    def backfill(self, start: date, end: date) -> int:
+        """Recompute the rollups of [start, end) from sensor.sensor_readings, replacing existing rows"""
+        day = "date(timestamp)" if self.is_sqlite else "CAST(timestamp AS DATE)"
+        aggregates = []
+        for feature in FEATURE_NAMES:
+            aggregates += [
+                f"COUNT({feature})", f"SUM({feature})", f"SUM({feature} * {feature})", f"MIN({feature})", f"MAX({feature})"
+            ]
+        cursor = self.write_conn.cursor()
+        params = self._params([
+            datetime.combine(start, datetime.min.time()), datetime.combine(end, datetime.min.time())
+        ])
+        try:
+            cursor.execute(
+                self._sql("DELETE FROM analytics.daily_rollups WHERE day >= %s AND day < %s"), self._params([start, end])
+            )
+            # The recomputed days count every stored reading, so later submissions of them are repeats
+            cursor.execute(
+                self._sql("DELETE FROM analytics.rollup_readings WHERE timestamp >= %s AND timestamp < %s"), params
+            )
+            cursor.execute(
+                self._sql(
+                    "INSERT INTO analytics.rollup_readings (sensor_id, timestamp) SELECT sensor_id, timestamp "
+                    "FROM sensor.sensor_readings WHERE timestamp >= %s AND timestamp < %s"
+                ),
+                params,
+            )
+            cursor.execute(
+                self._sql(
+                    f"INSERT INTO analytics.daily_rollups (sensor_id, day, {', '.join(STAT_COLUMNS)}) "
+                    f"SELECT sensor_id, {day}, {', '.join(aggregates)} FROM sensor.sensor_readings "
+                    f"WHERE timestamp >= %s AND timestamp < %s GROUP BY sensor_id, {day}"
+                ),
+                params,
+            )
+            written = cursor.rowcount
+        except Exception:
+            self.write_conn.rollback()
+            raise
+        self.write_conn.commit()
+        return written
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Backfill analytics.daily_rollups from sensor.sensor_readings")
+    parser.add_argument("--backfill", action="store_true", required=True)
+    parser.add_argument("--start", type=date.fromisoformat, required=True, help="first day (inclusive)")
+    parser.add_argument("--end", type=date.fromisoformat, required=True, help="last day (exclusive)")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("DATABASE_URL is not set")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    store = RollupStore(args.database_url)
+    try:
+        store.ensure_schema()
+        day = args.start
+        # One day per transaction keeps each rewrite short
+        while day < args.end:
+            written = store.backfill(day, day + timedelta(days=1))
+            logger.info("Backfilled %s: %d sensors", day.isoformat(), written)
+            day += timedelta(days=1)
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
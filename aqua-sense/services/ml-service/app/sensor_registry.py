@@ -0,0 +1,232 @@
+"""
+In-memory registry of sensors, facilities and tenants for enriching results
+
+Predictions only carry a sensor_id. The registry keeps sensor.sensors,
+sensor.facilities and tenant.tenants as column arrays addressed by interned
+indices (sensor -> facility index -> tenant index), so a batch of results is
+enriched with its facility, tenant and location by a couple of array gathers
+instead of a join per result.
+
+Tables are refreshed like the alert rules: rows whose updated_at moved past
+each table's watermark are re-read, applied to copies of the arrays and
+swapped in with a single assignment, and a full reload every
+`full_reload_every` refreshes drops rows that were deleted outright.
+Interned indices are never reused, so an index seen by a request stays valid.
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.db import Database
+
+logger = logging.getLogger(__name__)
+
+# Columns read from each table (id first, updated_at last)
+SENSOR_COLUMNS = ["id", "facility_id", "sensor_code", "sensor_type", "status", "updated_at"]
+FACILITY_COLUMNS = ["id", "tenant_id", "name", "location_lat", "location_lng", "updated_at"]
+TENANT_COLUMNS = ["id", "name", "plan", "status", "updated_at"]
+
+class _Table:
+    """One table's rows as column arrays, indexed by interned id; unknown rows hold the defaults"""
+
+    def __init__(self, defaults: Dict[str, object], dtypes: Dict[str, type]):
+        self.index: Dict[str, int] = {}
+        self.ids: List[str] = []
+        self.defaults = defaults
+        self.dtypes = dtypes
+        self.known = np.zeros(0, dtype=bool)
+        self.columns = {name: np.empty(0, dtype=dtypes[name]) for name in defaults}
+        self.watermark: Optional[datetime] = None
+
+    def intern(self, row_id) -> int:
+        """Index of an id, assigning the next one the first time it is seen (None is -1)"""
+        if row_id is None:
+            return -1
+        row_id = str(row_id)
+        idx = self.index.get(row_id)
+        if idx is None:
+            idx = self.index[row_id] = len(self.ids)
+            self.ids.append(row_id)
+        return idx
+
+    def apply(self, rows: Sequence[tuple], replace: bool = False) -> int:
+        """Upsert (id, *columns, updated_at) rows; returns the number of rows written"""
+        indices = [self.intern(row[0]) for row in rows]
+        if replace:
+            known = np.zeros(len(self.ids), dtype=bool)
+            columns = {
+                name: np.full(len(self.ids), self.defaults[name], dtype=self.dtypes[name]) for name in self.columns
+            }
+        else:
+            known = self._grown(self.known, False)
+            columns = {name: self._grown(values, self.defaults[name]) for name, values in self.columns.items()}
+        if rows:
+            idx = np.array(indices, dtype=np.int64)
+            known[idx] = True
+            for position, name in enumerate(self.columns, start=1):
+                columns[name][idx] = [
+                    self.defaults[name] if row[position] is None else row[position] for row in rows
+                ]
+            stamps = [row[-1] for row in rows if row[-1] is not None]
+            if stamps and (self.watermark is None or max(stamps) > self.watermark):
+                self.watermark = max(stamps)
+        # Replaced rather than mutated, so readers holding the previous arrays are unaffected
+        self.known, self.columns = known, columns
+        return len(rows)
+
+    def pad(self):
+        """Grow the arrays to cover ids interned as foreign keys by other tables"""
+        if len(self.known) < len(self.ids):
+            self.known, self.columns = self._grown(self.known, False), {
+                name: self._grown(values, self.defaults[name]) for name, values in self.columns.items()
+            }
+
+    def _grown(self, values: np.ndarray, default) -> np.ndarray:
+        grown = np.full(len(self.ids), default, dtype=values.dtype)
+        grown[:len(values)] = values
+        return grown
+
+def gather(values: np.ndarray, index: np.ndarray, missing=-1) -> np.ndarray:
+    """values[index], with `missing` where the index is -1 (also when `values` is empty)"""
+    result = np.full(len(index), missing, dtype=values.dtype)
+    present = index >= 0
+    result[present] = values[index[present]]
+    return result
+
+class Enrichment:
+    """Facility, tenant and location of a batch of sensors, as columns"""
+
+    def __init__(self, registry: "SensorRegistry", sensor: np.ndarray):
+        sensors, facilities, _ = registry.snapshot()
+        self.sensor = sensor
+        facility = gather(sensors["facility"], sensor)
+        # A refresh may have interned facilities after the facility arrays were read
+        self.facility = np.where(facility < len(facilities["tenant"]), facility, -1)
+        self.tenant = gather(facilities["tenant"], self.facility)
+        self._facility_ids = registry.facilities.ids
+        self._tenant_ids = registry.tenants.ids
+        self._facility_names = facilities["name"]
+        self._lat = facilities["location_lat"]
+        self._lng = facilities["location_lng"]
+
+    def __len__(self) -> int:
+        return len(self.sensor)
+
+    @property
+    def tenant_ids(self) -> List[Optional[str]]:
+        return [self._tenant_ids[t] if t >= 0 else None for t in self.tenant.tolist()]
+
+    def to_dicts(self) -> List[dict]:
+        """Per-result fields: facility_id, facility_name, tenant_id, location_lat, location_lng"""
+        names = gather(self._facility_names, self.facility, None).tolist()
+        lat = gather(self._lat, self.facility, np.nan)
+        lng = gather(self._lng, self.facility, np.nan)
+        return [
+            {
+                "facility_id": self._facility_ids[f] if f >= 0 else None,
+                "facility_name": name,
+                "tenant_id": tenant_id,
+                "location_lat": None if y != y else y,
+                "location_lng": None if x != x else x,
+            }
+            for f, name, tenant_id, y, x in zip(self.facility.tolist(), names, self.tenant_ids, lat.tolist(), lng.tolist())
+        ]
+
+class SensorRegistry:
+    """Sensors, facilities and tenants kept in sync with the database by updated_at"""
+
+    def __init__(self, full_reload_every: int = 20):
+        self.sensors = _Table(
+            {"facility": -1, "sensor_code": None, "sensor_type": None, "status": None},
+            {"facility": np.int32, "sensor_code": object, "sensor_type": object, "status": object},
+        )
+        self.facilities = _Table(
+            {"tenant": -1, "name": None, "location_lat": np.nan, "location_lng": np.nan},
+            {"tenant": np.int32, "name": object, "location_lat": np.float64, "location_lng": np.float64},
+        )
+        self.tenants = _Table(
+            {"name": None, "plan": None, "status": None},
+            {"name": object, "plan": object, "status": object},
+        )
+        self.full_reload_every = full_reload_every
+        self.refreshes = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self.refreshes > 0
+
+    def snapshot(self):
+        """Current column dicts of the three tables"""
+        return self.sensors.columns, self.facilities.columns, self.tenants.columns
+
+    def apply(self, sensors: Sequence[tuple] = (), facilities: Sequence[tuple] = (),
+              tenants: Sequence[tuple] = (), replace: bool = False) -> int:
+        """Upsert rows of each table (*_COLUMNS order); returns the number of rows written"""
+        changed = self.tenants.apply(tenants, replace)
+        changed += self.facilities.apply(
+            [(f[0], self.tenants.intern(f[1]), *f[2:]) for f in facilities], replace
+        )
+        changed += self.sensors.apply(
+            [(s[0], self.facilities.intern(s[1]), *s[2:]) for s in sensors], replace
+        )
+        # Facilities can intern tenants and sensors can intern facilities that have no rows yet
+        self.tenants.pad()
+        self.facilities.pad()
+        return changed
+
+    def refresh(self, store: "SensorRegistryStore") -> int:
+        """Pick up rows changed since the last refresh (everything on a periodic full reload)"""
+        full = self.refreshes % self.full_reload_every == 0
+        self.refreshes += 1
+        changed = self.apply(
+            store.fetch("sensor.sensors", SENSOR_COLUMNS, None if full else self.sensors.watermark),
+            store.fetch("sensor.facilities", FACILITY_COLUMNS, None if full else self.facilities.watermark),
+            store.fetch("tenant.tenants", TENANT_COLUMNS, None if full else self.tenants.watermark),
+            replace=full,
+        )
+        if not full:
+            logger.debug("Sensor registry: %d rows re-read", changed)
+        else:
+            logger.info("Sensor registry: %d sensors, %d facilities, %d tenants",
+                        int(self.sensors.known.sum()), int(self.facilities.known.sum()), int(self.tenants.known.sum()))
+        return changed
+
+    def lookup(self, sensor_ids: Sequence[str]) -> np.ndarray:
+        """Interned index of each sensor id, -1 for sensors not in the registry"""
+        index = self.sensors.index
+        known = self.sensors.known
+        sensor = np.fromiter((index.get(str(s), -1) for s in sensor_ids), dtype=np.int64, count=len(sensor_ids))
+        # Ids interned by a concurrent refresh may not be in the arrays read above yet
+        present = (sensor >= 0) & (sensor < len(known))
+        present[present] = known[sensor[present]]
+        return np.where(present, sensor, -1)
+
+    def tenant_plan(self, tenant_id: str) -> Optional[str]:
+        """Plan of a tenant ("" when unset), None for tenants not in the registry"""
+        idx = self.tenants.index.get(tenant_id)
+        known, plans = self.tenants.known, self.tenants.columns["plan"]
+        if idx is None or idx >= len(known) or not known[idx]:
+            return None
+        return plans[idx] or ""
+
+    def enrich(self, sensor_ids: Sequence[str]) -> Enrichment:
+        """Facility, tenant and location of each sensor"""
+        return Enrichment(self, self.lookup(sensor_ids))
+
+class SensorRegistryStore(Database):
+    """Reads sensors, facilities and tenants changed since a watermark"""
+
+    def fetch(self, table: str, columns: List[str], since: Optional[datetime] = None) -> List[tuple]:
+        """Rows of `table` changed at or after `since` (all rows when None)"""
+        rows = self.fetch_since(table, columns, since)
+        if not self.is_sqlite and "location_lat" in columns:
+            # DECIMAL columns arrive as Decimal
+            lat, lng = columns.index("location_lat"), columns.index("location_lng")
+            rows = [
+                row[:lat] + tuple(None if v is None else float(v) for v in row[lat:lng + 1]) + row[lng + 1:]
+                for row in rows
+            ]
+        return rows
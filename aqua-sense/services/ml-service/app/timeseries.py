@@ -0,0 +1,185 @@
+"""
+Downsampled reading time series for dashboard charts
+
+A chart `width` pixels wide cannot show more than a point or two per pixel
+column, so series are reduced server-side on a fixed time grid of `width`
+buckets over [start, end):
+
+- `minmax` keeps the lowest and highest reading of every bucket (spikes are
+  never lost), found with `reduceat` in one pass;
+- `lttb` keeps one point per bucket, the one forming the largest triangle with
+  the previous bucket's pick and the next bucket's average
+  (Largest-Triangle-Three-Buckets). Each pick depends on the one before, so
+  two vectorized passes guess the picks (anchored on the previous bucket's
+  average, then on the first guesses); a walk over the buckets then keeps the
+  second guess wherever its anchor turned out right and only recomputes the
+  other buckets, giving exactly the sequential algorithm's picks.
+
+Because buckets sit on a fixed grid, a poll can continue where the previous
+response stopped: the cursor records the grid and the start of the last,
+still-open bucket, and the next request only reads and reduces readings from
+there on. Clients replace their points from `replace_from` onward.
+"""
+
+import base64
+import json
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.db import Database
+from app.models import FEATURE_NAMES
+
+METHODS = ("lttb", "minmax")
+MAX_WIDTH = 10_000
+
+class SeriesCursor:
+    """Time grid of a downsampled query and where the next poll resumes"""
+
+    def __init__(self, anchor: float, bucket: float, method: str, resume_from: float):
+        self.anchor = anchor
+        self.bucket = bucket
+        self.method = method
+        self.resume_from = resume_from
+
+    def encode(self) -> str:
+        payload = json.dumps([self.anchor, self.bucket, self.method, self.resume_from]).encode()
+        return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+    @classmethod
+    def decode(cls, token: str) -> "SeriesCursor":
+        """Raises ValueError for anything that is not a cursor returned by this endpoint"""
+        try:
+            anchor, bucket, method, resume_from = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+            cursor = cls(float(anchor), float(bucket), str(method), float(resume_from))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"invalid cursor: {e}") from e
+        if cursor.bucket <= 0 or cursor.method not in METHODS:
+            raise ValueError("invalid cursor")
+        return cursor
+
+    def bucket_start(self, t: float) -> float:
+        """Start of the grid bucket containing t"""
+        return self.anchor + np.floor((t - self.anchor) / self.bucket) * self.bucket
+
+def _group_starts(bucket: np.ndarray) -> np.ndarray:
+    return np.r_[0, np.flatnonzero(np.diff(bucket)) + 1]
+
+def _first_max(values: np.ndarray, starts: np.ndarray, group: np.ndarray) -> np.ndarray:
+    """Index of the first maximum within each group (contiguous runs beginning at starts)"""
+    hits = np.flatnonzero(values == np.maximum.reduceat(values, starts)[group])
+    return hits[np.r_[True, group[hits][1:] != group[hits][:-1]]]
+
+def minmax(t: np.ndarray, v: np.ndarray, bucket: np.ndarray) -> np.ndarray:
+    """Indices (in time order) of the lowest and highest point of every bucket"""
+    if not len(t):
+        return np.empty(0, dtype=np.int64)
+    starts = _group_starts(bucket)
+    group = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(t)]))
+    return np.unique(np.concatenate([_first_max(-v, starts, group), _first_max(v, starts, group)]))
+
+def lttb(t: np.ndarray, v: np.ndarray, bucket: np.ndarray) -> np.ndarray:
+    """Indices (in time order) of one point per bucket, by largest triangle area"""
+    n = len(t)
+    starts = _group_starts(bucket) if n else np.empty(0, dtype=np.int64)
+    buckets = len(starts)
+    if buckets < 3:
+        return np.unique(np.r_[0, n - 1]) if n else np.empty(0, dtype=np.int64)
+    counts = np.diff(np.r_[starts, n])
+    mean_t = np.add.reduceat(t, starts) / counts
+    mean_v = np.add.reduceat(v, starts) / counts
+    group = np.repeat(np.arange(buckets), counts)
+    previous = np.maximum(group - 1, 0)
+    next_t = mean_t[np.minimum(group + 1, buckets - 1)]
+    next_v = mean_v[np.minimum(group + 1, buckets - 1)]
+
+    def best(anchor_t: np.ndarray, anchor_v: np.ndarray) -> np.ndarray:
+        area = np.abs((anchor_t - next_t) * (v - anchor_v) - (anchor_t - t) * (next_v - anchor_v))
+        return _first_max(area, starts, group)
+
+    guess = best(mean_t[previous], mean_v[previous])
+    guess[0] = 0
+    refined = best(t[guess][previous], v[guess][previous])
+
+    picks = np.empty(buckets, dtype=np.int64)
+    picks[0], picks[-1] = 0, n - 1
+    guess, refined, begins, ends = guess.tolist(), refined.tolist(), starts.tolist(), (starts + counts).tolist()
+    anchor = 0
+    for i in range(1, buckets - 1):
+        if anchor == guess[i - 1]:
+            anchor = refined[i]
+        else:
+            lo, hi = begins[i], ends[i]
+            area = np.abs(
+                (t[anchor] - mean_t[i + 1]) * (v[lo:hi] - v[anchor]) - (t[anchor] - t[lo:hi]) * (mean_v[i + 1] - v[anchor])
+            )
+            anchor = lo + int(np.argmax(area))
+        picks[i] = anchor
+    return picks
+
+DOWNSAMPLERS = {"lttb": lttb, "minmax": minmax}
+
+def downsample(t: np.ndarray, v: np.ndarray, cursor: SeriesCursor) -> Tuple[np.ndarray, np.ndarray]:
+    """Reduce one series (sorted by time, missing values dropped) on the cursor's grid"""
+    present = ~np.isnan(v)
+    t, v = t[present], v[present]
+    bucket = np.floor((t - cursor.anchor) / cursor.bucket).astype(np.int64)
+    picks = DOWNSAMPLERS[cursor.method](t, v, bucket)
+    return t[picks], v[picks]
+
+def downsample_series(
+    sensors: np.ndarray, t: np.ndarray, values: np.ndarray, metrics: Sequence[str], cursor: SeriesCursor
+) -> List[dict]:
+    """Per-sensor columnar series (epoch milliseconds and values) for rows sorted by (sensor, time)"""
+    series = []
+    if not len(t):
+        return series
+    starts = np.r_[0, np.flatnonzero(sensors[1:] != sensors[:-1]) + 1]
+    for begin, end in zip(starts.tolist(), np.r_[starts[1:], len(t)].tolist()):
+        points: Dict[str, dict] = {}
+        for column, metric in enumerate(metrics):
+            pt, pv = downsample(t[begin:end], values[begin:end, column], cursor)
+            points[metric] = {"t": np.round(pt * 1000).astype(np.int64).tolist(), "v": pv.tolist()}
+        series.append({"sensor_id": sensors[begin], "metrics": points})
+    return series
+
+class ReadingSeriesStore(Database):
+    """Reads sensor.sensor_readings as (sensor_id, epoch seconds, *metrics) rows"""
+
+    def fetch_series(
+        self, sensor_ids: List[str], start: float, end: float, metrics: Sequence[str], chunk_size: int = 50_000
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Readings of the sensors with start <= epoch < end, sorted by (sensor_id, timestamp)"""
+        if self.is_sqlite:
+            epoch, to_timestamp = "(julianday(timestamp) - 2440587.5) * 86400.0", "datetime(%s, 'unixepoch')"
+        else:
+            epoch, to_timestamp = "EXTRACT(EPOCH FROM timestamp)", "to_timestamp(%s) AT TIME ZONE 'UTC'"
+        columns = ", ".join(f"CAST({metric} AS DOUBLE PRECISION)" for metric in metrics)
+        query = (
+            f"SELECT sensor_id, {epoch}, {columns} FROM sensor.sensor_readings "
+            f"WHERE sensor_id IN ({', '.join(['%s'] * len(sensor_ids))}) "
+            f"AND timestamp >= {to_timestamp} AND timestamp < {to_timestamp} "
+            "ORDER BY sensor_id, timestamp"
+        )
+        cursor = self.read_conn.cursor()
+        cursor.execute(self._sql(query), self._params(list(sensor_ids) + [start, end]))
+        sensors, numbers = [], []
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            sensors.extend(str(row[0]) for row in rows)
+            numbers.extend(row[1:] for row in rows)
+        cursor.close()
+        self._end_read(self.read_conn.commit)
+        # NULL readings become NaN and are dropped per metric
+        table = np.array(numbers, dtype=np.float64).reshape(-1, len(metrics) + 1)
+        return np.array(sensors, dtype=object), table[:, 0], table[:, 1:]
+
+def parse_metrics(metrics: Optional[str]) -> List[str]:
+    """Requested metric names (all reading metrics by default); raises ValueError for unknown ones"""
+    names = [m.strip() for m in metrics.split(",") if m.strip()] if metrics else list(FEATURE_NAMES)
+    unknown = [m for m in names if m not in FEATURE_NAMES]
+    if unknown or not names:
+        raise ValueError(f"unknown metrics {unknown}, expected some of {FEATURE_NAMES}")
+    return names
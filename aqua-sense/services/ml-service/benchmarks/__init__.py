@@ -0,0 +1,3 @@
+"""
+Benchmarks for the ML service (see benchmarks/run.py)
+"""
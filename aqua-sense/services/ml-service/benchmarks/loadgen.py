@@ -0,0 +1,307 @@
+"""
+Open-loop load generator and traffic replay for the ML service
+
+Drives POST /predict/water-quality and /detect/anomalies at a target request
+rate from one asyncio loop over a pooled HTTP client. Requests are sent on
+schedule whether or not earlier ones have completed (open loop), and latency
+is measured from the scheduled send time, so a saturated service shows up as
+growing latency instead of a quietly lower request rate.
+
+Traffic is either synthetic or replayed:
+
+- synthetic: a fleet of sensors with a diurnal temperature / dissolved oxygen
+  cycle and bursty anomaly episodes (extreme pH and turbidity for a run of
+  consecutive readings). The request rate follows the same diurnal curve;
+  --time-scale compresses the simulated day into the run.
+- replay: an NDJSON capture with one SensorReading per line (the format
+  /predict/stream accepts). Lines are grouped into requests and sent with the
+  gaps between their timestamps divided by --speed, or at --rate if given.
+  --capture writes the synthetic traffic in this format.
+
+    uvicorn app.main:app --port 8086 &
+    python -m benchmarks.loadgen --url http://127.0.0.1:8086 --rate 200 --duration 60
+    python -m benchmarks.loadgen --replay capture.ndjson --speed 10
+
+The report (JSON on stdout) has the latency distribution, error rate and
+achieved throughput, overall and per endpoint.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from app.models import CONDUCTIVITY, DISSOLVED_OXYGEN, FEATURE_NAMES, PH, TEMPERATURE, TURBIDITY
+from benchmarks.synthetic import generate_features, generate_readings
+
+ENDPOINTS = {"predict": "/predict/water-quality", "detect": "/detect/anomalies"}
+DAY = 86400.0
+
+class SensorFleet:
+    """Synthetic readings from a fleet of sensors with daily cycles and anomaly episodes"""
+
+    def __init__(
+        self,
+        sensors: int = 5000,
+        episode_rate: float = 0.0005,
+        episode_length: int = 30,
+        seed: Optional[int] = 0,
+        start: datetime = datetime(2024, 1, 1),
+    ):
+        self.rng = np.random.default_rng(seed)
+        self.episode_rate = episode_rate
+        self.episode_length = episode_length
+        self.start = start
+        template = generate_readings(sensors, sensors=sensors, anomaly_rate=0.0, seed=seed)
+        self.sensor_ids = [reading["sensor_id"] for reading in template]
+        # Each sensor keeps its own baseline, so readings vary around a per-site level
+        self.baseline = generate_features(sensors, anomaly_rate=0.0, seed=seed)
+        self.episode_left = np.zeros(sensors, dtype=np.int64)
+        self.next_sensor = 0
+
+    def readings(self, count: int, sim_time: float) -> List[dict]:
+        """The next `count` reports, taken round-robin across the fleet at simulated time `sim_time`"""
+        sensors = (self.next_sensor + np.arange(count)) % len(self.sensor_ids)
+        self.next_sensor = int(sensors[-1] + 1) if count else self.next_sensor
+
+        day_phase = 2 * math.pi * ((sim_time % DAY) / DAY - 0.375)  # warmest mid-afternoon
+        features = self.baseline[sensors] + self.rng.normal(0, 0.05, (count, len(FEATURE_NAMES))) * self.baseline[sensors]
+        features[:, TEMPERATURE] += 4.0 * math.sin(day_phase)
+        features[:, DISSOLVED_OXYGEN] -= 1.0 * math.sin(day_phase)
+
+        starting = (self.episode_left[sensors] == 0) & (self.rng.random(count) < self.episode_rate)
+        self.episode_left[sensors[starting]] = self.rng.integers(1, 2 * self.episode_length, int(starting.sum()))
+        in_episode = self.episode_left[sensors] > 0
+        features[in_episode, PH] = self.rng.choice([3.0, 11.0], int(in_episode.sum()))
+        features[in_episode, TURBIDITY] *= 20
+        features[in_episode, CONDUCTIVITY] *= 3
+        self.episode_left[sensors[in_episode]] -= 1
+
+        timestamp = (self.start + timedelta(seconds=sim_time)).isoformat()
+        return [
+            {"sensor_id": self.sensor_ids[sensor], **dict(zip(FEATURE_NAMES, np.round(row, 3).tolist())),
+             "timestamp": timestamp}
+            for sensor, row in zip(sensors.tolist(), features)
+        ]
+
+def diurnal_rate(base_rate: float, sim_time: float, amplitude: float) -> float:
+    """Request rate at a simulated time of day: the base rate swung by +-amplitude, peaking mid-day"""
+    return base_rate * (1 + amplitude * math.sin(2 * math.pi * ((sim_time % DAY) / DAY - 0.25)))
+
+def synthetic_schedule(
+    fleet: SensorFleet, rate: float, duration: float, time_scale: float, amplitude: float,
+    readings_per_request: int, poisson: bool, rng: np.random.Generator,
+) -> Iterator[Tuple[float, List[dict]]]:
+    """(send offset in seconds, readings) for every request of a synthetic run"""
+    offset = 0.0
+    while True:
+        current = max(diurnal_rate(rate, offset * time_scale, amplitude), 1e-6)
+        offset += rng.exponential(1 / current) if poisson else 1 / current
+        if offset >= duration:
+            return
+        yield offset, fleet.readings(readings_per_request, offset * time_scale)
+
+def replay_schedule(
+    path: str, readings_per_request: int, speed: float, rate: Optional[float]
+) -> Iterator[Tuple[float, List[dict]]]:
+    """(send offset in seconds, readings) for requests built from an NDJSON capture"""
+    first = None
+    batch: List[dict] = []
+    sent = 0
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            batch.append(json.loads(line))
+            if len(batch) < readings_per_request:
+                continue
+            yield replay_offset(batch, sent, speed, rate, first), batch
+            if first is None:
+                first = datetime.fromisoformat(batch[0]["timestamp"])
+            sent += 1
+            batch = []
+    if batch:
+        yield replay_offset(batch, sent, speed, rate, first), batch
+
+def replay_offset(batch: List[dict], sent: int, speed: float, rate: Optional[float], first: Optional[datetime]) -> float:
+    if rate:
+        return sent / rate
+    if first is None:
+        return 0.0
+    return max(0.0, (datetime.fromisoformat(batch[0]["timestamp"]) - first).total_seconds() / speed)
+
+class LoadStats:
+    """Latency and outcome of every request, by endpoint"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.outcomes: Dict[str, Counter] = defaultdict(Counter)
+        self.readings = 0
+        self.dropped = 0
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+
+    def record(self, endpoint: str, latency: Optional[float], outcome: str, readings: int):
+        if latency is not None:
+            self.latencies[endpoint].append(latency)
+        self.outcomes[endpoint][outcome] += 1
+        if outcome == "200":
+            self.readings += readings
+
+    @staticmethod
+    def summarize(latencies: List[float], outcomes: Counter, elapsed: float) -> dict:
+        values = np.asarray(latencies, dtype=np.float64) * 1000
+        total = sum(outcomes.values())
+        ok = outcomes.get("200", 0)
+
+        def pct(q: float) -> Optional[float]:
+            return round(float(np.percentile(values, q)), 3) if len(values) else None
+
+        return {
+            "requests": total,
+            "ok": ok,
+            "error_rate": round((total - ok) / total, 4) if total else 0.0,
+            "outcomes": dict(outcomes),
+            "throughput_rps": round(ok / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": {
+                "p50": pct(50), "p90": pct(90), "p99": pct(99), "p99.9": pct(99.9),
+                "max": round(float(values.max()), 3) if len(values) else None,
+            },
+        }
+
+    def report(self, offered: int, duration: float) -> dict:
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        combined_latencies = [value for values in self.latencies.values() for value in values]
+        combined_outcomes = sum(self.outcomes.values(), Counter())
+        report = self.summarize(combined_latencies, combined_outcomes, elapsed)
+        report.update({
+            "offered_requests": offered,
+            "offered_rps": round(offered / duration, 2) if duration else None,
+            "dropped": self.dropped,
+            "elapsed_s": round(elapsed, 3),
+            "readings_per_s": round(self.readings / elapsed, 1) if elapsed else 0.0,
+            "endpoints": {
+                endpoint: self.summarize(self.latencies[endpoint], self.outcomes[endpoint], elapsed)
+                for endpoint in self.outcomes
+            },
+        })
+        return report
+
+async def send(client: httpx.AsyncClient, endpoint: str, readings: List[dict], scheduled: float, stats: LoadStats):
+    """POST one request; latency counts from when it was scheduled to be sent"""
+    try:
+        response = await client.post(ENDPOINTS[endpoint], json={"readings": readings})
+        outcome = str(response.status_code)
+    except httpx.HTTPError as e:
+        outcome = type(e).__name__
+    stats.record(endpoint, time.perf_counter() - scheduled, outcome, len(readings))
+
+async def paced(schedule: Iterator[Tuple[float, List[dict]]]) -> AsyncIterator[Tuple[float, List[dict]]]:
+    """Yield scheduled requests at their send time (absolute perf_counter value)"""
+    started = time.perf_counter()
+    for offset, readings in schedule:
+        delay = started + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield started + offset, readings
+
+async def run_load(
+    url: str,
+    schedule: Iterator[Tuple[float, List[dict]]],
+    endpoints: List[str],
+    connections: int,
+    max_in_flight: int,
+    timeout: float,
+    capture: Optional[str] = None,
+) -> Tuple[LoadStats, int, float]:
+    """Send every scheduled request; returns the stats, requests offered and scheduled duration"""
+    stats = LoadStats()
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    in_flight = set()
+    offered = 0
+    last_offset = 0.0
+    capture_file = open(capture, "w") if capture else None
+    try:
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=timeout) as client:
+            async for scheduled, readings in paced(schedule):
+                endpoint = endpoints[offered % len(endpoints)]
+                offered += 1
+                last_offset = scheduled - stats.started_at
+                if capture_file is not None:
+                    capture_file.writelines(json.dumps(reading) + "\n" for reading in readings)
+                if len(in_flight) >= max_in_flight:
+                    # Open loop: never wait for the service, count what could not be sent instead
+                    stats.dropped += 1
+                    stats.record(endpoint, None, "dropped", len(readings))
+                    continue
+                task = asyncio.create_task(send(client, endpoint, readings, scheduled, stats))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            if in_flight:
+                await asyncio.wait(in_flight)
+    finally:
+        if capture_file is not None:
+            capture_file.close()
+    stats.finished_at = time.perf_counter()
+    return stats, offered, last_offset
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Open-loop load generator for the ML service")
+    parser.add_argument("--url", default="http://127.0.0.1:8086")
+    parser.add_argument("--endpoints", default="predict,detect", help="comma-separated, sent in rotation")
+    parser.add_argument("--rate", type=float, help="target requests per second (synthetic default: 100)")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of synthetic traffic")
+    parser.add_argument("--readings-per-request", type=int, default=1)
+    parser.add_argument("--constant", action="store_true", help="evenly spaced arrivals instead of Poisson")
+    parser.add_argument("--sensors", type=int, default=5000)
+    parser.add_argument("--diurnal-amplitude", type=float, default=0.5, help="request rate swing over the day")
+    parser.add_argument("--time-scale", type=float, default=DAY / 600,
+                        help="simulated seconds per real second (default: a day every 10 minutes)")
+    parser.add_argument("--episode-rate", type=float, default=0.0005,
+                        help="chance per reading that a sensor starts an anomaly episode")
+    parser.add_argument("--episode-length", type=int, default=30, help="mean readings per anomaly episode")
+    parser.add_argument("--replay", help="NDJSON capture to replay instead of synthetic traffic")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed-up over capture timestamps")
+    parser.add_argument("--capture", help="write the readings sent to this NDJSON file")
+    parser.add_argument("--connections", type=int, default=100, help="HTTP connection pool size")
+    parser.add_argument("--max-in-flight", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON report here")
+    args = parser.parse_args(argv)
+
+    endpoints = [name for name in args.endpoints.split(",") if name]
+    unknown = [name for name in endpoints if name not in ENDPOINTS]
+    if not endpoints or unknown:
+        parser.error(f"--endpoints must be a list of {', '.join(ENDPOINTS)}")
+
+    if args.replay:
+        schedule = replay_schedule(args.replay, args.readings_per_request, args.speed, args.rate)
+    else:
+        fleet = SensorFleet(args.sensors, episode_rate=args.episode_rate,
+                            episode_length=args.episode_length, seed=args.seed)
+        schedule = synthetic_schedule(
+            fleet, args.rate or 100.0, args.duration, args.time_scale, args.diurnal_amplitude,
+            args.readings_per_request, not args.constant, np.random.default_rng(args.seed),
+        )
+
+    stats, offered, duration = asyncio.run(
+        run_load(args.url, schedule, endpoints, args.connections, args.max_in_flight, args.timeout, args.capture)
+    )
+    report = stats.report(offered, duration)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if offered else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""
+Benchmarks for the ML models and scoring endpoints
+
+Measures every stage of the two POST handlers across batch sizes:
+
+- inprocess: parse (JSON decoding and request validation), features
+  (extract_features), model (WaterQualityModel.predict / AnomalyDetector.detect)
+  and serialization (result dicts and JSON encoding), called directly
+- http: POST /predict/water-quality and /detect/anomalies through the FastAPI
+  test client, end to end and per stage (read back from the service's own
+  aquasense_ml_stage_seconds histograms)
+
+Each result reports p50/p99 latency and throughput in readings per second.
+Results are written as JSON; compared against a baseline, the run exits 1 when
+any p50 is slower than the baseline by more than the tolerance.
+
+    python -m benchmarks.run                                # print results
+    python -m benchmarks.run --save-baseline                # record benchmarks/baseline.json
+    python -m benchmarks.run --check --tolerance 0.25       # fail on regressions
+
+Run from services/ml-service. Baselines are machine-specific: record and check
+them on the same hardware. The prediction cache is disabled unless --cache is
+given, since repeated synthetic batches would otherwise be cache hits.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_SIZES = [1, 10, 100, 1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Readings timed per (stage, size) at most, so the 1M batches get a few runs and the small ones many
+ROW_BUDGET = 3_000_000
+
+def configure_service(cache: bool):
+    """Service settings for benchmarking; must run before app.main is imported"""
+    os.environ.setdefault("PREDICTION_CACHE_ENABLED", "true" if cache else "false")
+    os.environ.setdefault("MODEL_RELOAD_INTERVAL", "0")
+    os.environ.setdefault("ONLINE_STATE_PATH", "")
+
+def repeats_for(size: int, repeat: int) -> int:
+    return max(3, min(repeat, ROW_BUDGET // size))
+
+def summarize(samples: List[float], rows: int) -> dict:
+    """p50/p99 latency (ms) and throughput (readings/s) of a list of timings in seconds"""
+    values = np.asarray(samples, dtype=np.float64)
+    p50 = float(np.percentile(values, 50))
+    return {
+        "p50_ms": round(p50 * 1000, 4),
+        "p99_ms": round(float(np.percentile(values, 99)) * 1000, 4),
+        "rows_per_s": round(rows / p50, 1) if p50 > 0 else None,
+        "runs": len(values),
+    }
+
+def time_calls(fn: Callable[[], object], runs: int) -> List[float]:
+    """Wall time of `runs` calls, with garbage collection paused (as timeit does)"""
+    fn()  # warm-up
+    samples = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(runs):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return samples
+
+def bench_inprocess(sizes: List[int], repeat: int) -> Dict[str, dict]:
+    from app.main import PredictionRequest, extract_features
+    from app.models import AnomalyDetector, WaterQualityModel
+    from benchmarks.synthetic import generate_readings
+
+    quality_model, anomaly_detector = WaterQualityModel(), AnomalyDetector()
+    results = {}
+    for size in sizes:
+        runs = repeats_for(size, repeat)
+        body = json.dumps({"readings": generate_readings(size)}).encode()
+        request = PredictionRequest.model_validate(json.loads(body))
+        features = extract_features(request.readings)
+        predictions = quality_model.predict(features)
+        flags = anomaly_detector.detect(features)
+
+        def serialize_predictions():
+            rows = predictions.to_dicts()
+            for reading, row in zip(request.readings, rows):
+                row["sensor_id"] = reading.sensor_id
+                row["timestamp"] = reading.timestamp.isoformat()
+            return json.dumps({"predictions": rows}).encode()
+
+        def serialize_anomalies():
+            rows = flags.to_dicts()
+            for row in rows:
+                reading = request.readings[row["reading_index"]]
+                row["sensor_id"] = reading.sensor_id
+                row["timestamp"] = reading.timestamp.isoformat()
+            return json.dumps({"anomalies": rows}).encode()
+
+        stages = {
+            "parse": lambda: PredictionRequest.model_validate(json.loads(body)),
+            "features": lambda: extract_features(request.readings),
+            "model.predict": lambda: quality_model.predict(features),
+            "model.detect": lambda: anomaly_detector.detect(features),
+            "serialization.predict": serialize_predictions,
+            "serialization.detect": serialize_anomalies,
+        }
+        for stage, fn in stages.items():
+            results[f"inprocess.{stage}.{size}"] = summarize(time_calls(fn, runs), size)
+        log_size("inprocess", size, results)
+    return results
+
+def bench_http(sizes: List[int], repeat: int) -> Dict[str, dict]:
+    from fastapi.testclient import TestClient
+    from prometheus_client import REGISTRY
+
+    from app.main import app
+    from benchmarks.synthetic import generate_readings
+
+    endpoints = {"predict": ("/predict/water-quality", "predict_water_quality"),
+                 "detect": ("/detect/anomalies", "detect_anomalies")}
+    stages = ("parse", "features", "model", "serialization")
+
+    def stage_sums(endpoint: str) -> Dict[str, float]:
+        return {
+            stage: REGISTRY.get_sample_value(
+                "aquasense_ml_stage_seconds_sum", {"endpoint": endpoint, "stage": stage}
+            ) or 0.0
+            for stage in stages
+        }
+
+    results = {}
+    with TestClient(app) as client:
+        for size in sizes:
+            runs = repeats_for(size, repeat)
+            body = json.dumps({"readings": generate_readings(size)}).encode()
+            headers = {"content-type": "application/json"}
+            for name, (path, endpoint) in endpoints.items():
+                client.post(path, content=body, headers=headers).raise_for_status()
+                totals, per_stage = [], {stage: [] for stage in stages}
+                for _ in range(runs):
+                    before = stage_sums(endpoint)
+                    start = time.perf_counter()
+                    client.post(path, content=body, headers=headers).raise_for_status()
+                    totals.append(time.perf_counter() - start)
+                    after = stage_sums(endpoint)
+                    for stage in stages:
+                        per_stage[stage].append(after[stage] - before[stage])
+
+                results[f"http.{name}.total.{size}"] = summarize(totals, size)
+                for stage in stages:
+                    results[f"http.{name}.{stage}.{size}"] = summarize(per_stage[stage], size)
+            log_size("http", size, results)
+    return results
+
+def log_size(mode: str, size: int, results: Dict[str, dict]):
+    suffix = f".{size}"
+    line = ", ".join(
+        f"{key[len(mode) + 1:-len(suffix)]} {value['p50_ms']:.3f}ms"
+        for key, value in results.items()
+        if key.startswith(f"{mode}.") and key.endswith(suffix)
+    )
+    print(f"[{mode}] n={size}: {line}", file=sys.stderr)
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float, min_delta_ms: float) -> List[str]:
+    """Descriptions of every result whose p50 regressed past the tolerance"""
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        limit = reference["p50_ms"] * (1 + tolerance)
+        if result["p50_ms"] > limit and result["p50_ms"] - reference["p50_ms"] > min_delta_ms:
+            regressions.append(
+                f"{key}: p50 {result['p50_ms']:.3f}ms vs baseline {reference['p50_ms']:.3f}ms "
+                f"(+{(result['p50_ms'] / reference['p50_ms'] - 1) * 100:.0f}%)"
+            )
+    return regressions
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor() or None,
+        "cpus": os.cpu_count(),
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the ML service models and endpoints")
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=30, help="timed runs per stage and size (fewer for large batches)")
+    parser.add_argument("--http-max-size", type=int, default=100_000,
+                        help="largest batch sent through the test client")
+    parser.add_argument("--no-http", action="store_true", help="only run the in-process benchmarks")
+    parser.add_argument("--cache", action="store_true", help="keep the prediction cache enabled")
+    parser.add_argument("--output", help="also write the results JSON here")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="exit 1 when a result regresses past the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 slowdown, as a fraction")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05,
+                        help="ignore slowdowns smaller than this, which are timer noise")
+    args = parser.parse_args(argv)
+
+    configure_service(args.cache)
+    results = bench_inprocess(args.sizes, args.repeat)
+    if not args.no_http:
+        results.update(bench_http([size for size in args.sizes if size <= args.http_max_size], args.repeat))
+
+    report = {"environment": environment(), "results": results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+
+    if args.check:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.baseline}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
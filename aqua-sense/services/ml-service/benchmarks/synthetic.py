@@ -0,0 +1,52 @@
+"""
+Synthetic sensor readings for benchmarks and load tests
+
+Values are drawn around typical drinking-water ranges, with a configurable
+fraction of readings pushed outside the anomaly thresholds, so the models take
+both their normal and flagged paths.
+"""
+
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import numpy as np
+
+from app.models import CONDUCTIVITY, DISSOLVED_OXYGEN, FEATURE_NAMES, PH, TEMPERATURE, TURBIDITY
+
+def generate_features(n: int, anomaly_rate: float = 0.05, seed: Optional[int] = 0) -> np.ndarray:
+    """(n, len(FEATURE_NAMES)) float64 feature matrix"""
+    rng = np.random.default_rng(seed)
+    features = np.empty((n, len(FEATURE_NAMES)))
+    features[:, PH] = rng.normal(7.2, 0.6, n)
+    features[:, TEMPERATURE] = rng.normal(19.0, 5.0, n)
+    features[:, TURBIDITY] = rng.lognormal(0.5, 0.8, n)
+    features[:, DISSOLVED_OXYGEN] = rng.normal(8.0, 1.5, n)
+    features[:, CONDUCTIVITY] = rng.normal(500.0, 150.0, n)
+
+    anomalous = np.flatnonzero(rng.random(n) < anomaly_rate)
+    features[anomalous, PH] = rng.choice([2.5, 11.5], len(anomalous))
+    features[anomalous, TURBIDITY] = rng.uniform(50, 200, len(anomalous))
+    return np.round(features, 3)
+
+def generate_readings(
+    n: int,
+    sensors: int = 1000,
+    anomaly_rate: float = 0.05,
+    seed: Optional[int] = 0,
+    start: datetime = datetime(2024, 1, 1),
+    interval: timedelta = timedelta(minutes=1),
+) -> List[dict]:
+    """`n` SensorReading-shaped dicts from a pool of sensors, in timestamp order"""
+    rng = np.random.default_rng(seed)
+    sensor_ids = [str(uuid.UUID(int=int(value))) for value in rng.integers(0, 2**63, max(1, sensors))]
+    features = generate_features(n, anomaly_rate, seed).tolist()
+    owners = rng.integers(0, len(sensor_ids), n).tolist()
+
+    readings = []
+    for idx, (row, owner) in enumerate(zip(features, owners)):
+        reading = dict(zip(FEATURE_NAMES, row))
+        reading["sensor_id"] = sensor_ids[owner]
+        reading["timestamp"] = (start + interval * (idx // len(sensor_ids))).isoformat()
+        readings.append(reading)
+    return readings
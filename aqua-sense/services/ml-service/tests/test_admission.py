@@ -0,0 +1,52 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.main as main
+from app.admission import parse_deadline
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+def test_timeout_is_relative_to_now():
+    before = time.monotonic()
+    deadline = parse_deadline("2.5", None)
+    assert before + 2.5 <= deadline <= time.monotonic() + 2.5
+
+def test_absolute_deadline_is_converted_to_the_monotonic_clock():
+    deadline = parse_deadline(None, str(time.time() + 10))
+    assert deadline - time.monotonic() == pytest.approx(10, abs=0.1)
+
+def test_earlier_of_both_headers_wins_and_default_applies_to_neither():
+    now = time.monotonic()
+    assert parse_deadline("1", str(time.time() + 60)) - now == pytest.approx(1, abs=0.1)
+    assert parse_deadline("60", str(time.time() + 1)) - now == pytest.approx(1, abs=0.1)
+    assert parse_deadline(None, None, default_timeout=5) - now == pytest.approx(5, abs=0.1)
+    # An explicit deadline replaces the default timeout, even a later one
+    assert parse_deadline(None, str(time.time() + 60), default_timeout=5) - now == pytest.approx(60, abs=0.1)
+    assert parse_deadline(None, None) is None
+
+@pytest.mark.parametrize("timeout, deadline", [("soon", None), ("0", None), ("-1", None), ("inf", None), (None, "nan")])
+def test_malformed_values_raise(timeout, deadline):
+    with pytest.raises(ValueError):
+        parse_deadline(timeout, deadline)
+
+def test_malformed_header_is_answered_400(client):
+    response = client.post("/detect/anomalies", json={"readings": []}, headers={"X-Request-Timeout": "soon"})
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Invalid deadline")
+
+def test_request_past_its_deadline_is_shed(client):
+    response = client.post(
+        "/detect/anomalies", json={"readings": []}, headers={"X-Request-Deadline": str(time.time() - 1)}
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+    response = client.post(
+        "/detect/anomalies", json={"readings": []}, headers={"X-Request-Deadline": str(time.time() + 30)}
+    )
+    assert response.status_code == 200
@@ -0,0 +1,123 @@
+import operator
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from app.alert_rules import CONDITIONS, AlertRuleEngine, AlertRuleStore, CompiledRules, alert_records
+from app.models import FEATURE_NAMES
+
+OPERATORS = [operator.gt, operator.ge, operator.lt, operator.le, operator.eq, operator.ne]
+NOW = datetime(2024, 1, 1)
+
+def reference(rules: dict, tenants: dict, tenant_index: np.ndarray, features: np.ndarray) -> set:
+    """(reading, rule id) pairs fired by checking every rule of the reading's tenant in turn"""
+    by_index = {index: tenant_id for tenant_id, index in tenants.items()}
+    fired = set()
+    for reading, (tenant, row) in enumerate(zip(tenant_index.tolist(), features)):
+        for rule_id, (tenant_id, _, metric, condition, threshold, _, enabled) in rules.items():
+            value = row[FEATURE_NAMES.index(metric)]
+            if enabled and by_index.get(tenant) == tenant_id and not np.isnan(value) \
+                    and OPERATORS[CONDITIONS.index(condition)](value, threshold):
+                fired.add((reading, rule_id))
+    return fired
+
+def evaluated(compiled: CompiledRules, tenant_index: np.ndarray, features: np.ndarray) -> set:
+    fired = compiled.evaluate(tenant_index, features)
+    return set(zip(fired.reading_index.tolist(), compiled.rule_ids[fired.rule_index].tolist()))
+
+def test_bands_and_tenant_specific_thresholds_match_per_rule_loop():
+    tenants = {"plant-a": 0, "plant-b": 1}
+    rules = {
+        # A pH band per tenant (two one-sided rules each), with different limits
+        "a-ph-low": ("plant-a", "pH low", "ph", "less_than", 6.5, "high", True),
+        "a-ph-high": ("plant-a", "pH high", "ph", "greater_than", 8.5, "high", True),
+        "b-ph-low": ("plant-b", "pH low", "ph", "less_than_or_equal", 6.0, "high", True),
+        "b-ph-high": ("plant-b", "pH high", "ph", "greater_than_or_equal", 9.0, "high", True),
+        "a-turbidity": ("plant-a", "Turbid", "turbidity", "greater_than", 10.0, "medium", True),
+        "b-turbidity": ("plant-b", "Turbid", "turbidity", "greater_than", 5.0, "medium", True),
+        "b-disabled": ("plant-b", "Off", "temperature", "greater_than", 0.0, "low", False),
+    }
+    features = np.array([
+        [6.4, 20.0, 4.0, 8.0, 500.0],
+        [6.0, 20.0, 6.0, 8.0, 500.0],
+        [8.6, 20.0, 11.0, 8.0, 500.0],
+        [9.0, 20.0, np.nan, 8.0, 500.0],
+        [7.0, 20.0, 1.0, 8.0, 500.0],
+    ])
+    compiled = CompiledRules(rules, tenants)
+    for tenant in (0, 1, -1):
+        tenant_index = np.full(len(features), tenant)
+        assert evaluated(compiled, tenant_index, features) == reference(rules, tenants, tenant_index, features)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_rules_match_per_rule_loop(seed):
+    rng = np.random.default_rng(seed)
+    tenants = {f"tenant-{t}": t for t in range(3)}
+    rules = {
+        f"rule-{r}": (
+            f"tenant-{rng.integers(3)}", f"rule {r}", FEATURE_NAMES[rng.integers(len(FEATURE_NAMES))],
+            CONDITIONS[rng.integers(len(CONDITIONS))], float(rng.integers(0, 10)), "low", bool(rng.random() < 0.9),
+        )
+        for r in range(40)
+    }
+    # Integer-valued readings hit thresholds exactly, exercising the equality boundaries
+    features = rng.integers(0, 10, size=(200, len(FEATURE_NAMES))).astype(np.float64)
+    features[rng.random(features.shape) < 0.05] = np.nan
+    tenant_index = rng.integers(-1, 3, size=len(features))
+    compiled = CompiledRules(rules, tenants)
+    assert evaluated(compiled, tenant_index, features) == reference(rules, tenants, tenant_index, features)
+
+def test_engine_drops_deleted_rules_on_full_reload():
+    engine = AlertRuleEngine()
+    row = ("rule-1", "tenant-1", "Turbid", "turbidity", ">", 10.0, "high", True, NOW)
+    engine.apply([row, ("rule-2", "tenant-1", "Hot", "temperature", "gt", 30.0, "low", True, NOW)])
+    assert len(engine.compiled) == 2
+    engine.apply([row], replace=True)
+    assert engine.compiled.rule_ids.tolist() == ["rule-1"]
+
+@pytest.fixture
+def store():
+    store = AlertRuleStore("sqlite://")
+    store.write_conn.execute("CREATE TABLE sensor.sensors (id TEXT PRIMARY KEY)")
+    store.write_conn.execute("CREATE TABLE alert.alert_rules (id TEXT PRIMARY KEY)")
+    store.write_conn.execute(
+        "CREATE TABLE alert.alerts (id TEXT PRIMARY KEY, rule_id TEXT REFERENCES alert_rules(id), "
+        "sensor_id TEXT REFERENCES sensors(id), severity TEXT NOT NULL, message TEXT NOT NULL, metadata TEXT)"
+    )
+    yield store
+    store.close()
+
+def test_insert_alerts_skips_unknown_sensors_and_deleted_rules(store):
+    sensor, rule, deleted_rule = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+    store.write_conn.execute("INSERT INTO sensor.sensors VALUES (?)", (sensor,))
+    store.write_conn.execute("INSERT INTO alert.alert_rules VALUES (?)", (rule,))
+    store.write_conn.commit()
+    compiled = CompiledRules(
+        {
+            rule: ("tenant-1", "Turbid", "turbidity", "greater_than", 10.0, "high", True),
+            deleted_rule: ("tenant-1", "Very turbid", "turbidity", "greater_than", 20.0, "critical", True),
+        },
+        {"tenant-1": 0},
+    )
+    features = np.array([[7.0, 20.0, 25.0, 8.0, 500.0]] * 3)
+    fired = compiled.evaluate(np.zeros(3, dtype=np.int64), features)
+    records = alert_records(
+        compiled, fired, "tenant-1", [sensor, str(uuid.uuid4()), "not-a-uuid"], ["2024-01-01T00:00:00"] * 3, features
+    )
+    assert len(records) == 6
+
+    assert store.insert_alerts(records) == 1
+    assert store.write_conn.execute("SELECT rule_id, sensor_id FROM alert.alerts").fetchall() == [(rule, sensor)]
+
+def test_insert_alerts_rolls_back_a_failed_batch(store):
+    sensor, rule = str(uuid.uuid4()), str(uuid.uuid4())
+    store.write_conn.execute("INSERT INTO sensor.sensors VALUES (?)", (sensor,))
+    store.write_conn.execute("INSERT INTO alert.alert_rules VALUES (?)", (rule,))
+    store.write_conn.commit()
+    record = {"id": str(uuid.uuid4()), "rule_id": rule, "sensor_id": sensor, "severity": "high", "message": "m", "metadata": {}}
+    with pytest.raises(Exception):
+        store.insert_alerts([record, {**record, "id": str(uuid.uuid4()), "message": None}])
+    assert not store.write_conn.in_transaction
+    assert store.insert_alerts([record]) == 1
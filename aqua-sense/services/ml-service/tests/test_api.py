@@ -0,0 +1,132 @@
+import asyncio
+import json
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import app.main as main
+from app.cache import PredictionCache
+from app.columnar import BINARY_CONTENT_TYPE, encode_features
+from app.main import (
+    AnomalyDetectionResponse, DegradedAnomalyDetectionResponse, DegradedPredictionResponse, PredictionResponse
+)
+from app.models import FEATURE_NAMES, QualityPredictions
+
+READINGS = [
+    {
+        "sensor_id": "sensor-1",
+        "ph": 7.2,
+        "temperature": 18.0,
+        "turbidity": 1.5,
+        "dissolved_oxygen": 8.1,
+        "conductivity": 450.0,
+        "timestamp": "2024-01-01T12:00:00",
+    },
+    {
+        "sensor_id": "sensor-2",
+        "ph": 4.0,
+        "temperature": 18.0,
+        "turbidity": 80.0,
+        "dissolved_oxygen": 8.1,
+        "conductivity": 450.0,
+        "timestamp": "2024-01-01T12:00:00",
+    },
+]
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+def assert_shape(body: dict, model):
+    """The hand-encoded body has exactly the model's fields, and validating it changes nothing"""
+    assert set(body) == set(model.model_fields)
+    assert model.model_validate(body).model_dump(mode="json") == body
+
+def test_predict_matches_response_model(client):
+    response = client.post("/predict/water-quality", json={"readings": READINGS})
+    assert response.status_code == 200
+    assert_shape(response.json(), PredictionResponse)
+
+def test_detect_matches_response_model(client):
+    response = client.post("/detect/anomalies", json={"readings": READINGS})
+    assert response.status_code == 200
+    assert_shape(response.json(), AnomalyDetectionResponse)
+
+def test_empty_batch_scores_as_float(client):
+    body = client.post("/detect/anomalies", json={"readings": []}).json()
+    assert body == {"anomalies": [], "anomaly_score": 0.0}
+    assert isinstance(body["anomaly_score"], float)
+
+def test_degraded_responses_match_their_models(client, monkeypatch):
+    monkeypatch.setattr(main, "DEGRADED_MODE", "on")
+    body = client.post("/predict/water-quality", json={"readings": READINGS}).json()
+    assert_shape(body, DegradedPredictionResponse)
+    assert body["degraded"] is True and body["predictions"] == [] and body["anomalies"]
+    assert body["confidence"] == 0.0
+
+    body = client.post("/detect/anomalies", json={"readings": READINGS}).json()
+    assert_shape(body, DegradedAnomalyDetectionResponse)
+    assert body["degraded"] is True
+
+def test_stream_results_follow_input_order(client):
+    lines = [
+        json.dumps(READINGS[0]),
+        "not json",
+        json.dumps({**READINGS[1], "ph": "acidic"}),
+        "",
+        json.dumps(READINGS[1]),
+    ]
+    response = client.post("/predict/stream", content="\n".join(lines) + "\n")
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [result["line"] for result in results] == [1, 2, 3, 5]
+    assert ["error" in result for result in results] == [False, True, True, False]
+
+class CustomBandsExecutor:
+    """Scores like a custom water quality model whose bands are not the built-in ones"""
+
+    def __init__(self):
+        self.scored = 0
+
+    async def score(self, name, features):
+        self.scored += len(features)
+        rows = len(features)
+        return "1.0.0", QualityPredictions(np.full(rows, 90.5), np.full(rows, "clean"), np.full(rows, "none"))
+
+def test_prediction_cache_keeps_bands_and_skips_custom_results(monkeypatch):
+    monkeypatch.setattr(main, "prediction_cache", PredictionCache())
+    features = np.array([[7.2, 18.0, 1.5, 8.1, 450.0], [4.0, 30.0, 80.0, 2.0, 2000.0]])
+    _, scored = asyncio.run(main.score_cached(main.WATER_QUALITY, features))
+    _, cached = asyncio.run(main.score_cached(main.WATER_QUALITY, features))
+    assert main.prediction_cache.stats()["l1_hits"] == 2
+    assert cached.to_dicts() == scored.to_dicts()
+
+    executor = CustomBandsExecutor()
+    monkeypatch.setattr(main, "executor", executor)
+    monkeypatch.setattr(main, "prediction_cache", PredictionCache())
+    for _ in range(2):
+        _, predictions = asyncio.run(main.score_cached(main.WATER_QUALITY, features))
+        assert predictions.to_dicts()[0] == {"quality_score": 90.5, "quality_level": "clean", "risk_level": "none"}
+    assert executor.scored == 4
+
+def test_columnar_bodies_are_dispatched_on_content_type(client):
+    columns = {name: [reading[name] for reading in READINGS] for name in FEATURE_NAMES}
+    response = client.post("/detect/anomalies/columnar", json=columns)
+    assert response.status_code == 200
+    assert response.json()["reading_index"] == [1]
+
+    binary = encode_features(np.array([[reading[name] for name in FEATURE_NAMES] for reading in READINGS]))
+    response = client.post(
+        "/detect/anomalies/columnar", content=binary, headers={"content-type": BINARY_CONTENT_TYPE}
+    )
+    assert response.json()["reading_index"] == [1]
+
+    response = client.post("/detect/anomalies/columnar", content=binary, headers={"content-type": "text/plain"})
+    assert response.status_code == 415
+
+@pytest.mark.parametrize("body", [b"\xff\xfe not utf-8", b"{not json", b'{"ph": "acidic"}'])
+def test_undecodable_columnar_json_is_rejected(client, body):
+    response = client.post("/predict/water-quality/columnar", content=body, headers={"content-type": "application/json"})
+    assert response.status_code == 400
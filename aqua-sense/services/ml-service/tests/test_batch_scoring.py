@@ -0,0 +1,67 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+from app.batch_scoring import ReadingStore, run, score_rows
+from app.models import MODEL_FACTORIES, MODEL_METHODS
+from app.registry import ModelRegistry
+
+START, END = datetime(2024, 1, 1), datetime(2024, 1, 2)
+
+@pytest.fixture
+def registry(tmp_path):
+    return ModelRegistry(str(tmp_path), MODEL_FACTORIES, MODEL_METHODS)
+
+@pytest.fixture
+def store():
+    store = ReadingStore("sqlite://")
+    store.write_conn.execute(
+        "CREATE TABLE sensor.sensor_readings (sensor_id TEXT, timestamp TIMESTAMP, ph REAL, temperature REAL, "
+        "turbidity REAL, dissolved_oxygen REAL, conductivity REAL, PRIMARY KEY (sensor_id, timestamp))"
+    )
+    sensors = sorted(str(uuid.uuid4()) for _ in range(3))
+    store.write_conn.executemany(
+        "INSERT INTO sensor.sensor_readings VALUES (?, ?, 7.2, 18.0, 1.5, 8.1, 450.0)",
+        [(sensor, f"2024-01-01 {hour:02d}:00:00") for sensor in sensors for hour in range(4)],
+    )
+    store.write_conn.commit()
+    store.ensure_schema()
+    yield store
+    store.close()
+
+def scored(store):
+    return store.read_conn.execute(
+        "SELECT sensor_id, timestamp FROM analytics.reading_scores ORDER BY sensor_id, timestamp"
+    ).fetchall()
+
+def test_run_scores_every_reading(store, registry):
+    assert run(store, registry, START, END, chunk_size=5) == 12
+    assert len(scored(store)) == 12
+    assert store.resume_point(START, END) == scored(store)[-1]
+    # Re-runs upsert rather than duplicate
+    assert run(store, registry, START, END, chunk_size=5) == 12
+    assert len(scored(store)) == 12
+
+def test_resume_point_is_none_without_scores(store):
+    assert store.resume_point(START, END) is None
+
+def test_resume_continues_after_last_written_chunk(store, registry):
+    chunks = store.iter_chunks(START, END, 5)
+    store.write_scores(score_rows(registry, next(chunks)))
+    chunks.close()
+    assert store.resume_point(START, END) == scored(store)[4]
+
+    assert run(store, registry, START, END, chunk_size=5, resume=True) == 7
+    assert len(scored(store)) == 12
+
+def test_write_scores_rolls_back_a_failed_chunk(store, registry):
+    rows = score_rows(registry, next(store.iter_chunks(START, END, 5)))
+    broken = rows[:3] + [rows[3][:3] + (None,) + rows[3][4:]] + rows[4:]
+    with pytest.raises(Exception):
+        store.write_scores(broken)
+    assert not store.write_conn.in_transaction
+    assert scored(store) == []
+
+    store.write_scores(rows)
+    assert len(scored(store)) == 5
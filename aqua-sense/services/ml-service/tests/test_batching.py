@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from app.batching import MicroBatcher
+
+def rows(start: int, count: int) -> np.ndarray:
+    return np.arange(start, start + count, dtype=np.float64).reshape(-1, 1)
+
+class Model:
+    """Records the batches it is called with; the result is the rows doubled"""
+
+    def __init__(self, fail: bool = False):
+        self.calls = []
+        self.fail = fail
+
+    async def __call__(self, features):
+        self.calls.append(len(features))
+        if self.fail:
+            raise RuntimeError("model failed")
+        return "v1", features[:, 0] * 2
+
+def test_concurrent_requests_share_a_call_and_get_their_own_rows():
+    async def run():
+        model = Model()
+        batcher = MicroBatcher(model, max_batch_size=100, max_wait=0.05)
+        results = await asyncio.gather(*(batcher.submit(rows(10 * i, i + 1)) for i in range(5)))
+        batcher.stop()
+        return model, batcher, results
+
+    model, batcher, results = asyncio.run(run())
+    assert model.calls == [15]
+    for i, (version, result) in enumerate(results):
+        assert version == "v1"
+        assert result.tolist() == (rows(10 * i, i + 1)[:, 0] * 2).tolist()
+    assert (batcher.batches, batcher.requests) == (1, 5)
+
+def test_batches_never_exceed_the_maximum_size():
+    async def run():
+        model = Model()
+        batcher = MicroBatcher(model, max_batch_size=10, max_wait=0.05)
+        results = await asyncio.gather(*(batcher.submit(rows(0, 4)) for _ in range(6)))
+        batcher.stop()
+        return model, results
+
+    model, results = asyncio.run(run())
+    # Requests are never split: the one that does not fit opens the next batch
+    assert model.calls == [8, 8, 8]
+    assert all(len(result) == 4 for _, result in results)
+
+def test_a_lone_request_waits_at_most_max_wait():
+    async def run():
+        model = Model()
+        batcher = MicroBatcher(model, max_batch_size=1000, max_wait=0.02)
+        started = time.perf_counter()
+        await batcher.submit(rows(0, 1))
+        elapsed = time.perf_counter() - started
+        batcher.stop()
+        return batcher, elapsed
+
+    batcher, elapsed = asyncio.run(run())
+    assert 0.02 <= elapsed < 0.5
+    assert 0.02 <= batcher.wait_times[0] < 0.5
+    assert batcher.stats()["batch_size"]["mean"] == 1.0
+
+def test_a_full_batch_is_dispatched_without_waiting():
+    async def run():
+        batcher = MicroBatcher(Model(), max_batch_size=4, max_wait=5.0)
+        return await asyncio.wait_for(batcher.submit(rows(0, 4)), timeout=1.0)
+
+    assert asyncio.run(run())[1].tolist() == [0.0, 2.0, 4.0, 6.0]
+
+def test_model_errors_reach_every_caller_of_the_batch():
+    async def run():
+        batcher = MicroBatcher(Model(fail=True), max_batch_size=100, max_wait=0.01)
+        return await asyncio.gather(*(batcher.submit(rows(0, 2)) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+def test_cancelled_requests_are_not_scored():
+    async def run():
+        model = Model()
+        batcher = MicroBatcher(model, max_batch_size=100, max_wait=0.05)
+        abandoned = asyncio.create_task(batcher.submit(rows(0, 3)))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        _, result = await batcher.submit(rows(0, 2))
+        with pytest.raises(asyncio.CancelledError):
+            await abandoned
+        return model, result
+
+    model, result = asyncio.run(run())
+    assert model.calls == [2] and len(result) == 2
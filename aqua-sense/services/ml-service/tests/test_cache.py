@@ -0,0 +1,99 @@
+import asyncio
+
+import numpy as np
+
+from app.cache import InMemoryRedis, PredictionCache, cache_keys
+from app.models import QualityPredictions, WaterQualityModel
+
+FEATURES = np.array([
+    [7.2, 18.0, 1.5, 8.1, 450.0],
+    [6.4, 22.5, 9.0, 5.2, 900.0],
+    [7.2, 18.0, 1.5, 8.1, 450.0],
+])
+
+class FailingRedis:
+    async def mget(self, keys):
+        raise ConnectionError("redis is down")
+
+    def pipeline(self, transaction=False):
+        raise ConnectionError("redis is down")
+
+def test_keys_depend_on_features_model_and_version():
+    keys = cache_keys("water_quality", "v1", FEATURES)
+    assert keys[0] == keys[2]
+    assert keys[0] != keys[1]
+    assert keys == cache_keys("water_quality", "v1", FEATURES.copy())
+    assert set(keys).isdisjoint(cache_keys("water_quality", "v2", FEATURES))
+    assert set(keys).isdisjoint(cache_keys("anomaly_detector", "v1", FEATURES))
+
+def test_missing_values_hash_consistently():
+    features = np.array([[7.0, np.nan, 1.0, 8.0, 400.0]])
+    assert cache_keys("water_quality", "v1", features) == cache_keys("water_quality", "v1", features.copy())
+
+def test_miss_then_l1_hit():
+    cache = PredictionCache()
+    keys = cache_keys("water_quality", "v1", FEATURES[:2])
+
+    values, hit = asyncio.run(cache.lookup(keys))
+    assert not hit.any()
+    asyncio.run(cache.store(keys, np.array([91, 42])))
+    values, hit = asyncio.run(cache.lookup(keys))
+    assert hit.all()
+    assert values.tolist() == [91, 42]
+    assert cache.stats()["l1_hits"] == 2
+    assert cache.stats()["misses"] == 2
+
+def test_l2_hit_after_l1_is_dropped():
+    redis = InMemoryRedis()
+    writer, reader = PredictionCache(redis), PredictionCache(redis)
+    keys = cache_keys("water_quality", "v1", FEATURES[:2])
+    asyncio.run(writer.store(keys, np.array([91, 42])))
+
+    values, hit = asyncio.run(reader.lookup(keys))
+    assert hit.all() and values.tolist() == [91, 42]
+    assert reader.stats()["l2_hits"] == 2
+    # Served from L1 the second time
+    asyncio.run(reader.lookup(keys))
+    assert reader.stats()["l1_hits"] == 2
+
+    reader.invalidate()
+    assert reader.stats()["l1_entries"] == 0
+    values, hit = asyncio.run(reader.lookup(keys))
+    assert hit.all()
+    assert reader.stats()["l2_hits"] == 4
+
+def test_new_model_version_misses():
+    redis = InMemoryRedis()
+    cache = PredictionCache(redis)
+    asyncio.run(cache.store(cache_keys("water_quality", "v1", FEATURES), np.array([91, 42, 91])))
+    _, hit = asyncio.run(cache.lookup(cache_keys("water_quality", "v2", FEATURES)))
+    assert not hit.any()
+
+def test_l1_is_bounded():
+    cache = PredictionCache(l1_size=2)
+    keys = cache_keys("water_quality", "v1", FEATURES[:2]) + cache_keys("water_quality", "v2", FEATURES[:1])
+    asyncio.run(cache.store(keys, np.array([1, 2, 3])))
+    _, hit = asyncio.run(cache.lookup(keys))
+    assert hit.tolist() == [False, True, True]
+
+def test_l2_failures_are_misses():
+    cache = PredictionCache(FailingRedis())
+    keys = cache_keys("water_quality", "v1", FEATURES[:2])
+    asyncio.run(cache.store(keys, np.array([91, 42])))
+    cache.invalidate()
+    values, hit = asyncio.run(cache.lookup(keys))
+    assert not hit.any()
+
+def test_quality_predictions_pack_losslessly():
+    predictions = WaterQualityModel().predict(np.array([
+        [7.2, 18.0, 1.5, 8.1, 450.0],
+        [4.0, 30.0, 80.0, 2.0, 2000.0],
+        [6.4, 22.5, 9.0, 5.2, 900.0],
+    ]))
+    assert QualityPredictions.unpack(predictions.pack()).to_dicts() == predictions.to_dicts()
+
+def test_custom_quality_results_are_not_packed():
+    custom_bands = QualityPredictions(np.array([90, 10]), np.array(["good", "bad"]), np.array(["low", "high"]))
+    fractional = QualityPredictions(np.array([90.5]), np.array(["excellent"]), np.array(["low"]))
+    assert custom_bands.pack() is None
+    assert fractional.pack() is None
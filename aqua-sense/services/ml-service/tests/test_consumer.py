@@ -0,0 +1,131 @@
+import json
+import uuid
+from datetime import date
+
+import pytest
+
+from app.consumer import Broker, BrokerError, InMemoryBroker, ReadingConsumer
+from app.models import MODEL_FACTORIES, MODEL_METHODS
+from app.registry import ModelRegistry
+from app.rollups import RollupStore
+
+TOPIC = "sensor-readings"
+
+def reading(sensor_id=None, **overrides) -> bytes:
+    record = {
+        "sensor_id": sensor_id or str(uuid.uuid4()),
+        "timestamp": "2024-01-01T12:00:00",
+        "ph": 7.2,
+        "temperature": 18.0,
+        "turbidity": 1.5,
+        "dissolved_oxygen": 8.1,
+        "conductivity": 450.0,
+    }
+    record.update(overrides)
+    return json.dumps(record).encode()
+
+@pytest.fixture
+def broker():
+    return InMemoryBroker([TOPIC])
+
+@pytest.fixture
+def consumer(broker, tmp_path):
+    registry = ModelRegistry(str(tmp_path), MODEL_FACTORIES, MODEL_METHODS)
+    return ReadingConsumer(broker, registry, dead_letter_topic="dead-letters", batch_size=100, poll_timeout=0)
+
+def test_broker_is_abstract():
+    with pytest.raises(TypeError):
+        Broker()
+
+def test_decode_rejects_malformed_readings(broker, consumer):
+    messages = [
+        broker.append(TOPIC, None, reading()),
+        broker.append(TOPIC, None, b"not json"),
+        broker.append(TOPIC, None, reading(ph="acidic")),
+        broker.append(TOPIC, None, reading(timestamp="yesterday")),
+        broker.append(TOPIC, None, json.dumps({"ph": 7.0}).encode()),
+        broker.append(TOPIC, None, reading(sensor_id="sensor-1")),
+    ]
+    readings, features, invalid = consumer.decode(messages)
+    assert len(readings) == 2
+    assert features.shape == (2, 5)
+    assert invalid == messages[1:-1]
+
+def test_decode_requires_uuid_sensor_ids_for_rollups(broker, tmp_path):
+    registry = ModelRegistry(str(tmp_path), MODEL_FACTORIES, MODEL_METHODS)
+    consumer = ReadingConsumer(broker, registry, batch_size=100, poll_timeout=0, rollup_store=RollupStore("sqlite://"))
+    messages = [broker.append(TOPIC, None, reading()), broker.append(TOPIC, None, reading(sensor_id="sensor-1"))]
+    readings, _, invalid = consumer.decode(messages)
+    assert len(readings) == 1
+    assert invalid == messages[1:]
+    consumer.rollup_store.close()
+
+def test_process_publishes_results_and_commits(broker, consumer):
+    sensor_id = str(uuid.uuid4())
+    broker.append(TOPIC, sensor_id.encode(), reading(sensor_id))
+    broker.append(TOPIC, sensor_id.encode(), reading(sensor_id, turbidity=80.0, timestamp="2024-01-01T12:01:00"))
+    broker.append(TOPIC, None, b"{}")
+
+    assert consumer.run_once() == 3
+    predictions = [json.loads(m.value) for m in broker.messages("reading-predictions")]
+    assert [p["timestamp"] for p in predictions] == ["2024-01-01T12:00:00", "2024-01-01T12:01:00"]
+    assert all(p["sensor_id"] == sensor_id for p in predictions)
+    assert [json.loads(m.value)["timestamp"] for m in broker.messages("reading-anomalies")] == ["2024-01-01T12:01:00"]
+    assert [m.value for m in broker.messages("dead-letters")] == [b"{}"]
+    assert broker.committed == {(TOPIC, 0): 3}
+    assert consumer.stats() == {"consumed": 2, "invalid": 1, "anomalies": 1, "redeliveries": 0}
+    assert consumer.run_once() == 0
+
+def test_failed_flush_rewinds_and_redelivers(broker, consumer):
+    for _ in range(3):
+        broker.append(TOPIC, None, reading())
+    broker.fail_next_flush = True
+
+    assert consumer.run_once() == 0
+    assert consumer.redeliveries == 1
+    assert broker.committed == {}
+    assert broker.messages("reading-predictions") == []
+
+    assert consumer.run_once() == 3
+    assert len(broker.messages("reading-predictions")) == 3
+    assert broker.committed == {(TOPIC, 0): 3}
+
+def test_rewind_returns_to_last_commit(broker):
+    for _ in range(4):
+        broker.append(TOPIC, None, reading())
+    assert len(broker.poll(2, 0)) == 2
+    broker.commit({(TOPIC, 0): 2})
+    assert [m.offset for m in broker.poll(10, 0)] == [2, 3]
+    broker.rewind()
+    assert [m.offset for m in broker.poll(10, 0)] == [2, 3]
+
+class CommitFailsOnce(InMemoryBroker):
+    def __init__(self, topics):
+        super().__init__(topics)
+        self.fail_next_commit = True
+
+    def commit(self, offsets):
+        if self.fail_next_commit:
+            self.fail_next_commit = False
+            raise BrokerError("Offset commit failed")
+        super().commit(offsets)
+
+def test_redelivered_readings_are_rolled_up_once(tmp_path):
+    broker = CommitFailsOnce([TOPIC])
+    store = RollupStore("sqlite://")
+    store.ensure_schema()
+    registry = ModelRegistry(str(tmp_path), MODEL_FACTORIES, MODEL_METHODS)
+    consumer = ReadingConsumer(broker, registry, batch_size=100, poll_timeout=0, rollup_store=store)
+    sensor_id = str(uuid.uuid4())
+    broker.append(TOPIC, None, reading(sensor_id))
+    broker.append(TOPIC, None, reading(sensor_id, timestamp="2024-01-01T13:00:00"))
+
+    # The rollups are merged, then the commit fails and the batch is consumed again
+    assert consumer.run_once() == 0
+    assert consumer.run_once() == 2
+    assert broker.committed == {(TOPIC, 0): 2}
+
+    (row,) = store.query(date(2024, 1, 1), date(2024, 1, 2))
+    assert row[0] == sensor_id
+    assert row[2] == 2  # ph_count
+    store.close()
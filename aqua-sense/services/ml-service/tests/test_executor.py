@@ -0,0 +1,69 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from app.executor import ScoringExecutor
+from app.models import ANOMALY_DETECTOR, MODEL_FACTORIES, MODEL_METHODS, WATER_QUALITY
+from app.registry import ModelRegistry
+
+def readings(n: int) -> np.ndarray:
+    rng = np.random.default_rng(n)
+    return np.column_stack([
+        rng.uniform(3, 11, n), rng.uniform(-5, 45, n), rng.uniform(0, 60, n), rng.uniform(0, 10, n), rng.uniform(0, 2500, n)
+    ])
+
+@pytest.fixture
+def registry(tmp_path):
+    return ModelRegistry(str(tmp_path), MODEL_FACTORIES, MODEL_METHODS)
+
+def scored_on(executor: ScoringExecutor, features: np.ndarray, offload: bool = False):
+    """Thread name the model ran on, and the result"""
+    threads = []
+    score_inline = executor.score_inline
+
+    def recording(name, features):
+        threads.append(threading.current_thread().name)
+        return score_inline(name, features)
+
+    executor.score_inline = recording
+    try:
+        result = asyncio.run(executor.score(WATER_QUALITY, features, offload=offload))
+    finally:
+        executor.score_inline = score_inline
+    return threads[0], result
+
+def test_thread_mode_moves_only_large_batches_off_the_loop(registry):
+    executor = ScoringExecutor(registry, mode="thread", workers=2, inline_max_rows=100)
+    try:
+        small, (version, inline) = scored_on(executor, readings(100))
+        large, (_, offloaded) = scored_on(executor, readings(101))
+        forced, _ = scored_on(executor, readings(1), offload=True)
+    finally:
+        executor.shutdown()
+    assert small == threading.current_thread().name
+    assert large.startswith("scoring") and forced.startswith("scoring")
+    assert version == registry.get(WATER_QUALITY).version
+    expected = registry.get(WATER_QUALITY).model.predict(readings(101))
+    assert offloaded.to_dicts() == expected.to_dicts()
+    assert len(inline) == 100
+
+def test_inline_mode_never_leaves_the_loop(registry):
+    executor = ScoringExecutor(registry, mode="inline", inline_max_rows=1)
+    thread, _ = scored_on(executor, readings(50), offload=True)
+    assert thread == threading.current_thread().name
+    assert executor._pool is None
+
+def test_process_mode_scores_through_shared_memory(registry):
+    executor = ScoringExecutor(registry, mode="process", workers=1, inline_max_rows=0)
+    try:
+        version, flags = asyncio.run(executor.score(ANOMALY_DETECTOR, readings(500)))
+    finally:
+        executor.shutdown()
+    assert version == registry.get(ANOMALY_DETECTOR).version
+    assert flags.mask.tolist() == registry.get(ANOMALY_DETECTOR).model.detect(readings(500)).mask.tolist()
+
+def test_unknown_mode_is_rejected(registry):
+    with pytest.raises(ValueError):
+        ScoringExecutor(registry, mode="gpu")
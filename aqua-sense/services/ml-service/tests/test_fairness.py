@@ -0,0 +1,81 @@
+import asyncio
+import math
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import app.main as main
+from app.admission import DeadlineExceeded
+from app.fairness import FairScheduler, TokenBucket
+
+PLANS = {"gold-tenant": "gold", "basic-tenant": "basic"}
+
+def scheduler(**kwargs) -> FairScheduler:
+    return FairScheduler(PLANS.get, {"gold": 3.0, "basic": 1.0}, {"basic": 10.0}, **kwargs)
+
+def test_token_bucket_rejects_until_refilled_and_oversized_costs_forever():
+    bucket = TokenBucket(rate=10.0, burst=20.0)
+    assert bucket.take(15) == 0.0
+    assert bucket.take(10) == pytest.approx(0.5, abs=0.01)
+    assert bucket.tokens == pytest.approx(5.0, abs=0.1)
+    assert bucket.take(21) == math.inf
+    assert TokenBucket(rate=0.0, burst=0.0).take(1_000) == 0.0
+
+def test_admit_answers_429_then_413(monkeypatch):
+    monkeypatch.setattr(main, "fair_queue", scheduler(burst_seconds=1.0))
+    main.admit("basic-tenant", 8)
+    with pytest.raises(HTTPException) as rejected:
+        main.admit("basic-tenant", 8)
+    assert rejected.value.status_code == 429
+    assert int(rejected.value.headers["Retry-After"]) >= 1
+    with pytest.raises(HTTPException) as oversized:
+        main.admit("basic-tenant", 11)
+    assert oversized.value.status_code == 413
+    # Gold has no rate, and unknown tenants are never limited
+    main.admit("gold-tenant", 1_000)
+    main.admit("someone-else", 1_000)
+    assert main.fair_queue.tenant("basic-tenant").rejected == 2
+
+def test_contended_turns_follow_plan_weights():
+    async def run():
+        queue = scheduler(max_rows=1)
+        order = []
+
+        async def request(tenant_id):
+            async with queue.turn(tenant_id, 1):
+                order.append(tenant_id)
+
+        # Hold the only slot so every request queues, the basic ones first
+        async with queue.turn("someone-else", 1):
+            tasks = [asyncio.create_task(request(tenant)) for tenant in ["basic-tenant"] * 4 + ["gold-tenant"] * 4]
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order
+
+    # Gold is charged a third of the virtual time per reading
+    assert [PLANS[tenant][0] for tenant in asyncio.run(run())] == list("ggbggbbb")
+
+def test_queued_request_expires_at_its_deadline_without_charging_its_tenant():
+    async def run():
+        queue = scheduler(max_rows=1)
+        basic = queue.tenant("basic-tenant")
+        async with queue.turn("someone-else", 1):
+            with pytest.raises(DeadlineExceeded):
+                async with queue.turn("basic-tenant", 5, deadline=time.monotonic() + 0.05):
+                    pytest.fail("an expired request must not be scored")
+            assert (basic.expired, basic.queued, basic.finish) == (1, 0, 0.0)
+
+            # A cancelled wait is taken back too
+            waiting = asyncio.create_task(queue.turn("basic-tenant", 5).__aenter__())
+            await asyncio.sleep(0)
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+            assert basic.finish == 0.0
+        assert queue.in_flight == 0
+
+        async with queue.turn("basic-tenant", 2):
+            assert basic.finish == 2.0
+
+    asyncio.run(run())
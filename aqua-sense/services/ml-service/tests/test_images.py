@@ -0,0 +1,93 @@
+import asyncio
+import hashlib
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.cache import PredictionCache
+from app.images import ImagePipeline, decode_image
+from app.models import ImageAnalyzer
+
+def photo(color, size=(64, 48), fmt="PNG") -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+BLUE, GREEN = photo((40, 90, 200)), photo((30, 160, 40))
+
+class CountingAnalyzer:
+    """The built-in analyzer, counting the images it is asked to score"""
+
+    def __init__(self):
+        self.model = ImageAnalyzer()
+        self.scored = 0
+
+    async def __call__(self, images: np.ndarray):
+        self.scored += len(images)
+        # Give concurrent requests the chance to find the photos in flight
+        await asyncio.sleep(0.01)
+        return self.model.version, self.model.analyze(images)
+
+def pipeline(analyzer, cache=None) -> ImagePipeline:
+    return ImagePipeline(analyzer, lambda: analyzer.model.version, cache=cache, workers=2, input_size=32, max_wait=0)
+
+def test_duplicate_photos_in_a_request_are_analysed_once():
+    analyzer = CountingAnalyzer()
+    images = pipeline(analyzer)
+    try:
+        results = asyncio.run(images.analyze([BLUE, GREEN, BLUE]))
+    finally:
+        images.shutdown()
+    assert analyzer.scored == 2
+    assert [r["sha256"] for r in results] == [hashlib.sha256(data).hexdigest() for data in (BLUE, GREEN, BLUE)]
+    assert results[0] == results[2] and results[0]["cached"] is False
+
+def test_cached_photos_skip_decoding_and_the_model():
+    analyzer = CountingAnalyzer()
+    images = pipeline(analyzer, PredictionCache())
+    try:
+        first = asyncio.run(images.analyze([BLUE]))
+        second = asyncio.run(images.analyze([BLUE, GREEN]))
+    finally:
+        images.shutdown()
+    assert analyzer.scored == 2
+    assert second[0] == {**first[0], "cached": True}
+    assert second[1]["cached"] is False
+
+def test_concurrent_requests_share_photos_in_flight():
+    analyzer = CountingAnalyzer()
+    images = pipeline(analyzer)
+
+    async def run():
+        return await asyncio.gather(images.analyze([BLUE]), images.analyze([BLUE, GREEN]))
+
+    try:
+        first, second = asyncio.run(run())
+    finally:
+        images.shutdown()
+    assert analyzer.scored == 2
+    assert first[0] == second[0]
+    assert images._in_flight == {}
+
+def test_undecodable_uploads_get_an_error_and_are_not_cached():
+    analyzer = CountingAnalyzer()
+    cache = PredictionCache()
+    images = pipeline(analyzer, cache)
+    try:
+        results = asyncio.run(images.analyze([b"not an image", GREEN]))
+        again = asyncio.run(images.analyze([b"not an image"]))
+    finally:
+        images.shutdown()
+    assert results[0]["error"] == "unrecognized image format" and again[0] == results[0]
+    assert results[1]["label"] and analyzer.scored == 1
+    assert cache.stats()["l1_entries"] == 1
+
+def test_decode_crops_to_a_normalized_square():
+    pixels = decode_image(photo((255, 255, 255), size=(1600, 1200), fmt="JPEG"), 32, 40_000_000)
+    assert pixels.shape == (3, 32, 32) and pixels.dtype == np.float32
+    # White, normalized per channel
+    assert np.allclose(pixels[:, 16, 16], (1 - np.array([0.485, 0.456, 0.406])) / np.array([0.229, 0.224, 0.225]), atol=0.05)
+    with pytest.raises(ValueError, match="pixel limit"):
+        decode_image(photo((0, 0, 0), size=(100, 100)), 32, 9_999)
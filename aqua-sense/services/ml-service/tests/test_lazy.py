@@ -0,0 +1,63 @@
+import builtins
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from app.lazy import ImportTimer, LazyModule, import_timer, is_loaded, lazy_import, load_module, warm_up
+
+@pytest.fixture
+def module_name(tmp_path, monkeypatch):
+    """A module that nothing has imported yet"""
+    name = f"aqs_lazy_{tmp_path.name}".replace("-", "_")
+    (tmp_path / f"{name}.py").write_text("LOADS = []\nLOADS.append(1)\nVALUE = 42\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield name
+    sys.modules.pop(name, None)
+
+def test_import_happens_on_first_attribute_access(module_name):
+    proxy = lazy_import(module_name)
+    assert isinstance(proxy, LazyModule)
+    assert lazy_import(module_name) is proxy
+    assert not is_loaded(proxy) and module_name not in sys.modules
+    assert "not loaded" in repr(proxy)
+
+    assert proxy.VALUE == 42
+    assert is_loaded(proxy) and load_module(proxy) is sys.modules[module_name]
+    assert proxy.LOADS == [1]
+    assert import_timer.records[module_name]["lazy"] is True
+
+def test_missing_attributes_and_modules_fail_on_use(module_name):
+    with pytest.raises(AttributeError):
+        lazy_import(module_name).MISSING
+    missing = LazyModule("aqs_no_such_module")
+    with pytest.raises(ModuleNotFoundError):
+        missing.anything
+    assert not is_loaded(missing)
+
+def test_warm_up_loads_now(module_name):
+    assert set(warm_up([module_name])) == {module_name}
+    assert is_loaded(lazy_import(module_name))
+
+def test_import_timer_records_only_while_installed(module_name):
+    original_import = builtins.__import__
+    timer = ImportTimer()
+    timer.install()
+    try:
+        __import__(module_name)
+    finally:
+        timer.uninstall()
+    assert timer.records[module_name]["lazy"] is False
+    assert timer.report()["startup_total_ms"] >= timer.records[module_name]["self_ms"]
+    assert builtins.__import__ is original_import
+
+def test_service_import_loads_no_heavy_framework():
+    code = (
+        "import sys, app.main\n"
+        "from app.lazy import HEAVY_MODULES\n"
+        "print(','.join(name for name in HEAVY_MODULES if name in sys.modules))"
+    )
+    service_root = Path(__file__).resolve().parents[1]
+    result = subprocess.run([sys.executable, "-c", code], cwd=service_root, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
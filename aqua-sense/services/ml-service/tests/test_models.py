@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from app.models import AnomalyDetector, WaterQualityModel
+
+# Rule boundaries of every feature, so both sides of each comparison are hit
+EDGES = [
+    [4, 6.5, 8.5, 10],
+    [0, 15, 25, 40],
+    [5, 50],
+    [2, 5],
+    [1000, 2000],
+]
+
+def random_readings(seed: int, n: int = 2000) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    columns = []
+    for edges in EDGES:
+        spread = rng.uniform(min(edges) - 10, max(edges) + 10, n)
+        exact = rng.choice(edges, n)
+        columns.append(np.where(rng.random(n) < 0.2, exact, spread))
+    readings = np.column_stack(columns)
+    readings[rng.random(readings.shape) < 0.02] = np.nan
+    return readings
+
+def quality_of(reading) -> dict:
+    """The water quality rules applied to one reading at a time"""
+    ph, temp, turbidity, do, conductivity = reading
+    score = 100
+    if ph < 6.5 or ph > 8.5:
+        score -= 20
+    if temp < 15 or temp > 25:
+        score -= 15
+    if turbidity > 5:
+        score -= 25
+    if do < 5:
+        score -= 30
+    if conductivity > 1000:
+        score -= 10
+    quality = "excellent" if score >= 80 else "good" if score >= 60 else "fair" if score >= 40 else "poor"
+    return {
+        "quality_score": max(0, score),
+        "quality_level": quality,
+        "risk_level": "low" if score >= 70 else "medium" if score >= 50 else "high",
+    }
+
+@pytest.mark.parametrize("seed", range(5))
+def test_water_quality_matches_per_reading_rules(seed):
+    readings = random_readings(seed)
+    assert WaterQualityModel().predict(readings).to_dicts() == [quality_of(reading) for reading in readings.tolist()]
+
+def test_water_quality_of_no_readings():
+    assert WaterQualityModel().predict(np.empty((0, 5))).to_dicts() == []
+
+def anomalies_of(readings) -> list:
+    """The anomaly rules applied to one reading at a time, flagged readings only"""
+    anomalies = []
+    for idx, (ph, temp, turbidity, do, conductivity) in enumerate(readings):
+        anomaly_flags = []
+        if ph < 4 or ph > 10:
+            anomaly_flags.append("extreme_ph")
+        if temp < 0 or temp > 40:
+            anomaly_flags.append("extreme_temperature")
+        if turbidity > 50:
+            anomaly_flags.append("high_turbidity")
+        if do < 2:
+            anomaly_flags.append("low_oxygen")
+        if conductivity > 2000:
+            anomaly_flags.append("high_conductivity")
+        if anomaly_flags:
+            anomalies.append({
+                "reading_index": idx,
+                "anomaly_types": anomaly_flags,
+                "severity": "high" if len(anomaly_flags) > 2 else "medium" if len(anomaly_flags) > 1 else "low",
+            })
+    return anomalies
+
+@pytest.mark.parametrize("seed", range(5))
+def test_anomaly_flags_match_per_reading_rules(seed):
+    readings = random_readings(seed)
+    flags = AnomalyDetector().detect(readings)
+    expected = anomalies_of(readings.tolist())
+    assert flags.to_dicts() == expected
+    assert flags.indices.tolist() == [anomaly["reading_index"] for anomaly in expected]
+    assert flags.flag_count[flags.indices].tolist() == [len(anomaly["anomaly_types"]) for anomaly in expected]
+
+def test_every_flag_combination_is_named_in_order():
+    readings = np.array([[7.0, 20.0, 1.0, 8.0, 400.0]] * 32)
+    anomalous = np.array([[2.0, 45.0, 60.0, 1.0, 2500.0]])
+    for mask in range(32):
+        for bit in range(5):
+            if mask & (1 << bit):
+                readings[mask, bit] = anomalous[0, bit]
+    assert AnomalyDetector().detect(readings).to_dicts() == anomalies_of(readings.tolist())
@@ -0,0 +1,41 @@
+import numpy as np
+
+from app.models import FEATURE_NAMES
+from app.online import OnlineAnomalyDetector
+
+BASE = np.array([7.0, 20.0, 1.0, 8.0, 500.0])
+
+def test_jump_from_constant_history_is_flagged():
+    detector = OnlineAnomalyDetector(FEATURE_NAMES, capacity=4)
+    for _ in range(20):
+        assert detector.detect(["sensor-1"], BASE).to_dicts() == []
+    (anomaly,) = detector.detect(["sensor-1"], BASE + [1.0, 0, 0, 0, 0]).to_dicts()
+    assert anomaly["zscore_features"] == ["ph"]
+    assert anomaly["rate_of_change_features"] == []
+
+def test_rate_of_change_against_previous_reading():
+    detector = OnlineAnomalyDetector(FEATURE_NAMES, capacity=4)
+    detector.detect(["sensor-1"], BASE)
+    result = detector.detect(["sensor-1", "sensor-1"], np.vstack([BASE + [0, 0, 30.0, 0, 0], BASE + [0, 0, 30.0, 0, 0]]))
+    assert result.roc_mask.tolist() == [1 << FEATURE_NAMES.index("turbidity"), 0]
+
+def test_checkpoint_round_trip(tmp_path):
+    detector = OnlineAnomalyDetector(FEATURE_NAMES, capacity=4)
+    for _ in range(12):
+        detector.detect(["sensor-1", "sensor-2"], np.vstack([BASE, BASE + 1]))
+    path = str(tmp_path / "online.npz")
+    detector.checkpoint(path)
+
+    restored = OnlineAnomalyDetector(FEATURE_NAMES, capacity=2)
+    restored.restore(path)
+    assert restored.size == 2 and restored.capacity == 4
+    np.testing.assert_array_equal(restored.last[:2], detector.last[:2])
+    jump = np.vstack([BASE + [1.0, 0, 0, 0, 0], BASE + 1])
+    assert restored.detect(["sensor-1", "sensor-2"], jump).indices.tolist() == [0]
+
+def test_missing_value_keeps_previous_reading():
+    detector = OnlineAnomalyDetector(FEATURE_NAMES, capacity=4)
+    detector.detect(["sensor-1"], BASE)
+    detector.detect(["sensor-1"], BASE + [np.nan, 0, 0, 0, 0])
+    result = detector.detect(["sensor-1"], BASE + [2.0, 0, 0, 0, 0])
+    assert result.roc_mask.tolist() == [1 << FEATURE_NAMES.index("ph")]
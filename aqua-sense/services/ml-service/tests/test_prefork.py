@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from app import prefork
+from app.prefork import available_cpus
+
+@pytest.fixture
+def cgroup(tmp_path, monkeypatch):
+    """Point the cgroup limits at files under tmp_path, on a machine with 8 CPUs"""
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(8)), raising=False)
+    v2 = tmp_path / "cpu.max"
+    v1 = tmp_path / "cpu.cfs_quota_us", tmp_path / "cpu.cfs_period_us"
+    monkeypatch.setattr(prefork, "CGROUP_CPU_LIMITS", ((str(v2), None), (str(v1[0]), str(v1[1]))))
+    return v2, v1
+
+def test_no_cgroup_limit_uses_the_affinity_mask(cgroup):
+    assert available_cpus() == 8
+
+@pytest.mark.parametrize("cpu_max, cpus", [
+    ("max 100000\n", 8),
+    ("200000 100000\n", 2),
+    ("150000 100000\n", 2),
+    ("50000 100000\n", 1),
+    ("1600000 100000\n", 8),
+])
+def test_cgroup_v2_quota(cgroup, cpu_max, cpus):
+    cgroup[0].write_text(cpu_max)
+    assert available_cpus() == cpus
+
+@pytest.mark.parametrize("quota, cpus", [("-1", 8), ("300000", 3), ("25000", 1)])
+def test_cgroup_v1_quota(cgroup, quota, cpus):
+    quota_file, period_file = cgroup[1]
+    quota_file.write_text(f"{quota}\n")
+    period_file.write_text("100000\n")
+    assert available_cpus() == cpus
+
+def test_cgroup_v2_takes_precedence_and_malformed_files_are_skipped(cgroup):
+    quota_file, period_file = cgroup[1]
+    quota_file.write_text("100000\n")
+    period_file.write_text("100000\n")
+    cgroup[0].write_text("400000 100000\n")
+    assert available_cpus() == 4
+
+    # An empty cpu.max falls through to the v1 files
+    cgroup[0].write_text("")
+    assert available_cpus() == 1
@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import app.main as main
+from app.profiling import ProfilingMiddleware, RequestProfiler
+
+TOKEN = "s3cret"
+
+def busy(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+async def waiting_then_busy():
+    await asyncio.sleep(0.05)
+    busy(0.05)
+
+def profiled_app(profiler: RequestProfiler) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/work")
+    async def work():
+        await waiting_then_busy()
+        return {"ok": True}
+
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+    return app
+
+def test_requests_sent_with_the_admin_token_are_sampled():
+    profiler = RequestProfiler(token=TOKEN, interval=0.002)
+    with TestClient(profiled_app(profiler)) as client:
+        assert client.get("/work").status_code == 200
+        assert profiler.requests == 0
+        assert client.get("/work", headers={"X-Profile-Token": "wrong"}).status_code == 200
+        assert profiler.requests == 0
+
+        assert client.get("/work", headers={"X-Profile-Token": TOKEN}).status_code == 200
+    assert profiler.requests == 1 and profiler.samples > 0
+
+    lines = profiler.collapsed().splitlines()
+    assert lines and all(line.startswith("GET /work;") for line in lines)
+    stacks = [line.rsplit(" ", 1)[0] for line in lines]
+    # Both the awaited sleep and the computation on the event loop are seen
+    assert any("waiting_then_busy" in stack and stack.endswith("(waiting)") for stack in stacks)
+    assert any(stack.split(";")[-1].startswith("busy ") for stack in stacks)
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) >= profiler.samples
+
+    profiler.collapsed(reset=True)
+    assert profiler.collapsed() == "" and profiler.requests == 0
+
+def test_admin_profile_requires_the_token(monkeypatch):
+    monkeypatch.setattr(main, "profiler", RequestProfiler(token=TOKEN))
+    with TestClient(main.app) as client:
+        assert client.get("/admin/profile").status_code == 403
+        assert client.get("/admin/profile", headers={"X-Profile-Token": "wrong"}).status_code == 403
+        response = client.get("/admin/profile", headers={"X-Profile-Token": TOKEN})
+    assert response.status_code == 200
+    assert response.headers["X-Profiled-Requests"] == "0"
+
+def test_no_token_is_authorized_without_one_configured():
+    profiler = RequestProfiler(sample_rate=0.5)
+    assert profiler.enabled
+    assert not any(profiler.authorized(token) for token in (None, "", "anything"))
@@ -0,0 +1,70 @@
+import os
+
+import joblib
+import numpy as np
+import pytest
+
+from app.models import MODEL_FACTORIES, MODEL_METHODS, WATER_QUALITY, WaterQualityModel
+from app.registry import ModelRegistry, version_key
+
+def artifact(root, version: str, model) -> str:
+    directory = root / WATER_QUALITY
+    directory.mkdir(exist_ok=True)
+    path = str(directory / f"{version}.joblib")
+    # Written aside and renamed into place, as trainers do
+    joblib.dump(model, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return path
+
+def versioned(version: str) -> WaterQualityModel:
+    model = WaterQualityModel()
+    model.version = version
+    return model
+
+@pytest.fixture
+def registry(tmp_path):
+    return ModelRegistry(str(tmp_path), MODEL_FACTORIES, MODEL_METHODS)
+
+def test_versions_sort_numerically():
+    assert sorted(["1.10.0", "1.9.0", "1.9.0-rc1", "2.0"], key=version_key) == ["1.9.0", "1.9.0-rc1", "1.10.0", "2.0"]
+
+def test_builtins_are_active_until_an_artifact_appears(registry, tmp_path):
+    assert registry.get(WATER_QUALITY).info()["source"] == "builtin"
+    assert registry.refresh() == []
+
+    swaps = []
+    registry.listeners.append(swaps.append)
+    held = registry.get(WATER_QUALITY)
+    artifact(tmp_path, "1.9.0", versioned("1.9.0"))
+    path = artifact(tmp_path, "1.10.0", versioned("1.10.0"))
+    assert registry.refresh() == [WATER_QUALITY]
+
+    entry = registry.get(WATER_QUALITY)
+    assert (entry.version, entry.path) == ("1.10.0", path)
+    assert [swapped.version for swapped in swaps] == ["1.10.0"]
+    # Requests holding the previous entry finish on it
+    assert held.path is None
+    scores = entry.model.predict(np.array([[7.2, 18.0, 1.5, 8.1, 450.0]])).quality_score
+    assert scores.tolist() == [100]
+    assert registry.refresh() == []
+
+def test_replaced_artifact_is_reloaded(registry, tmp_path):
+    path = artifact(tmp_path, "1.0.0", versioned("first"))
+    registry.refresh()
+    artifact(tmp_path, "1.0.0", versioned("second"))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert registry.refresh() == [WATER_QUALITY]
+    assert registry.get(WATER_QUALITY).model.version == "second"
+
+def test_broken_artifact_keeps_the_active_model_and_is_not_retried(registry, tmp_path, monkeypatch):
+    artifact(tmp_path, "1.0.0", versioned("1.0.0"))
+    registry.refresh()
+    artifact(tmp_path, "2.0.0", {"not": "a model"})
+    assert registry.refresh() == []
+    assert registry.get(WATER_QUALITY).version == "1.0.0"
+
+    loads = []
+    monkeypatch.setattr(registry, "load", lambda *args: loads.append(args))
+    assert registry.refresh() == []
+    assert loads == []
@@ -0,0 +1,112 @@
+import uuid
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.models import FEATURE_NAMES
+from app.rollups import DailyRollups, RollupStore, summarize
+
+SENSOR = str(uuid.uuid4())
+JAN_1, JAN_2, JAN_3 = date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 3)
+
+@pytest.fixture
+def store(tmp_path):
+    # A file database, so reads go through their own connection
+    store = RollupStore(f"sqlite:///{tmp_path / 'rollups.db'}")
+    store.ensure_schema()
+    yield store
+    store.close()
+
+def features(*ph) -> np.ndarray:
+    rows = np.full((len(ph), len(FEATURE_NAMES)), 10.0)
+    rows[:, FEATURE_NAMES.index("ph")] = ph
+    return rows
+
+def ph_stats(store, day: date) -> dict:
+    (row,) = store.query(day, day + timedelta(days=1))
+    return summarize(row)["features"]["ph"]
+
+def test_late_readings_are_folded_into_their_day(store):
+    rollups = DailyRollups()
+    rollups.add([SENSOR] * 2, ["2024-01-01T10:00:00", "2024-01-02T10:00:00"], features(7.0, 8.0))
+    assert rollups.flush(store) == 2
+
+    # A reading of the previous day arrives after that day was merged
+    rollups.add([SENSOR], ["2024-01-01T23:59:00+00:00"], features(6.0))
+    assert rollups.flush(store) == 1
+
+    assert ph_stats(store, JAN_1) == {"count": 2, "mean": 6.5, "std": 0.5, "min": 6.0, "max": 7.0}
+    assert ph_stats(store, JAN_2)["count"] == 1
+
+def test_duplicate_readings_are_counted_once(store):
+    rollups = DailyRollups()
+    # Repeated within one batch, and submitted again in a later one
+    rollups.add([SENSOR] * 3, ["2024-01-01T10:00:00", "2024-01-01T10:00:00", "2024-01-01T11:00:00"], features(7.0, 7.0, 9.0))
+    assert rollups.flush(store) == 2
+    rollups.add([SENSOR, SENSOR], ["2024-01-01T11:00:00", "2024-01-01T12:00:00"], features(9.0, 8.0))
+    assert rollups.flush(store) == 1
+
+    assert ph_stats(store, JAN_1) == {"count": 3, "mean": 8.0, "std": 0.8165, "min": 7.0, "max": 9.0}
+
+def test_readings_of_non_uuid_sensors_are_skipped(store):
+    rollups = DailyRollups()
+    rollups.add(["sensor-1", SENSOR], ["2024-01-01T10:00:00"] * 2, features(7.0, 8.0))
+    assert rollups.skipped == 1
+    assert rollups.flush(store) == 1
+
+def create_readings(store, rows):
+    store.write_conn.execute(
+        f"CREATE TABLE sensor.sensor_readings (sensor_id TEXT, timestamp TIMESTAMP, {', '.join(f'{f} REAL' for f in FEATURE_NAMES)})"
+    )
+    store.write_conn.executemany(
+        f"INSERT INTO sensor.sensor_readings VALUES ({', '.join('?' * (len(FEATURE_NAMES) + 2))})", rows
+    )
+    store.write_conn.commit()
+
+def test_backfill_replaces_days_and_claims_their_readings(store):
+    rollups = DailyRollups()
+    rollups.add([SENSOR], ["2024-01-01T10:00:00"], features(5.0))
+    rollups.flush(store)
+    create_readings(store, [
+        (SENSOR, "2024-01-01 10:00:00", 7.0, 10.0, 10.0, 10.0, 10.0),
+        (SENSOR, "2024-01-01 11:00:00", 9.0, 10.0, 10.0, 10.0, None),
+        (SENSOR, "2024-01-02 10:00:00", 8.0, 10.0, 10.0, 10.0, 10.0),
+    ])
+
+    assert store.backfill(JAN_1, JAN_2) == 1
+    stats = ph_stats(store, JAN_1)
+    assert (stats["count"], stats["mean"]) == (2, 8.0)
+    assert store.query(JAN_2, JAN_3) == []
+
+    # Readings of a backfilled day are not counted again when they are submitted later
+    rollups.add([SENSOR], ["2024-01-01T11:00:00"], features(9.0))
+    assert rollups.flush(store) == 0
+    assert ph_stats(store, JAN_1)["count"] == 2
+
+def test_failed_backfill_keeps_the_stored_rollups(store):
+    rollups = DailyRollups()
+    rollups.add([SENSOR], ["2024-01-01T10:00:00"], features(7.0))
+    rollups.flush(store)
+
+    # sensor.sensor_readings does not exist, so the recompute fails after the deletes
+    with pytest.raises(Exception):
+        store.backfill(JAN_1, JAN_2)
+    assert not store.write_conn.in_transaction
+    assert ph_stats(store, JAN_1)["count"] == 1
+
+def test_prune_is_retried_after_a_failed_merge(store, monkeypatch):
+    store.write_conn.execute(
+        "INSERT INTO analytics.rollup_readings (sensor_id, timestamp, claimed_at) VALUES (?, ?, ?)",
+        (SENSOR, "2023-01-01 10:00:00", datetime(2023, 1, 1).isoformat(sep=" ")),
+    )
+    store.write_conn.commit()
+    monkeypatch.setattr(store, "_merge_rows", lambda cursor, rows: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        store.merge(np.array([SENSOR]), np.array(["2024-01-01T10:00"], dtype="datetime64[us]"), features(7.0))
+    assert store._pruned is None
+
+    monkeypatch.undo()
+    store.merge(np.array([SENSOR]), np.array(["2024-01-01T10:00"], dtype="datetime64[us]"), features(7.0))
+    assert store._pruned is not None
+    assert store.read("SELECT COUNT(*) FROM analytics.rollup_readings") == [(1,)]
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from app.timeseries import SeriesCursor, downsample, lttb, minmax
+
+def groups(bucket: np.ndarray):
+    """(start, end) of each run of equal bucket numbers"""
+    starts = np.r_[0, np.flatnonzero(np.diff(bucket)) + 1, len(bucket)].tolist()
+    return list(zip(starts[:-1], starts[1:]))
+
+def reference_lttb(t: np.ndarray, v: np.ndarray, bucket: np.ndarray) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets, one bucket at a time"""
+    runs = groups(bucket)
+    if len(runs) < 3:
+        return np.unique([0, len(t) - 1])
+    picks = [0]
+    for (lo, hi), (next_lo, next_hi) in zip(runs[1:-1], runs[2:]):
+        anchor = picks[-1]
+        next_t, next_v = t[next_lo:next_hi].mean(), v[next_lo:next_hi].mean()
+        areas = [
+            abs((t[anchor] - next_t) * (v[idx] - v[anchor]) - (t[anchor] - t[idx]) * (next_v - v[anchor]))
+            for idx in range(lo, hi)
+        ]
+        picks.append(lo + areas.index(max(areas)))
+    return np.array(picks + [len(t) - 1])
+
+def reference_minmax(t: np.ndarray, v: np.ndarray, bucket: np.ndarray) -> np.ndarray:
+    picks = set()
+    for lo, hi in groups(bucket):
+        values = v[lo:hi].tolist()
+        picks.update([lo + values.index(min(values)), lo + values.index(max(values))])
+    return np.array(sorted(picks), dtype=np.int64)
+
+def random_series(rng, n: int, width: int, integers: bool):
+    t = np.sort(rng.uniform(0, 1000, n))
+    # Small integer values tie often, exercising which maximum is kept
+    v = rng.integers(0, 4, n).astype(np.float64) if integers else rng.normal(size=n).cumsum()
+    return t, v, np.floor(t / (1000 / width)).astype(np.int64)
+
+@pytest.mark.parametrize("seed", range(25))
+def test_lttb_matches_sequential_reference(seed):
+    rng = np.random.default_rng(seed)
+    for n, width, integers in [(2000, 50, False), (300, 100, True), (40, 60, False), (5, 3, True)]:
+        t, v, bucket = random_series(rng, n, width, integers)
+        np.testing.assert_array_equal(lttb(t, v, bucket), reference_lttb(t, v, bucket))
+
+@pytest.mark.parametrize("seed", range(10))
+def test_minmax_matches_per_bucket_extremes(seed):
+    rng = np.random.default_rng(seed)
+    for n, width, integers in [(2000, 50, False), (300, 100, True), (3, 10, False)]:
+        t, v, bucket = random_series(rng, n, width, integers)
+        np.testing.assert_array_equal(minmax(t, v, bucket), reference_minmax(t, v, bucket))
+
+def test_short_and_empty_series():
+    t = np.array([0.0, 1.0, 2.0])
+    for reduce in (lttb, minmax):
+        assert reduce(t[:0], t[:0], t[:0].astype(np.int64)).tolist() == []
+    assert lttb(t, t, np.array([0, 0, 1])).tolist() == [0, 2]
+    assert minmax(t[:1], t[:1], np.array([0])).tolist() == [0]
+
+def test_downsample_drops_missing_values():
+    cursor = SeriesCursor(0.0, 10.0, "minmax", 0.0)
+    t = np.array([1.0, 2.0, 3.0, 11.0])
+    pt, pv = downsample(t, np.array([5.0, np.nan, -1.0, np.nan]), cursor)
+    assert pt.tolist() == [1.0, 3.0] and pv.tolist() == [5.0, -1.0]
+
+def test_cursor_round_trip():
+    cursor = SeriesCursor(1_700_000_000.0, 4.5, "lttb", 1_700_000_090.0)
+    decoded = SeriesCursor.decode(cursor.encode())
+    assert vars(decoded) == vars(cursor)
+    assert decoded.bucket_start(1_700_000_094.0) == 1_700_000_090.0
+
+@pytest.mark.parametrize("token", [
+    "",
+    "not base64!",
+    SeriesCursor(0.0, 0.0, "lttb", 0.0).encode(),
+    SeriesCursor(0.0, 1.0, "average", 0.0).encode(),
+])
+def test_cursor_rejects_foreign_tokens(token):
+    with pytest.raises(ValueError):
+        SeriesCursor.decode(token)
+
+def test_resumed_poll_matches_the_full_series_from_the_open_bucket():
+    rng = np.random.default_rng(7)
+    t = np.sort(rng.uniform(0, 1000, 500))
+    v = rng.normal(size=500)
+    first = SeriesCursor(0.0, 20.0, "minmax", 0.0)
+    # The first poll saw readings up to t=610; the bucket holding it may still grow
+    resumed = SeriesCursor.decode(SeriesCursor(0.0, 20.0, "minmax", first.bucket_start(610.0)).encode())
+    assert resumed.resume_from == 600.0
+
+    full_t, full_v = downsample(t, v, first)
+    later = t >= resumed.resume_from
+    part_t, part_v = downsample(t[later], v[later], resumed)
+    np.testing.assert_array_equal(part_t, full_t[full_t >= resumed.resume_from])
+    np.testing.assert_array_equal(part_v, full_v[full_t >= resumed.resume_from])
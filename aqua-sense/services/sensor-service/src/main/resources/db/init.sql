@@ -133,6 +133,35 @@ CREATE TABLE IF NOT EXISTS alert.alerts (
     metadata JSONB
 );
 
+-- Keep updated_at current: the ML service refreshes its compiled alert rules (and the
+-- sensors, facilities and tenants of its sensor registry) from it
+CREATE OR REPLACE FUNCTION public.touch_updated_at() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS alert_rules_touch_updated_at ON alert.alert_rules;
+CREATE TRIGGER alert_rules_touch_updated_at
+    BEFORE UPDATE ON alert.alert_rules
+    FOR EACH ROW EXECUTE FUNCTION public.touch_updated_at();
+
+-- Analytics Schema Tables
+
+-- ML service scores per reading (written by app.batch_scoring)
+CREATE TABLE IF NOT EXISTS analytics.reading_scores (
+    sensor_id UUID NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    quality_score SMALLINT NOT NULL,
+    quality_level VARCHAR(20) NOT NULL,
+    risk_level VARCHAR(20) NOT NULL,
+    anomaly_flags SMALLINT NOT NULL,
+    model_version VARCHAR(50) NOT NULL,
+    scored_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sensor_id, timestamp)
+);
+
 -- Tenant Schema Tables
 
 CREATE TABLE IF NOT EXISTS tenant.tenants (
@@ -164,7 +193,27 @@ CREATE INDEX idx_sensor_readings_timestamp ON sensor.sensor_readings(timestamp D
 CREATE INDEX idx_alerts_sensor_id ON alert.alerts(sensor_id);
 CREATE INDEX idx_alerts_status ON alert.alerts(status);
 CREATE INDEX idx_alerts_created_at ON alert.alerts(created_at DESC);
+CREATE INDEX idx_alert_rules_updated_at ON alert.alert_rules(updated_at);
 CREATE INDEX idx_facilities_tenant_id ON sensor.facilities(tenant_id);
+CREATE INDEX idx_sensors_updated_at ON sensor.sensors(updated_at);
+CREATE INDEX idx_facilities_updated_at ON sensor.facilities(updated_at);
+CREATE INDEX idx_tenants_updated_at ON tenant.tenants(updated_at);
+
+-- The ML service's sensor registry refreshes from updated_at as well
+DROP TRIGGER IF EXISTS sensors_touch_updated_at ON sensor.sensors;
+CREATE TRIGGER sensors_touch_updated_at
+    BEFORE UPDATE ON sensor.sensors
+    FOR EACH ROW EXECUTE FUNCTION public.touch_updated_at();
+
+DROP TRIGGER IF EXISTS facilities_touch_updated_at ON sensor.facilities;
+CREATE TRIGGER facilities_touch_updated_at
+    BEFORE UPDATE ON sensor.facilities
+    FOR EACH ROW EXECUTE FUNCTION public.touch_updated_at();
+
+DROP TRIGGER IF EXISTS tenants_touch_updated_at ON tenant.tenants;
+CREATE TRIGGER tenants_touch_updated_at
+    BEFORE UPDATE ON tenant.tenants
+    FOR EACH ROW EXECUTE FUNCTION public.touch_updated_at();
 
 -- Insert default roles
 
@@ -291,6 +340,52 @@ LEFT JOIN sensor.facilities f ON s.facility_id = f.id
 LEFT JOIN sensor.sensor_readings sr ON s.id = sr.sensor_id
 GROUP BY s.id, s.sensor_code, s.sensor_type, f.name, s.status;
 
+-- Per-sensor daily sums maintained incrementally by the ML service (ingest path and
+-- backfill job), so dashboards can read daily quality without scanning sensor.sensor_readings
+CREATE TABLE IF NOT EXISTS analytics.daily_rollups (
+    sensor_id UUID NOT NULL,
+    day DATE NOT NULL,
+    ph_count BIGINT NOT NULL DEFAULT 0,
+    ph_sum DOUBLE PRECISION,
+    ph_sumsq DOUBLE PRECISION,
+    ph_min DOUBLE PRECISION,
+    ph_max DOUBLE PRECISION,
+    temperature_count BIGINT NOT NULL DEFAULT 0,
+    temperature_sum DOUBLE PRECISION,
+    temperature_sumsq DOUBLE PRECISION,
+    temperature_min DOUBLE PRECISION,
+    temperature_max DOUBLE PRECISION,
+    turbidity_count BIGINT NOT NULL DEFAULT 0,
+    turbidity_sum DOUBLE PRECISION,
+    turbidity_sumsq DOUBLE PRECISION,
+    turbidity_min DOUBLE PRECISION,
+    turbidity_max DOUBLE PRECISION,
+    dissolved_oxygen_count BIGINT NOT NULL DEFAULT 0,
+    dissolved_oxygen_sum DOUBLE PRECISION,
+    dissolved_oxygen_sumsq DOUBLE PRECISION,
+    dissolved_oxygen_min DOUBLE PRECISION,
+    dissolved_oxygen_max DOUBLE PRECISION,
+    conductivity_count BIGINT NOT NULL DEFAULT 0,
+    conductivity_sum DOUBLE PRECISION,
+    conductivity_sumsq DOUBLE PRECISION,
+    conductivity_min DOUBLE PRECISION,
+    conductivity_max DOUBLE PRECISION,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sensor_id, day)
+);
+
+CREATE INDEX IF NOT EXISTS idx_daily_rollups_day ON analytics.daily_rollups(day);
+
+-- (sensor_id, timestamp) of readings already folded into the rollups, so repeats are not counted twice
+CREATE TABLE IF NOT EXISTS analytics.rollup_readings (
+    sensor_id UUID NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    claimed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sensor_id, timestamp)
+);
+
+CREATE INDEX IF NOT EXISTS idx_rollup_readings_claimed_at ON analytics.rollup_readings(claimed_at);
+
 CREATE OR REPLACE VIEW analytics.daily_water_quality AS
 SELECT 
     date_trunc('day', timestamp) as date,
@@ -305,4 +400,19 @@ SELECT
 FROM sensor.sensor_readings
 GROUP BY date_trunc('day', timestamp), sensor_id;
 
+-- Same columns from the rollups: covers readings scored by the ML service, and days backfilled
+-- with `python -m app.rollups --backfill`
+CREATE OR REPLACE VIEW analytics.daily_rollup_quality AS
+SELECT 
+    day::TIMESTAMP as date,
+    sensor_id,
+    (ph_sum / NULLIF(ph_count, 0))::NUMERIC as avg_ph,
+    (temperature_sum / NULLIF(temperature_count, 0))::NUMERIC as avg_temperature,
+    (turbidity_sum / NULLIF(turbidity_count, 0))::NUMERIC as avg_turbidity,
+    (dissolved_oxygen_sum / NULLIF(dissolved_oxygen_count, 0))::NUMERIC as avg_do,
+    (conductivity_sum / NULLIF(conductivity_count, 0))::NUMERIC as avg_conductivity,
+    ph_min::NUMERIC as min_ph,
+    ph_max::NUMERIC as max_ph
+FROM analytics.daily_rollups;
+
 COMMENT ON DATABASE aquasense IS 'AquaSense Enterprise Water Intelligence Platform Database';